@@ -1,9 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional, List
 from sqlalchemy.orm import Session
 from ..core.database import get_db
 from ..services.client_service import ClientService
 from ..services.message_service import MessageService
 from ..services.pact_service import PactService
+from ..services.analysis_job_service import AnalysisJobService
+from ..services.notification_service import notification_bridge
+from ..services.chat_history_cache import chat_history_cache
+from ..services.llm_usage_service import LLMUsageService
+from ..services.ai.batch_reanalysis import BatchReanalysisService
+from ..models.analysis_job import AnalysisJobStatus
+from ..services.ai import (
+    ClientAnalysisWorkflow,
+    analysis_gate,
+    analysis_result_cache,
+    llm_scheduler,
+    llm_priority,
+    PRIORITY_INTERACTIVE,
+    analysis_telemetry,
+    model_router
+)
 from datetime import datetime, timedelta
 import logging
 
@@ -134,4 +151,206 @@ async def test_pact_connection():
         return {
             "status": "error",
             "message": f"Ошибка: {str(e)}"
-        } 
\ No newline at end of file
+        }
+
+
+@router.post("/analysis/compare/{client_id}")
+def compare_analysis_modes(client_id: int):
+    """Сравнить единый и раздельный режимы AI анализа клиента (без сохранения результатов)"""
+    try:
+        return ClientAnalysisWorkflow.compare_analysis_modes(client_id)
+    except Exception as e:
+        logger.error(f"Ошибка сравнения режимов анализа для клиента {client_id}: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка сравнения режимов анализа")
+
+
+@router.get("/analysis/gate-stats")
+def get_analysis_gate_stats():
+    """Статистика фильтра анализа: сколько запусков агентов пропущено и почему"""
+    return analysis_gate.get_stats()
+
+
+@router.get("/analysis/cache-stats")
+def get_analysis_cache_stats():
+    """Статистика кеша результатов агентов: размер и доля попаданий"""
+    try:
+        return {**analysis_result_cache.get_stats(), "history": chat_history_cache.get_stats()}
+    except Exception as e:
+        logger.error(f"Ошибка получения статистики кеша анализа: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка получения статистики кеша анализа")
+
+@router.delete("/analysis/cache")
+def clear_analysis_cache():
+    """Очистить кеш результатов агентов (например, после изменения промптов)"""
+    deleted = analysis_result_cache.clear()
+    return {"success": True, "deleted": deleted}
+
+
+@router.post("/analysis/run/{client_id}")
+def run_client_analysis(client_id: int):
+    """Ручной AI анализ клиента: все агенты, вызовы LLM в приоритете перед фоновыми"""
+    try:
+        with llm_priority(PRIORITY_INTERACTIVE):
+            return ClientAnalysisWorkflow.analyze_client_complete(client_id, force=True)
+    except Exception as e:
+        logger.error(f"Ошибка ручного анализа клиента {client_id}: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка анализа клиента")
+
+@router.get("/llm/scheduler")
+def get_llm_scheduler_metrics():
+    """Очередь вызовов LLM: глубина, ожидание по приоритетам, загрузка бюджетов RPM/TPM"""
+    return llm_scheduler.get_metrics()
+
+
+@router.get("/analysis/telemetry")
+def get_analysis_telemetry():
+    """Гистограммы длительностей узлов графа и вызовов LLM, итераций и счетчики повторов по агентам"""
+    return analysis_telemetry.get_metrics()
+
+
+@router.delete("/analysis/telemetry")
+def reset_analysis_telemetry():
+    """Сбросить накопленные метрики телеметрии анализа"""
+    analysis_telemetry.reset()
+    return {"success": True}
+
+
+@router.get("/analysis/routing")
+def get_model_routing_stats():
+    """Решения выбора модели агентов и их исходы: успехи, повышения уровня, время и токены"""
+    return model_router.get_stats()
+
+
+@router.get("/analysis/trace/{client_id}")
+def get_last_analysis_trace(client_id: int):
+    """Трасса последнего AI анализа клиента: спаны узлов, вызовов LLM и инструментов"""
+    trace = analysis_telemetry.get_last_trace(client_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Нет трассы анализа для клиента")
+    return trace
+
+
+@router.get("/llm/usage/top-clients")
+def get_llm_top_clients(
+    days: int = Query(30, ge=1, le=365),
+    limit: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db)
+):
+    """Клиенты с наибольшим расходом на LLM за период"""
+    return LLMUsageService.get_top_clients(db, days=days, limit=limit)
+
+
+@router.get("/llm/usage/trend")
+def get_llm_usage_trend(
+    days: int = Query(30, ge=1, le=365),
+    client_id: Optional[int] = Query(None),
+    db: Session = Depends(get_db)
+):
+    """Расход на LLM по дням и агентам, по всем клиентам или по одному"""
+    return LLMUsageService.get_trend(db, days=days, client_id=client_id)
+
+
+@router.get("/llm/budget/{client_id}")
+def get_llm_budget(client_id: int, db: Session = Depends(get_db)):
+    """Месячный бюджет клиента, расход с начала месяца и решение для следующего анализа"""
+    client = ClientService.get_client(db, client_id)
+    if not client:
+        raise HTTPException(status_code=404, detail="Клиент не найден")
+    return {
+        **LLMUsageService.check_budget(db, client),
+        "client_budget_usd": client.llm_monthly_budget_usd,
+        "month_spent_usd": round(LLMUsageService.get_month_spend(db, client_id), 6)
+    }
+
+
+@router.put("/llm/budget/{client_id}")
+def set_llm_budget(
+    client_id: int,
+    budget_usd: Optional[float] = Query(None, ge=0, description="Пусто - общий бюджет из настроек, 0 - без ограничений"),
+    db: Session = Depends(get_db)
+):
+    """Задать месячный бюджет AI анализа клиента"""
+    client = LLMUsageService.set_budget(db, client_id, budget_usd)
+    if not client:
+        raise HTTPException(status_code=404, detail="Клиент не найден")
+    return {"success": True, "client_id": client_id, "budget_usd": client.llm_monthly_budget_usd}
+
+
+@router.post("/analysis/batch")
+def start_batch_reanalysis(
+    provider: Optional[str] = Query(None, description="whatsapp или telegram_personal"),
+    stale_before: Optional[datetime] = Query(None, description="Только клиенты без анализа сообщений после этой даты"),
+    client_ids: Optional[List[int]] = Query(None),
+    limit: Optional[int] = Query(None, ge=1),
+    executor: Optional[str] = Query(None, description="openai или local"),
+    db: Session = Depends(get_db)
+):
+    """Массовый повторный анализ выбранных клиентов через batch файлы (в фоне)"""
+    try:
+        manifest = BatchReanalysisService.create_run(
+            db, provider=provider, stale_before=stale_before, client_ids=client_ids, limit=limit, executor=executor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if manifest["clients_total"]:
+        BatchReanalysisService.start(manifest["run_id"])
+    return manifest
+
+
+@router.get("/analysis/batch")
+def list_batch_reanalysis_runs():
+    """Прогоны массового анализа, новые первыми"""
+    return BatchReanalysisService.list_runs()
+
+
+@router.get("/analysis/batch/{run_id}")
+def get_batch_reanalysis_status(run_id: str):
+    """Прогресс прогона: состояния чанков и клиентов"""
+    status = BatchReanalysisService.get_status(run_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Прогон не найден")
+    return status
+
+
+@router.post("/analysis/batch/{run_id}/resume")
+def resume_batch_reanalysis(run_id: str):
+    """Продолжить прерванный прогон с сохраненного места; неудавшиеся чанки и клиенты выполняются повторно"""
+    if BatchReanalysisService.get_status(run_id) is None:
+        raise HTTPException(status_code=404, detail="Прогон не найден")
+    started = BatchReanalysisService.start(run_id)
+    return {"success": started, "message": "Прогон запущен" if started else "Прогон уже выполняется"}
+
+
+@router.get("/analysis/jobs")
+def get_analysis_jobs(
+    status: Optional[AnalysisJobStatus] = Query(None, description="queued, running, done или failed"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """Очередь отложенного AI анализа: задачи и количество по статусам"""
+    jobs = AnalysisJobService.get_jobs(db, status=status, limit=limit)
+    return {
+        "counts": AnalysisJobService.get_status_counts(db),
+        "jobs": [
+            {
+                "id": job.id,
+                "client_id": job.client_id,
+                "status": job.status.value,
+                "run_after": job.run_after,
+                "attempts": job.attempts,
+                "max_attempts": job.max_attempts,
+                "last_error": job.last_error,
+                "locked_by": job.locked_by,
+                "locked_at": job.locked_at,
+                "created_at": job.created_at,
+                "finished_at": job.finished_at
+            }
+            for job in jobs
+        ]
+    }
+
+
+@router.get("/notifications/metrics")
+def get_notification_metrics():
+    """Доставка WebSocket уведомлений: очередь, пачки, задержка, отброшенные события"""
+    return notification_bridge.get_metrics()
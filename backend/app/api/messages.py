@@ -65,8 +65,8 @@ async def create_message(message: message_schemas.MessageCreate, db: Session = D
         "created_at": created_message.created_at.isoformat()
     })
     
-    # Запускаем анализ через 1 минуту после любого сообщения
-    ClientAnalysisWorkflow.schedule_analysis_after_delay(message.client_id, delay_minutes=0.1)
+    # Планируем анализ после паузы в переписке (см. AnalysisDebouncePolicy)
+    ClientAnalysisWorkflow.schedule_analysis_after_delay(message.client_id)
     
     return created_message
 
@@ -226,8 +226,8 @@ async def _handle_message_webhook(db: Session, event: str, message_data: Dict[st
             # Запускаем AI анализ для входящих сообщений
             if message.sender.value == 'client':
                 try:
-                    # Планируем анализ клиента с небольшой задержкой
-                    ClientAnalysisWorkflow.schedule_analysis_after_delay(message.client_id, delay_minutes=0.1)
+                    # Планируем анализ после паузы в переписке (см. AnalysisDebouncePolicy)
+                    ClientAnalysisWorkflow.schedule_analysis_after_delay(message.client_id)
                 except Exception as e:
                     logger.error(f"Ошибка AI анализа сообщения {message.id}: {e}")
             
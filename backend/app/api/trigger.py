@@ -6,11 +6,25 @@ from ..schemas import trigger as trigger_schemas
 from ..models.trigger import TriggerStatus
 from ..services.trigger_service import TriggerService
 from ..services.google_sheets_service import google_sheets_service
+from ..services.trigger_backtest import trigger_backtester
+from datetime import datetime, timedelta, timezone
 import asyncio
 
 router = APIRouter()
 
 
+def _with_recent_counts(db: Session, triggers: list, schema) -> list:
+    """Ответы по триггерам с числом срабатываний за 30 дней (один агрегатный запрос на список)"""
+    since = datetime.now(timezone.utc) - timedelta(days=30)
+    counts = TriggerService.get_trigger_counts(db, since, [trigger.id for trigger in triggers])
+    return [
+        schema.model_validate(trigger).model_copy(
+            update={"triggers_last_30_days": counts.get(trigger.id, {}).get("fired", 0)}
+        )
+        for trigger in triggers
+    ]
+
+
 @router.get("/", response_model=List[trigger_schemas.TriggerSummary])
 def get_triggers(
     skip: int = 0,
@@ -20,7 +34,7 @@ def get_triggers(
 ):
     """Получить список триггеров"""
     triggers = TriggerService.get_triggers(db, skip=skip, limit=limit, status=status)
-    return triggers
+    return _with_recent_counts(db, triggers, trigger_schemas.TriggerSummary)
 
 
 @router.get("/{trigger_id}", response_model=trigger_schemas.Trigger)
@@ -29,7 +43,7 @@ def get_trigger(trigger_id: int, db: Session = Depends(get_db)):
     trigger = TriggerService.get_trigger(db, trigger_id)
     if not trigger:
         raise HTTPException(status_code=404, detail="Триггер не найден")
-    return trigger
+    return _with_recent_counts(db, [trigger], trigger_schemas.Trigger)[0]
 
 
 @router.post("/", response_model=trigger_schemas.Trigger)
@@ -55,7 +69,7 @@ def update_trigger(
     trigger = TriggerService.update_trigger(db, trigger_id, trigger_update)
     if not trigger:
         raise HTTPException(status_code=404, detail="Триггер не найден")
-    return trigger
+    return _with_recent_counts(db, [trigger], trigger_schemas.Trigger)[0]
 
 
 @router.delete("/{trigger_id}")
@@ -129,10 +143,11 @@ async def test_trigger(
             raise HTTPException(status_code=503, detail="Нет данных из Google Sheets")
     
     # Тестируем триггер
-    matched_cars = []
-    for car in cars:
-        if TriggerService.check_trigger_condition(trigger, car):
-            matched_cars.append(car.to_dict())
+    if car_id:
+        matched_cars = [car.to_dict() for car in cars if TriggerService.check_trigger_condition(trigger, car)]
+    else:
+        inventory = google_sheets_service.get_inventory_index(cars)
+        matched_cars = [car.to_dict() for car in TriggerService.find_matching_cars(trigger, inventory)]
     
     return {
         "trigger_name": trigger.name,
@@ -143,6 +158,45 @@ async def test_trigger(
     }
 
 
+@router.post("/backtest")
+def backtest_triggers(request: trigger_schemas.TriggerBacktestRequest, db: Session = Depends(get_db)):
+    """Оценить триггеры по истории склада: сколько раз и по каким автомобилям они сработали бы
+    
+    Ничего не записывается и действия не выполняются; можно передать сохраненные
+    триггеры (trigger_ids) и несохраненные определения (definitions).
+    """
+    if not request.trigger_ids and not request.definitions:
+        raise HTTPException(status_code=400, detail="Нужно указать trigger_ids или definitions")
+    
+    definitions = []
+    for trigger_id in request.trigger_ids:
+        trigger = TriggerService.get_trigger(db, trigger_id)
+        if not trigger:
+            raise HTTPException(status_code=404, detail=f"Триггер {trigger_id} не найден")
+        definitions.append({
+            "trigger_id": trigger.id,
+            "name": trigger.name,
+            "conditions": trigger.conditions,
+            "events": trigger.events,
+            "cooldown_minutes": trigger.cooldown_minutes
+        })
+    for definition in request.definitions:
+        definitions.append({
+            "trigger_id": None,
+            "name": definition.name,
+            "conditions": definition.conditions.model_dump(exclude_none=True),
+            "events": definition.events,
+            "cooldown_minutes": definition.cooldown_minutes
+        })
+    
+    end = request.end or datetime.now(timezone.utc)
+    start = request.start or end - timedelta(days=7)
+    start, end = (value if value.tzinfo else value.replace(tzinfo=timezone.utc) for value in (start, end))
+    if start >= end:
+        raise HTTPException(status_code=400, detail="Начало периода должно быть раньше конца")
+    return trigger_backtester.run(db, definitions, start, end, sample_size=request.sample_size)
+
+
 @router.get("/{trigger_id}/logs", response_model=List[trigger_schemas.TriggerLog])
 def get_trigger_logs(
     trigger_id: int,
@@ -278,9 +332,10 @@ def search_google_sheets_data(
 def get_system_status(db: Session = Depends(get_db)):
     """Получить общий статус системы триггеров"""
     # Подсчитываем триггеры по статусам
-    active_triggers = len(TriggerService.get_triggers(db, status=TriggerStatus.ACTIVE, limit=1000))
-    inactive_triggers = len(TriggerService.get_triggers(db, status=TriggerStatus.INACTIVE, limit=1000))
-    paused_triggers = len(TriggerService.get_triggers(db, status=TriggerStatus.PAUSED, limit=1000))
+    status_counts = TriggerService.count_triggers_by_status(db)
+    active_triggers = status_counts[TriggerStatus.ACTIVE.value]
+    inactive_triggers = status_counts[TriggerStatus.INACTIVE.value]
+    paused_triggers = status_counts[TriggerStatus.PAUSED.value]
     
     # Проверяем подключение к Google Sheets
     sheets_connected = google_sheets_service.is_connected()
@@ -15,6 +15,106 @@ class Settings(BaseSettings):
     # OpenAI
     openai_api_key: str = ""
     
+    # AI анализ: "per_agent" (три отдельных агента) или "combined" (один вызов на все разделы)
+    analysis_mode: str = os.getenv("ANALYSIS_MODE", "per_agent")
+    
+    # LLM бэкенд агентов: "live", "record" (live + запись кассет), "replay" (кассеты без сети), "fake"
+    llm_backend: str = os.getenv("LLM_BACKEND", "live")
+    llm_cassette_dir: str = os.getenv("LLM_CASSETTE_DIR", "./llm_cassettes")
+    
+    # Выбор модели агента по сложности переписки: "off", "shadow" (только логирование решений) или "on"
+    model_routing_mode: str = os.getenv("MODEL_ROUTING_MODE", "shadow")
+    llm_model_fast: str = os.getenv("LLM_MODEL_FAST", "gpt-4.1-nano")
+    llm_model_strong: str = os.getenv("LLM_MODEL_STRONG", "gpt-4o")
+    model_routing_fast_max_messages: int = int(os.getenv("MODEL_ROUTING_FAST_MAX_MESSAGES", "3"))
+    model_routing_fast_max_chars: int = int(os.getenv("MODEL_ROUTING_FAST_MAX_CHARS", "300"))
+    
+    # Фильтр перед запуском агентов: пропускает анализ для "ок", стикеров и т.п.
+    analysis_gate_enabled: bool = os.getenv("ANALYSIS_GATE_ENABLED", "true").lower() == "true"
+    analysis_gate_model: str = os.getenv("ANALYSIS_GATE_MODEL", "")  # пусто - классификатор отключен
+    analysis_gate_long_text_chars: int = int(os.getenv("ANALYSIS_GATE_LONG_TEXT_CHARS", "80"))
+    
+    # Кеш результатов агентов по хешу истории и текущего состояния клиента
+    analysis_cache_enabled: bool = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+    analysis_cache_ttl_hours: int = int(os.getenv("ANALYSIS_CACHE_TTL_HOURS", "72"))
+    analysis_cache_max_entries: int = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "5000"))
+    
+    # Сколько клиентов держать в кеше отформатированной истории чата
+    chat_history_cache_clients: int = int(os.getenv("CHAT_HISTORY_CACHE_CLIENTS", "500"))
+    
+    # Телеметрия анализа: для скольких клиентов хранить трассу последнего анализа
+    analysis_trace_clients: int = int(os.getenv("ANALYSIS_TRACE_CLIENTS", "500"))
+    
+    # Общий диспетчер вызовов OpenAI: бюджеты в минуту и число одновременных запросов
+    llm_rpm_limit: int = int(os.getenv("LLM_RPM_LIMIT", "500"))
+    llm_tpm_limit: int = int(os.getenv("LLM_TPM_LIMIT", "200000"))
+    llm_max_concurrency: int = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+    llm_rate_limit_pause_seconds: float = float(os.getenv("LLM_RATE_LIMIT_PAUSE_SECONDS", "5"))
+    
+    # Месячный бюджет AI анализа на клиента, USD (0 - без ограничений; можно переопределить у клиента)
+    llm_client_monthly_budget_usd: float = float(os.getenv("LLM_CLIENT_MONTHLY_BUDGET_USD", "0"))
+    # Что делать при превышении: "downgrade" (один объединенный вызов вместо трех агентов) или "skip"
+    llm_budget_exceeded_action: str = os.getenv("LLM_BUDGET_EXCEEDED_ACTION", "downgrade")
+    
+    # Debounce анализа: ждем паузу в переписке, но не дольше max_wait от первого непроанализированного сообщения
+    analysis_debounce_seconds: int = int(os.getenv("ANALYSIS_DEBOUNCE_SECONDS", "120"))
+    analysis_debounce_min_seconds: int = int(os.getenv("ANALYSIS_DEBOUNCE_MIN_SECONDS", "30"))
+    analysis_debounce_max_seconds: int = int(os.getenv("ANALYSIS_DEBOUNCE_MAX_SECONDS", "600"))
+    analysis_max_wait_seconds: int = int(os.getenv("ANALYSIS_MAX_WAIT_SECONDS", "900"))
+    
+    # Очередь отложенного анализа (таблица analysis_jobs)
+    analysis_job_workers: int = int(os.getenv("ANALYSIS_JOB_WORKERS", "2"))
+    analysis_job_poll_seconds: float = float(os.getenv("ANALYSIS_JOB_POLL_SECONDS", "5"))
+    analysis_job_max_attempts: int = int(os.getenv("ANALYSIS_JOB_MAX_ATTEMPTS", "3"))
+    analysis_job_retry_base_seconds: int = int(os.getenv("ANALYSIS_JOB_RETRY_BASE_SECONDS", "60"))
+    analysis_job_lease_minutes: int = int(os.getenv("ANALYSIS_JOB_LEASE_MINUTES", "30"))
+    analysis_job_retention_days: int = int(os.getenv("ANALYSIS_JOB_RETENTION_DAYS", "7"))
+    
+    # Массовый повторный анализ: "openai" (Batch API) или "local" (через LLM_BACKEND, для проверки)
+    batch_reanalysis_executor: str = os.getenv("BATCH_REANALYSIS_EXECUTOR", "openai")
+    batch_reanalysis_dir: str = os.getenv("BATCH_REANALYSIS_DIR", "./batch_reanalysis")
+    batch_reanalysis_chunk_size: int = int(os.getenv("BATCH_REANALYSIS_CHUNK_SIZE", "200"))
+    batch_reanalysis_concurrency: int = int(os.getenv("BATCH_REANALYSIS_CONCURRENCY", "4"))
+    batch_reanalysis_poll_seconds: int = int(os.getenv("BATCH_REANALYSIS_POLL_SECONDS", "60"))
+    # Ночной прогон по клиентам без анализа дольше N дней (0 - отключен)
+    batch_reanalysis_nightly_stale_days: int = int(os.getenv("BATCH_REANALYSIS_NIGHTLY_STALE_DAYS", "0"))
+    
+    # Планировщик триггеров: окно, в котором близкие сроки проверяются одной пачкой,
+    # и как часто перечитывать очередь из БД (изменения из других процессов)
+    trigger_scheduler_batch_window_seconds: float = float(os.getenv("TRIGGER_SCHEDULER_BATCH_WINDOW_SECONDS", "5"))
+    trigger_scheduler_reload_seconds: int = int(os.getenv("TRIGGER_SCHEDULER_RELOAD_SECONDS", "300"))
+    
+    # Действия сработавших триггеров: параллелизм всего запуска и на одного адресата (хост webhook, Telegram),
+    # таймаут попытки и повторы (для webhook можно переопределить в action_config: timeout, retries)
+    trigger_action_concurrency: int = int(os.getenv("TRIGGER_ACTION_CONCURRENCY", "10"))
+    trigger_action_per_target_concurrency: int = int(os.getenv("TRIGGER_ACTION_PER_TARGET_CONCURRENCY", "4"))
+    trigger_action_timeout_seconds: float = float(os.getenv("TRIGGER_ACTION_TIMEOUT_SECONDS", "10"))
+    trigger_action_retries: int = int(os.getenv("TRIGGER_ACTION_RETRIES", "2"))
+    trigger_action_retry_base_seconds: float = float(os.getenv("TRIGGER_ACTION_RETRY_BASE_SECONDS", "1"))
+    
+    # Подавление повторных срабатываний триггера по тому же автомобилю (если у триггера не задан cooldown_minutes)
+    trigger_default_cooldown_minutes: int = int(os.getenv("TRIGGER_DEFAULT_COOLDOWN_MINUTES", "1440"))
+    
+    # Выбор ведущего экземпляра для фоновых задач (проверка триггеров, напоминания, сводки) при нескольких
+    # воркерах/контейнерах: аренда в БД на scheduler_lease_ttl_seconds, продление каждые scheduler_lease_renew_seconds
+    scheduler_leader_election: bool = os.getenv("SCHEDULER_LEADER_ELECTION", "true").lower() == "true"
+    scheduler_lease_ttl_seconds: int = int(os.getenv("SCHEDULER_LEASE_TTL_SECONDS", "30"))
+    scheduler_lease_renew_seconds: int = int(os.getenv("SCHEDULER_LEASE_RENEW_SECONDS", "10"))
+    scheduler_instance_id: Optional[str] = os.getenv("SCHEDULER_INSTANCE_ID")
+    # Проверки триггеров (по сроку и ручные) выполняются по одной во всех экземплярах;
+    # сколько ручная проверка ждет завершения текущей
+    trigger_check_lock_timeout_seconds: int = int(os.getenv("TRIGGER_CHECK_LOCK_TIMEOUT_SECONDS", "300"))
+    
+    # Журнал изменений склада для триггеров: сколько дней хранить события
+    inventory_event_retention_days: int = int(os.getenv("INVENTORY_EVENT_RETENTION_DAYS", "30"))
+    
+    # Снимки склада для бэктеста триггеров: полный снимок раз в inventory_snapshot_base_hours, между ними - изменения
+    inventory_snapshot_base_hours: int = int(os.getenv("INVENTORY_SNAPSHOT_BASE_HOURS", "168"))
+    inventory_snapshot_retention_days: int = int(os.getenv("INVENTORY_SNAPSHOT_RETENTION_DAYS", "90"))
+    
+    # Логи триггеров старше срока сворачиваются в дневные сводки trigger_log_daily (0 - не сворачивать)
+    trigger_log_retention_days: int = int(os.getenv("TRIGGER_LOG_RETENTION_DAYS", "30"))
+    
     # LangSmith (опционально для трейсинга)
     langsmith_tracing: Optional[str] = os.getenv("LANGSMITH_TRACING")
     langsmith_api_key: Optional[str] = os.getenv("LANGSMITH_API_KEY")
@@ -23,6 +123,11 @@ class Settings(BaseSettings):
     langchain_api_key: Optional[str] = os.getenv("LANGCHAIN_API_KEY", os.getenv("LANGSMITH_API_KEY"))
     langchain_project: Optional[str] = os.getenv("LANGCHAIN_PROJECT", "farmer-crm-agents")
     
+    # Доставка WebSocket уведомлений из потоков анализа
+    notification_queue_size: int = int(os.getenv("NOTIFICATION_QUEUE_SIZE", "1000"))
+    notification_batch_window_ms: int = int(os.getenv("NOTIFICATION_BATCH_WINDOW_MS", "50"))
+    notification_batch_max: int = int(os.getenv("NOTIFICATION_BATCH_MAX", "100"))
+    
     # Google Sheets (опционально)
     google_sheets_spreadsheet_id: str = ""
     google_sheets_credentials_file: str = ""
@@ -41,6 +146,8 @@ class Settings(BaseSettings):
 
     class Config:
         env_file = ".env"
+        # Поля model_routing_* - настройки маршрутизации, а не служебные атрибуты pydantic
+        protected_namespaces = ("settings_",)
 
 
 settings = Settings()
\ No newline at end of file
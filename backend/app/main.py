@@ -1,9 +1,17 @@
+import time
+
+# Время импорта приложения для отчета о запуске (до остальных импортов)
+_import_started_at = time.perf_counter()
+
 from contextlib import asynccontextmanager
+from datetime import datetime
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.schedulers.base import STATE_PAUSED
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.cron import CronTrigger
+import asyncio
 import logging
 import atexit
 from .core.database import engine, SessionLocal
@@ -11,6 +19,13 @@ from .models import Client, Message, MessageAttachment, Dossier, CarInterest, Ta
 from .api import api_router
 from .services.trigger_service import TriggerService
 from .services.task_service import TaskService
+from .services.analysis_job_service import analysis_job_workers
+from .services.timer_service import analysis_timers
+from .services.notification_service import notification_bridge
+from .services.trigger_action_dispatcher import trigger_action_dispatcher
+from .services.trigger_scheduler import trigger_scheduler
+from .services.leader_election import scheduler_leader
+from .core.config import settings
 from starlette.middleware.base import BaseHTTPMiddleware
 
 # Настройка логирования для планировщика
@@ -20,6 +35,13 @@ scheduler_logger.setLevel(logging.INFO)
 # Глобальный планировщик
 scheduler = AsyncIOScheduler()
 
+# Отчет о времени запуска: импорт модулей и lifespan до готовности принимать запросы
+startup_report = {
+    "import_seconds": None,
+    "lifespan_seconds": None,
+    "ready_at": None
+}
+
 async def run_trigger_check():
     """Функция для автоматической проверки триггеров"""
     scheduler_logger.info("Запуск автоматической проверки триггеров...")
@@ -65,22 +87,95 @@ async def run_daily_tasks_summary():
     finally:
         db.close()
 
+# Очистка и свертка выполняют тяжелые синхронные запросы к БД - в отдельном потоке,
+# чтобы не останавливать event loop и продление аренды ведущего
+
+def _cleanup_inventory_events():
+    from .services.inventory_change_service import inventory_change_detector
+    
+    db = SessionLocal()
+    try:
+        deleted = inventory_change_detector.cleanup_events(db)
+        scheduler_logger.info(f"Удалено {deleted} старых событий склада")
+        deleted = inventory_change_detector.cleanup_snapshots(db)
+        scheduler_logger.info(f"Удалено {deleted} старых снимков склада")
+    except Exception as e:
+        scheduler_logger.error(f"Ошибка очистки событий склада: {e}")
+    finally:
+        db.close()
+
+async def run_inventory_events_cleanup():
+    """Удаление событий склада старше inventory_event_retention_days и снимков старше inventory_snapshot_retention_days"""
+    await asyncio.to_thread(_cleanup_inventory_events)
+
+def _compact_trigger_logs():
+    db = SessionLocal()
+    try:
+        result = TriggerService.compact_trigger_logs(db)
+        scheduler_logger.info(f"Свернуто {result['logs']} логов триггеров в {result['rollups']} дневных сводок")
+    except Exception as e:
+        db.rollback()
+        scheduler_logger.error(f"Ошибка свертки логов триггеров: {e}")
+    finally:
+        db.close()
+
+async def run_trigger_logs_compaction():
+    """Свертка логов триггеров старше trigger_log_retention_days в дневные сводки"""
+    await asyncio.to_thread(_compact_trigger_logs)
+
+def _cleanup_trigger_cooldowns():
+    from .services.trigger_cooldown_service import trigger_cooldown_cache
+    
+    db = SessionLocal()
+    try:
+        deleted = trigger_cooldown_cache.cleanup(db)
+        scheduler_logger.info(f"Удалено {deleted} истекших записей подавления срабатываний")
+    except Exception as e:
+        db.rollback()
+        scheduler_logger.error(f"Ошибка очистки подавления срабатываний: {e}")
+    finally:
+        db.close()
+
+async def run_trigger_cooldowns_cleanup():
+    """Удаление записей подавления повторных срабатываний, у которых истек cooldown"""
+    await asyncio.to_thread(_cleanup_trigger_cooldowns)
+
+def _start_nightly_reanalysis():
+    from datetime import timedelta
+    from .services.ai.batch_reanalysis import BatchReanalysisService
+    
+    db = SessionLocal()
+    try:
+        stale_before = datetime.utcnow() - timedelta(days=settings.batch_reanalysis_nightly_stale_days)
+        manifest = BatchReanalysisService.create_run(db, stale_before=stale_before)
+        if manifest["clients_total"]:
+            BatchReanalysisService.start(manifest["run_id"])
+        scheduler_logger.info(f"Ночной массовый анализ {manifest['run_id']}: {manifest['clients_total']} клиентов")
+    except Exception as e:
+        scheduler_logger.error(f"Ошибка запуска ночного массового анализа: {e}")
+    finally:
+        db.close()
+
+async def run_nightly_reanalysis():
+    """Ночной массовый анализ клиентов, не анализировавшихся дольше batch_reanalysis_nightly_stale_days"""
+    await asyncio.to_thread(_start_nightly_reanalysis)
+
+async def start_leader_tasks():
+    """Фоновые задачи ведущего экземпляра: проверка триггеров по сроку и задачи APScheduler"""
+    trigger_scheduler.start()
+    scheduler.resume()
+
+async def stop_leader_tasks():
+    scheduler.pause()
+    await trigger_scheduler.stop()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
     # Startup
+    lifespan_started_at = time.perf_counter()
     scheduler_logger.info("Запуск планировщика...")
     
-    # Добавляем задачу проверки триггеров каждые 5 минут
-    scheduler.add_job(
-        run_trigger_check,
-        trigger=IntervalTrigger(minutes=5),
-        id='trigger_check',
-        name='Проверка триггеров каждые 5 минут',
-        replace_existing=True,
-        max_instances=1  # Предотвращаем параллельное выполнение
-    )
-    
     # Добавляем задачу отправки напоминаний о задачах каждые 5 минут
     scheduler.add_job(
         run_task_reminders,
@@ -101,25 +196,84 @@ async def lifespan(app: FastAPI):
         max_instances=1
     )
     
-    # Запускаем планировщик
-    scheduler.start()
-    scheduler_logger.info("Планировщик запущен. Проверка триггеров каждые 5 минут, напоминания о задачах каждые 5 минут, ежедневная сводка в 8:00.")
+    # Очистка журнала событий склада каждый день в 3:00
+    scheduler.add_job(
+        run_inventory_events_cleanup,
+        trigger=CronTrigger(hour=3, minute=0),
+        id='inventory_events_cleanup',
+        name='Очистка событий склада каждый день в 3:00',
+        replace_existing=True,
+        max_instances=1
+    )
     
-    # Запускаем первую проверку сразу (опционально)
-    try:
-        await run_trigger_check()
-        scheduler_logger.info("Первая проверка триггеров выполнена при старте приложения")
-    except Exception as e:
-        scheduler_logger.error(f"Ошибка при первой проверке триггеров: {e}")
+    # Свертка старых логов триггеров в дневные сводки каждый день в 3:30
+    scheduler.add_job(
+        run_trigger_logs_compaction,
+        trigger=CronTrigger(hour=3, minute=30),
+        id='trigger_logs_compaction',
+        name='Свертка логов триггеров каждый день в 3:30',
+        replace_existing=True,
+        max_instances=1
+    )
+    
+    # Очистка истекших записей подавления повторных срабатываний каждый день в 3:45
+    scheduler.add_job(
+        run_trigger_cooldowns_cleanup,
+        trigger=CronTrigger(hour=3, minute=45),
+        id='trigger_cooldowns_cleanup',
+        name='Очистка подавления срабатываний каждый день в 3:45',
+        replace_existing=True,
+        max_instances=1
+    )
+    
+    # Ночной массовый анализ давно не анализированных клиентов (если включен)
+    if settings.batch_reanalysis_nightly_stale_days > 0:
+        scheduler.add_job(
+            run_nightly_reanalysis,
+            trigger=CronTrigger(hour=2, minute=0),
+            id='nightly_reanalysis',
+            name='Ночной массовый анализ клиентов в 2:00',
+            replace_existing=True,
+            max_instances=1
+        )
+    
+    # Триггеры проверяются своим планировщиком по сроку каждого триггера (check_interval_minutes).
+    # Первые проверки (с загрузкой Google Sheets) идут в фоне, приложение принимает запросы не дожидаясь их.
+    # При нескольких экземплярах задачи выполняет только ведущий: остальные держат планировщик на паузе
+    if settings.scheduler_leader_election:
+        scheduler.start(paused=True)
+        scheduler_leader.start(start_leader_tasks, stop_leader_tasks)
+    else:
+        scheduler.start()
+        trigger_scheduler.start()
+    scheduler_logger.info("Планировщик запущен. Проверка триггеров по сроку каждого триггера, напоминания о задачах каждые 5 минут, ежедневная сводка в 8:00.")
+    
+    # Уведомления из потоков анализа доставляются через основной event loop
+    notification_bridge.bind()
+    
+    # Воркеры очереди отложенного AI анализа
+    analysis_job_workers.start()
     
     # Регистрируем обработчик для корректного завершения
     atexit.register(lambda: scheduler.shutdown())
     
+    startup_report["lifespan_seconds"] = round(time.perf_counter() - lifespan_started_at, 3)
+    startup_report["ready_at"] = datetime.now().isoformat()
+    scheduler_logger.info(
+        f"Приложение готово: импорт {startup_report['import_seconds']}с, запуск {startup_report['lifespan_seconds']}с"
+    )
+    
     yield
     
     # Shutdown
     scheduler_logger.info("Остановка планировщика...")
+    # Аренда ведущего освобождается сразу, чтобы задачи без задержки подхватил другой экземпляр
+    await scheduler_leader.stop()
     scheduler.shutdown()
+    await trigger_scheduler.stop()
+    await analysis_job_workers.stop()
+    await notification_bridge.stop()
+    await trigger_action_dispatcher.aclose()
 
 # Создание таблиц теперь происходит через Alembic миграции
 # Запустите: alembic upgrade head
@@ -154,6 +308,8 @@ app.add_middleware(
 # Подключаем роутеры
 app.include_router(api_router, prefix="/api/v1")
 
+startup_report["import_seconds"] = round(time.perf_counter() - _import_started_at, 3)
+
 
 @app.get("/")
 async def root():
@@ -165,12 +321,20 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/health/startup")
+async def startup_status():
+    """Время импорта и запуска приложения"""
+    return startup_report
+
+
 @app.get("/scheduler/status")
 async def scheduler_status():
     """Получить статус планировщика"""
     jobs = scheduler.get_jobs()
     return {
         "running": scheduler.running,
+        "paused": scheduler.state == STATE_PAUSED,
+        "leader": await asyncio.to_thread(scheduler_leader.get_status),
         "jobs_count": len(jobs),
         "jobs": [
             {
@@ -180,7 +344,9 @@ async def scheduler_status():
                 "trigger": str(job.trigger)
             }
             for job in jobs
-        ]
+        ],
+        "trigger_scheduler": trigger_scheduler.get_status(),
+        "analysis_timers": analysis_timers.get_metrics()
     }
 
 
@@ -3,7 +3,12 @@ from .message import Message, MessageAttachment
 from .dossier import Dossier
 from .car_interest import CarInterest
 from .task import Task
-from .trigger import Trigger, TriggerLog
+from .trigger import Trigger, TriggerLog, TriggerLogDaily, TriggerCooldown
 from .settings import Settings, GreetingSettings
+from .analysis_cache import AnalysisCacheEntry
+from .analysis_job import AnalysisJob, AnalysisJobStatus
+from .llm_usage import LLMUsage, LLMUsageDaily
+from .inventory import InventoryCarState, InventoryEvent, InventorySnapshot
+from .scheduler_lease import SchedulerLease
 
-__all__ = ["Client", "Message", "MessageAttachment", "Dossier", "CarInterest", "Settings", "GreetingSettings"]
\ No newline at end of file
+__all__ = ["Client", "Message", "MessageAttachment", "Dossier", "CarInterest", "Settings", "GreetingSettings", "AnalysisCacheEntry", "AnalysisJob", "AnalysisJobStatus", "LLMUsage", "LLMUsageDaily", "InventoryCarState", "InventoryEvent", "InventorySnapshot", "SchedulerLease"]
\ No newline at end of file
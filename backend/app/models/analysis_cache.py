@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, DateTime, JSON
+from sqlalchemy.sql import func
+from ..core.database import Base
+
+
+class AnalysisCacheEntry(Base):
+    """Результат AI агента, сохраненный по хешу входных данных"""
+    __tablename__ = "analysis_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), unique=True, nullable=False, index=True)  # sha256 входных данных агента
+    agent = Column(String, nullable=False, index=True)                        # "dossier", "car_interest", "task", "combined"
+    client_id = Column(Integer, nullable=True, index=True)
+    result = Column(JSON, nullable=False)
+    hit_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_accessed_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
@@ -0,0 +1,53 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text, Enum as SQLEnum, ForeignKey, Index, text
+from sqlalchemy.sql import func
+from ..core.database import Base
+import enum
+
+
+class AnalysisJobStatus(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class AnalysisJob(Base):
+    """Отложенный AI анализ клиента. Переживает рестарт и делится между репликами backend"""
+    __tablename__ = "analysis_jobs"
+    __table_args__ = (
+        # Не больше одной ожидающей задачи на ключ debounce, даже при одновременных webhook.
+        # SQLEnum хранит имя элемента перечисления, поэтому в условии 'QUEUED'
+        Index(
+            "uq_analysis_jobs_queued_debounce_key",
+            "debounce_key",
+            unique=True,
+            postgresql_where=text("status = 'QUEUED'"),
+            sqlite_where=text("status = 'QUEUED'")
+        ),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer, ForeignKey("clients.id"), nullable=False, index=True)
+    
+    # Ключ debounce: новое сообщение переносит run_after уже ожидающей задачи с тем же ключом
+    debounce_key = Column(String, nullable=False, index=True)
+    status = Column(SQLEnum(AnalysisJobStatus), default=AnalysisJobStatus.QUEUED, nullable=False, index=True)
+    run_after = Column(DateTime, nullable=False, index=True)
+    
+    # Поступившие сообщения до запуска: для ограничения максимального ожидания и адаптивной задержки
+    first_requested_at = Column(DateTime, nullable=True)
+    last_requested_at = Column(DateTime, nullable=True)
+    request_count = Column(Integer, default=1, nullable=False)
+    
+    # Повторы с backoff
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    last_error = Column(Text, nullable=True)
+    
+    # Какой воркер взял задачу и когда (для возврата задач упавших реплик)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime, nullable=True)
+    
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime, nullable=True)
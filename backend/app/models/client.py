@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Float
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from ..core.database import Base
@@ -34,6 +34,8 @@ class Client(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     last_message_at = Column(DateTime(timezone=True), nullable=True)
     last_pact_message_id = Column(Integer, nullable=True)
+    last_analyzed_message_id = Column(Integer, nullable=True)  # последнее сообщение, учтенное AI анализом
+    llm_monthly_budget_usd = Column(Float, nullable=True)      # бюджет AI анализа в месяц; null - общий из настроек
     
     # Relationships
     messages = relationship("Message", back_populates="client", order_by="Message.timestamp.desc()")
@@ -0,0 +1,43 @@
+from sqlalchemy import Column, Integer, String, DateTime, Float, Boolean, JSON
+from sqlalchemy.sql import func
+from ..core.database import Base
+
+
+class InventoryCarState(Base):
+    """Последнее известное состояние автомобиля склада для поиска изменений между загрузками"""
+    __tablename__ = "inventory_car_states"
+
+    id = Column(Integer, primary_key=True, index=True)
+    car_id = Column(String, unique=True, nullable=False, index=True)
+    fingerprint = Column(String(40), nullable=False)     # sha1 строки листа
+    price = Column(Float, nullable=True)
+    status = Column(String, nullable=True)
+    data = Column(JSON, nullable=False)                  # CarData.to_dict() на момент последнего изменения
+    first_seen_at = Column(DateTime(timezone=True), server_default=func.now())
+    changed_at = Column(DateTime(timezone=True), server_default=func.now())
+    removed_at = Column(DateTime(timezone=True), nullable=True, index=True)  # нет в последней загрузке
+
+
+class InventoryEvent(Base):
+    """Изменение склада: новый, измененный или пропавший автомобиль (только добавление записей)"""
+    __tablename__ = "inventory_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    car_id = Column(String, nullable=False, index=True)
+    kind = Column(String, nullable=False)                # "new", "changed", "removed"
+    changes = Column(JSON, nullable=True)                # {"price": [было, стало], ...} для "changed"
+    data = Column(JSON, nullable=True)                   # текущее состояние (для "removed" - последнее известное)
+    previous_data = Column(JSON, nullable=True)          # состояние до изменения
+    detected_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+class InventorySnapshot(Base):
+    """Снимок склада для бэктеста триггеров: полный (базовый) или изменения относительно предыдущего"""
+    __tablename__ = "inventory_snapshots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    taken_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    is_base = Column(Boolean, default=False, nullable=False)
+    car_count = Column(Integer, default=0, nullable=False)   # автомобилей на складе после снимка
+    cars = Column(JSON, nullable=False)                    # {car_id: raw_data}: весь склад или новые и измененные
+    removed = Column(JSON, nullable=True)                  # [car_id] пропавших (только для изменений)
@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Integer, String, DateTime, Date, Float, ForeignKey, UniqueConstraint
+from sqlalchemy.sql import func
+from ..core.database import Base
+
+
+class LLMUsage(Base):
+    """Один вызов LLM агентом анализа (только добавление записей)"""
+    __tablename__ = "llm_usage"
+
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer, ForeignKey("clients.id"), nullable=True, index=True)
+    agent = Column(String, nullable=False, index=True)      # "dossier", "car_interest", "task", "combined", "gate"
+    model = Column(String, nullable=False)
+    input_tokens = Column(Integer, default=0, nullable=False)
+    output_tokens = Column(Integer, default=0, nullable=False)
+    cost_usd = Column(Float, default=0.0, nullable=False)   # по таблице цен на момент вызова
+    latency_ms = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+class LLMUsageDaily(Base):
+    """Дневные суммы LLMUsage по клиенту, агенту и модели, обновляются при каждой записи вызова"""
+    __tablename__ = "llm_usage_daily"
+    __table_args__ = (
+        UniqueConstraint("day", "client_id", "agent", "model", name="uq_llm_usage_daily"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False, index=True)
+    client_id = Column(Integer, ForeignKey("clients.id"), nullable=True, index=True)
+    agent = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    calls = Column(Integer, default=0, nullable=False)
+    input_tokens = Column(Integer, default=0, nullable=False)
+    output_tokens = Column(Integer, default=0, nullable=False)
+    cost_usd = Column(Float, default=0.0, nullable=False)
+    latency_ms_total = Column(Integer, default=0, nullable=False)
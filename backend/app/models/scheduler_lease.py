@@ -0,0 +1,13 @@
+from sqlalchemy import Column, String, DateTime
+from ..core.database import Base
+
+
+class SchedulerLease(Base):
+    """Аренда роли ведущего экземпляра: фоновые задачи выполняет только держатель аренды"""
+    __tablename__ = "scheduler_leases"
+
+    name = Column(String, primary_key=True)              # "scheduler"
+    holder = Column(String, nullable=True)               # ID экземпляра (хост:pid:случайный суффикс)
+    acquired_at = Column(DateTime(timezone=True), nullable=True)
+    renewed_at = Column(DateTime(timezone=True), nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=True, index=True)
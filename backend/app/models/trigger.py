@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, JSON, Text, Enum as SQLEnum, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Date, Boolean, JSON, Text, Enum as SQLEnum, ForeignKey, UniqueConstraint
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from ..core.database import Base
@@ -18,6 +18,19 @@ class TriggerAction(enum.Enum):
     WEBHOOK = "webhook"
 
 
+class TriggerEvent(enum.Enum):
+    """События склада, на которые подписывается триггер"""
+    NEW_MATCH = "new_match"            # автомобиль появился или впервые подошел под условия
+    PRICE_DROPPED = "price_dropped"    # подходящий автомобиль подешевел
+    STATUS_CHANGED = "status_changed"  # у подходящего автомобиля сменился статус
+    CHANGED = "changed"                # любое изменение подходящего автомобиля
+    REMOVED = "removed"                # подходивший автомобиль пропал из склада
+
+
+# Подписка триггера без явного списка событий
+DEFAULT_TRIGGER_EVENTS = [TriggerEvent.NEW_MATCH.value]
+
+
 class Trigger(Base):
     __tablename__ = "triggers"
 
@@ -40,6 +53,9 @@ class Trigger(Base):
     #   "status": ["в продаже"]  # статусы
     # }
     
+    # События склада, на которые срабатывает триггер (значения TriggerEvent); None - DEFAULT_TRIGGER_EVENTS
+    events = Column(JSON, nullable=True)
+    
     # Действия при срабатывании
     action_type = Column(SQLEnum(TriggerAction), nullable=False)
     action_config = Column(JSON, nullable=True)
@@ -50,18 +66,24 @@ class Trigger(Base):
     
     # Настройки частоты проверки
     check_interval_minutes = Column(Integer, default=5, nullable=False)  # как часто проверять
+    # Повторное срабатывание по тому же автомобилю подавляется на cooldown_minutes;
+    # None - settings.trigger_default_cooldown_minutes, 0 - без подавления
+    cooldown_minutes = Column(Integer, nullable=True)
     
     # Метаданные
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     last_checked_at = Column(DateTime(timezone=True), nullable=True)
     last_triggered_at = Column(DateTime(timezone=True), nullable=True)
+    # Последнее обработанное событие склада (inventory_events.id); None - триггер еще не проверялся
+    last_event_id = Column(Integer, nullable=True)
     
     # Статистика
     trigger_count = Column(Integer, default=0, nullable=False)  # сколько раз сработал
     
     # Relationships
     trigger_logs = relationship("TriggerLog", back_populates="trigger", cascade="all, delete-orphan")
+    log_rollups = relationship("TriggerLogDaily", back_populates="trigger", cascade="all, delete-orphan")
 
 
 class TriggerLog(Base):
@@ -78,4 +100,36 @@ class TriggerLog(Base):
     error_message = Column(Text, nullable=True)
     
     # Relationships
-    trigger = relationship("Trigger", back_populates="trigger_logs") 
\ No newline at end of file
+    trigger = relationship("Trigger", back_populates="trigger_logs")
+
+
+class TriggerLogDaily(Base):
+    """Дневные суммы срабатываний триггера по логам старше trigger_log_retention_days (сами логи удаляются)"""
+    __tablename__ = "trigger_log_daily"
+    __table_args__ = (
+        UniqueConstraint("trigger_id", "day", name="uq_trigger_log_daily"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    trigger_id = Column(Integer, ForeignKey("triggers.id"), nullable=False, index=True)
+    day = Column(Date, nullable=False, index=True)
+    fired_count = Column(Integer, default=0, nullable=False)
+    success_count = Column(Integer, default=0, nullable=False)
+    failed_count = Column(Integer, default=0, nullable=False)
+    last_triggered_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Relationships
+    trigger = relationship("Trigger", back_populates="log_rollups")
+
+
+class TriggerCooldown(Base):
+    """Время последнего срабатывания триггера по автомобилю для подавления повторов"""
+    __tablename__ = "trigger_cooldowns"
+    __table_args__ = (
+        UniqueConstraint("trigger_id", "car_id", name="uq_trigger_cooldown"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    trigger_id = Column(Integer, ForeignKey("triggers.id"), nullable=False, index=True)
+    car_id = Column(String, nullable=False)
+    last_fired_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import Optional, Dict, Any, List, Union
 from pydantic import BaseModel, Field, field_validator, ConfigDict
-from ..models.trigger import TriggerStatus, TriggerAction
+from ..models.trigger import TriggerStatus, TriggerAction, TriggerEvent
 
 
 class TriggerConditions(BaseModel):
@@ -34,6 +34,18 @@ class TriggerConditions(BaseModel):
         return v
 
 
+def validate_trigger_events(v: Optional[List[str]]) -> Optional[List[str]]:
+    if v is None:
+        return v
+    allowed_events = {event.value for event in TriggerEvent}
+    for event in v:
+        if event not in allowed_events:
+            raise ValueError(f"Неподдерживаемое событие: {event}")
+    if not v:
+        raise ValueError("Нужно указать хотя бы одно событие")
+    return list(dict.fromkeys(v))
+
+
 class TriggerActionConfig(BaseModel):
     """Базовая схема для конфигурации действий триггера"""
     pass
@@ -74,6 +86,8 @@ class WebhookActionConfig(TriggerActionConfig):
     url: str = Field(..., description="URL для webhook")
     method: str = Field(default="POST", description="HTTP метод")
     headers: Optional[Dict[str, str]] = Field(default={}, description="HTTP заголовки")
+    timeout: Optional[float] = Field(None, gt=0, le=60, description="Таймаут попытки в секундах")
+    retries: Optional[int] = Field(None, ge=0, le=5, description="Число повторов при ошибке")
     
     @field_validator('method')
     @classmethod
@@ -89,9 +103,16 @@ class TriggerBase(BaseModel):
     description: Optional[str] = Field(None, description="Описание триггера")
     status: TriggerStatus = Field(default=TriggerStatus.ACTIVE, description="Статус триггера")
     conditions: TriggerConditions = Field(..., description="Условия срабатывания")
+    events: Optional[List[str]] = Field(None, description="События склада: new_match, price_dropped, status_changed, changed, removed")
     action_type: TriggerAction = Field(..., description="Тип действия")
     action_config: Optional[Dict[str, Any]] = Field(None, description="Конфигурация действия")
     check_interval_minutes: int = Field(default=5, ge=1, le=1440, description="Интервал проверки в минутах")
+    cooldown_minutes: Optional[int] = Field(None, ge=0, description="Не повторять срабатывание по тому же автомобилю, минут (0 - без подавления)")
+    
+    @field_validator('events')
+    @classmethod
+    def validate_events(cls, v):
+        return validate_trigger_events(v)
 
 
 class TriggerCreate(TriggerBase):
@@ -103,9 +124,16 @@ class TriggerUpdate(BaseModel):
     description: Optional[str] = None
     status: Optional[TriggerStatus] = None
     conditions: Optional[TriggerConditions] = None
+    events: Optional[List[str]] = None
     action_type: Optional[TriggerAction] = None
     action_config: Optional[Dict[str, Any]] = None
     check_interval_minutes: Optional[int] = Field(None, ge=1, le=1440)
+    cooldown_minutes: Optional[int] = Field(None, ge=0)
+    
+    @field_validator('events')
+    @classmethod
+    def validate_events(cls, v):
+        return validate_trigger_events(v)
 
 
 class TriggerLogBase(BaseModel):
@@ -134,7 +162,8 @@ class Trigger(TriggerBase):
     last_checked_at: Optional[datetime] = None
     last_triggered_at: Optional[datetime] = None
     trigger_count: int
-    trigger_logs: Optional[List[TriggerLog]] = None
+    # Логи не вкладываются в ответ (GET /{trigger_id}/logs), только число срабатываний
+    triggers_last_30_days: int = 0
     
     model_config = ConfigDict(from_attributes=True)
 
@@ -146,7 +175,29 @@ class TriggerSummary(BaseModel):
     status: TriggerStatus
     action_type: TriggerAction
     trigger_count: int
+    triggers_last_30_days: int = 0
     last_triggered_at: Optional[datetime] = None
     created_at: datetime
     
-    model_config = ConfigDict(from_attributes=True) 
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True) 
+
+class TriggerBacktestDefinition(BaseModel):
+    """Определение триггера для бэктеста (например, несохраненная форма)"""
+    name: Optional[str] = None
+    conditions: TriggerConditions = Field(..., description="Условия срабатывания")
+    events: Optional[List[str]] = Field(None, description="События склада: new_match, price_dropped, status_changed, changed, removed")
+    cooldown_minutes: Optional[int] = Field(None, ge=0)
+    
+    @field_validator('events')
+    @classmethod
+    def validate_events(cls, v):
+        return validate_trigger_events(v)
+
+
+class TriggerBacktestRequest(BaseModel):
+    """Бэктест сохраненных триггеров и/или определений по снимкам склада за период"""
+    trigger_ids: List[int] = Field(default_factory=list)
+    definitions: List[TriggerBacktestDefinition] = Field(default_factory=list)
+    start: Optional[datetime] = Field(None, description="Начало периода (по умолчанию 7 дней назад)")
+    end: Optional[datetime] = Field(None, description="Конец периода (по умолчанию сейчас)")
+    sample_size: int = Field(default=10, ge=0, le=100, description="Сколько примеров срабатываний вернуть")
@@ -4,18 +4,36 @@ from .dossier_service import DossierService
 from .task_service import TaskService
 from .trigger_service import TriggerService
 from .google_sheets_service import GoogleSheetsService, google_sheets_service
+from .trigger_engine import InventoryColumns, InventoryIndex, CompiledConditions, trigger_condition_compiler
+from .inventory_change_service import InventoryChangeDetector, inventory_change_detector
+from .trigger_action_dispatcher import TriggerActionDispatcher, trigger_action_dispatcher
+from .trigger_scheduler import TriggerScheduler, trigger_scheduler
+from .trigger_cooldown_service import TriggerCooldownCache, trigger_cooldown_cache
+from .leader_election import LeaderElection, LeaseLock, scheduler_leader, trigger_check_lock
+from .trigger_backtest import InventoryHistory, TriggerBacktester, trigger_backtester
 from .pact_service import PactService
 from .telegram_admin_service import TelegramAdminService
-from .notification_service import NotificationService, notification_service
+from .notification_service import NotificationService, NotificationBridge, notification_service, notification_bridge
 from .timer_service import TimerService, timer_service, analysis_timers
+from .analysis_job_service import AnalysisJobService, AnalysisJobWorkerPool, analysis_job_workers
+from .llm_usage_service import LLMUsageService
 from .ai import ClientAnalysisWorkflow
 
 __all__ = [
     "ClientService", "MessageService", "DossierService", 
     "TaskService", "TriggerService", 
     "GoogleSheetsService", "google_sheets_service", 
+    "InventoryColumns", "InventoryIndex", "CompiledConditions", "trigger_condition_compiler",
+    "InventoryChangeDetector", "inventory_change_detector",
+    "TriggerActionDispatcher", "trigger_action_dispatcher",
+    "TriggerScheduler", "trigger_scheduler",
+    "TriggerCooldownCache", "trigger_cooldown_cache",
+    "LeaderElection", "LeaseLock", "scheduler_leader", "trigger_check_lock",
+    "InventoryHistory", "TriggerBacktester", "trigger_backtester",
     "PactService", "TelegramAdminService",
-    "NotificationService", "notification_service",
+    "NotificationService", "NotificationBridge", "notification_service", "notification_bridge",
     "TimerService", "timer_service", "analysis_timers",
+    "AnalysisJobService", "AnalysisJobWorkerPool", "analysis_job_workers",
+    "LLMUsageService",
     "ClientAnalysisWorkflow"
 ]
\ No newline at end of file
@@ -11,9 +11,22 @@ from .base_agent import BaseAnalysisAgent
 from .dossier_agent import DossierAnalysisAgent, DossierAnalysisState, dossier_agent
 from .car_interest_agent import CarInterestAnalysisAgent, CarInterestAnalysisState, car_interest_agent
 from .task_agent import TaskAnalysisAgent, TaskAnalysisState, task_agent
-from .workflows import ClientAnalysisWorkflow
+from .combined_agent import CombinedAnalysisAgent, CombinedAnalysisState, combined_agent
+from .result_cache import AnalysisResultCache, analysis_result_cache
+from .llm_scheduler import (
+    LLMScheduler,
+    llm_scheduler,
+    llm_priority,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_BACKGROUND
+)
+from .analysis_gate import AnalysisGate, analysis_gate
+from .telemetry import AnalysisTelemetry, analysis_telemetry
+from .model_router import ModelRouter, model_router
+from .workflows import ClientAnalysisWorkflow, ANALYSIS_MODE_PER_AGENT, ANALYSIS_MODE_COMBINED
+from .batch_reanalysis import BatchReanalysisService
 from .schemas import DOSSIER_SCHEMA, TASK_SCHEMA, CAR_INTEREST_SCHEMA
-from .tools import DOSSIER_TOOLS, CAR_INTEREST_TOOLS, TASK_TOOLS
+from .tools import DOSSIER_TOOLS, CAR_INTEREST_TOOLS, TASK_TOOLS, COMBINED_TOOLS
 
 # Импорты из общих сервисов
 from ..notification_service import (
@@ -34,19 +47,50 @@ __all__ = [
     'DossierAnalysisAgent',
     'CarInterestAnalysisAgent', 
     'TaskAnalysisAgent',
+    'CombinedAnalysisAgent',
     
     # Состояния
     'DossierAnalysisState',
     'CarInterestAnalysisState',
     'TaskAnalysisState',
+    'CombinedAnalysisState',
     
     # Экземпляры агентов
     'dossier_agent',
     'car_interest_agent',
     'task_agent',
+    'combined_agent',
     
     # Workflows
     'ClientAnalysisWorkflow',
+    'ANALYSIS_MODE_PER_AGENT',
+    'ANALYSIS_MODE_COMBINED',
+    
+    # Массовый повторный анализ
+    'BatchReanalysisService',
+    
+    # Фильтр перед анализом
+    'AnalysisGate',
+    'analysis_gate',
+    
+    # Кеш результатов агентов
+    'AnalysisResultCache',
+    'analysis_result_cache',
+    
+    # Диспетчер вызовов LLM
+    'LLMScheduler',
+    'llm_scheduler',
+    'llm_priority',
+    'PRIORITY_INTERACTIVE',
+    'PRIORITY_BACKGROUND',
+    
+    # Телеметрия анализа
+    'AnalysisTelemetry',
+    'analysis_telemetry',
+    
+    # Выбор модели агента
+    'ModelRouter',
+    'model_router',
     
     # Схемы
     'DOSSIER_SCHEMA',
@@ -57,6 +101,7 @@ __all__ = [
     'DOSSIER_TOOLS',
     'CAR_INTEREST_TOOLS',
     'TASK_TOOLS',
+    'COMBINED_TOOLS',
     
     # Уведомления (для обратной совместимости)
     'send_dossier_notification',
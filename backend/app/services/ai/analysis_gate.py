@@ -0,0 +1,265 @@
+"""Дешевый фильтр перед запуском агентов: решает, какие агенты нужны для новых сообщений"""
+
+import re
+import threading
+import time
+import logging
+from collections import Counter
+from typing import Dict, Any, List, Optional
+
+from langchain_core.messages import HumanMessage
+
+from ...core.config import settings
+from ...models.message import Message
+from .llm_backends import create_chat_model
+from .llm_scheduler import llm_scheduler, estimate_tokens
+from .telemetry import analysis_telemetry, SPAN_LLM
+from .tools import classify_new_messages
+from ..llm_usage_service import LLMUsageService
+
+logger = logging.getLogger(__name__)
+
+AGENT_DOSSIER = "dossier"
+AGENT_CAR_INTEREST = "car_interest"
+AGENT_TASK = "task"
+ALL_AGENTS = [AGENT_DOSSIER, AGENT_CAR_INTEREST, AGENT_TASK]
+
+# Короткие ответы, которые сами по себе ничего не меняют
+ACK_PHRASES = {
+    "ок", "окей", "ok", "okay", "ага", "угу", "да", "нет", "хорошо", "понял", "поняла", "понятно",
+    "ясно", "спасибо", "спс", "благодарю", "пасиб", "thanks", "thx", "супер", "отлично", "класс",
+    "принято", "договорились", "ладно", "+", "жду", "добрый день", "здравствуйте", "привет",
+    "доброе утро", "добрый вечер", "хорошего дня", "до свидания", "пока"
+}
+
+# Короткие ответы, которые могут подтвердить или отклонить предложение другой стороны
+REPLY_PHRASES = {"ок", "окей", "ok", "okay", "да", "нет", "хорошо", "договорились", "принято", "ладно", "+", "ага", "угу"}
+
+DOSSIER_PATTERN = re.compile(
+    r"(\+?\d[\d\s\-()]{8,}\d|телефон|номер|живу|город|переезж|день рожд|др\b|родил|жена|муж|дет[иья]|сын|доч|"
+    r"собак|кош|хобби|перекуп|перепрод|автосалон|площадк|дилер|подбор|перегон|клиент[ау]? под|бизнес)",
+    re.IGNORECASE
+)
+CAR_INTEREST_PATTERN = re.compile(
+    r"(\$|usd|долл|бюджет|цен|стоимост|\d+\s?к\b|\d{2,3}\s?000|год[ау]?\b|\b(19|20)\d{2}\b|пробег|км\b|миль|"
+    r"цвет|салон|кож|панорам|привод|awd|fwd|rwd|полный|бензин|дизел|гибрид|электр|седан|кроссовер|внедорожник|"
+    r"ищу|нужен|нужна|хочу|интересует|вариант|bmw|бмв|mercedes|мерседес|audi|ауди|toyota|тойот|lexus|лексус|"
+    r"honda|хонд|hyundai|хендай|kia|киа|nissan|ниссан|ford|форд|chevrolet|шевроле|tesla|тесл|porsche|порше|"
+    r"volkswagen|фольксваген|jeep|джип|mazda|мазд|subaru|субару|land rover|range rover)",
+    re.IGNORECASE
+)
+TASK_PATTERN = re.compile(
+    r"(завтра|послезавтра|сегодня|вечер|утр|через\s+\d|недел|месяц|понедельник|вторник|сред[аыу]|четверг|пятниц|"
+    r"суббот|воскресень|\d{1,2}[:.]\d{2}|\d{1,2}\s?(числа|января|февраля|марта|апреля|мая|июня|июля|августа|"
+    r"сентября|октября|ноября|декабря)|созвон|позвон|перезвон|встрет|приед|отправ|пришл|скин|подготов|оплат|"
+    r"договор|документ|напомн|после отпуск|вернусь|отмен|уже не актуальн|купил|передума)",
+    re.IGNORECASE
+)
+
+_NORMALIZE_PATTERN = re.compile(r"[^\w\s+]", re.UNICODE)
+
+
+class AnalysisGate:
+    """Решает, какие агенты запускать для новых сообщений, и собирает статистику пропусков"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._classifier = None
+        self._stats = {
+            "decisions": 0,
+            "skipped_all": 0,
+            "agents_run": Counter(),
+            "agents_skipped": Counter(),
+            "stages": Counter(),
+            "reasons": Counter()
+        }
+
+    @staticmethod
+    def _normalize(text: Optional[str]) -> str:
+        """Текст сообщения без пунктуации, эмодзи и лишних пробелов"""
+        if not text:
+            return ""
+        return " ".join(_NORMALIZE_PATTERN.sub(" ", text.lower()).split())
+
+    @staticmethod
+    def _is_noise(message: Message) -> bool:
+        """Сообщение без смысловой нагрузки: стикер/вложение без текста, знаки без букв и цифр или подтверждение
+        
+        Короткие ответы с цифрами ("30", "5к", "да, 2") - цены и количества, их видят агенты.
+        """
+        normalized = AnalysisGate._normalize(message.content)
+        if not normalized:
+            return True
+        return normalized in ACK_PHRASES or not any(char.isalnum() for char in normalized)
+
+    @staticmethod
+    def _match_agents(text: str) -> set:
+        """Агенты, по ключевым словам которых совпадает текст"""
+        agents = set()
+        if DOSSIER_PATTERN.search(text):
+            agents.add(AGENT_DOSSIER)
+        if CAR_INTEREST_PATTERN.search(text):
+            agents.add(AGENT_CAR_INTEREST)
+        if TASK_PATTERN.search(text):
+            agents.add(AGENT_TASK)
+        return agents
+
+    def decide(self, messages: List[Message], last_analyzed_message_id: Optional[int]) -> Dict[str, Any]:
+        """Определяет агентов для запуска по сообщениям после last_analyzed_message_id
+
+        Args:
+            messages: Полная история чата, упорядоченная по времени
+            last_analyzed_message_id: ID последнего сообщения, учтенного предыдущим анализом
+
+        Returns:
+            {"agents": [...], "stage": "heuristic" | "classifier", "reason": str}
+        """
+        decision = self._decide(messages, last_analyzed_message_id)
+        self._record(decision)
+        logger.info(f"Фильтр анализа: агенты {decision['agents'] or 'не нужны'} ({decision['stage']}: {decision['reason']})")
+        return decision
+
+    def _decide(self, messages: List[Message], last_analyzed_message_id: Optional[int]) -> Dict[str, Any]:
+        if not settings.analysis_gate_enabled:
+            return {"agents": list(ALL_AGENTS), "stage": "disabled", "reason": "фильтр отключен"}
+
+        if last_analyzed_message_id is None:
+            return {"agents": list(ALL_AGENTS), "stage": "heuristic", "reason": "первый анализ клиента"}
+
+        new_start = next((i for i, msg in enumerate(messages) if msg.id > last_analyzed_message_id), None)
+        if new_start is None:
+            return {"agents": [], "stage": "heuristic", "reason": "нет новых сообщений"}
+
+        new_messages = messages[new_start:]
+        previous = messages[new_start - 1] if new_start > 0 else None
+
+        agents = set()
+        uncertain_texts = []
+        for msg in new_messages:
+            if self._is_noise(msg):
+                # Короткое "да"/"нет" отвечает на предыдущее сообщение другой стороны и наследует его тему
+                normalized = self._normalize(msg.content)
+                if (normalized in REPLY_PHRASES and previous is not None
+                        and previous.sender != msg.sender and previous.content):
+                    agents.update(self._match_agents(previous.content))
+                previous = msg
+                continue
+
+            text = msg.content or ""
+            if msg.sender.value == "farmer":
+                # Сообщения фермера не несут данных о клиенте, но фиксируют обещания менеджера
+                agents.add(AGENT_TASK)
+            elif len(text) >= settings.analysis_gate_long_text_chars:
+                agents.update(ALL_AGENTS)
+            else:
+                matched = self._match_agents(text)
+                if matched:
+                    agents.update(matched)
+                else:
+                    uncertain_texts.append(text)
+            previous = msg
+
+        if uncertain_texts and not agents.issuperset(ALL_AGENTS):
+            classified = self._classify(new_messages)
+            if classified is not None:
+                agents.update(classified)
+                return {"agents": [a for a in ALL_AGENTS if a in agents], "stage": "classifier",
+                        "reason": "неоднозначные сообщения"}
+            # Без классификатора лучше запустить лишнее, чем потерять обновление
+            return {"agents": list(ALL_AGENTS), "stage": "heuristic", "reason": "неоднозначные сообщения"}
+
+        if not agents:
+            return {"agents": [], "stage": "heuristic", "reason": "только подтверждения, стикеры и вложения"}
+
+        return {"agents": [a for a in ALL_AGENTS if a in agents], "stage": "heuristic", "reason": "ключевые слова"}
+
+    def _get_classifier(self):
+        """Ленивая инициализация маленькой модели-классификатора для выбранного LLM_BACKEND"""
+        if self._classifier is None:
+            self._classifier = create_chat_model(settings.analysis_gate_model, [classify_new_messages])
+        return self._classifier
+
+    def _classify(self, new_messages: List[Message]) -> Optional[set]:
+        """Спрашивает быструю модель, какие разделы затрагивают новые сообщения. None - классификатор недоступен"""
+        if not settings.analysis_gate_model:
+            return None
+
+        conversation = "\n".join(
+            f"{'КЛИЕНТ' if msg.sender.value == 'client' else 'ФЕРМЕР'}: {msg.content or f'[{msg.content_type.upper()}]'}"
+            for msg in new_messages
+        )
+        prompt = (
+            "Ты классифицируешь новые сообщения из переписки автодилера с клиентом. "
+            "Отметь вызовом classify_new_messages, какие разделы CRM могут измениться из-за этих сообщений: "
+            "досье клиента, автомобильные интересы, задачи менеджера. Если сомневаешься - отмечай раздел.\n\n"
+            f"Новые сообщения:\n{conversation}"
+        )
+        messages = [HumanMessage(content=prompt)]
+        estimated = estimate_tokens(messages)
+        timing = {}
+
+        def invoke():
+            started = time.perf_counter()
+            response = self._get_classifier().invoke(messages)
+            timing["latency_ms"] = int((time.perf_counter() - started) * 1000)
+            return response
+
+        with analysis_telemetry.span(SPAN_LLM, "llm_call", agent="analysis_gate", model=settings.analysis_gate_model,
+                                     estimated_tokens=estimated) as span:
+            try:
+                response = llm_scheduler.call(invoke, estimated)
+            except Exception as e:
+                logger.error(f"Ошибка классификатора фильтра анализа: {e}")
+                span["error"] = str(e)
+                return None
+
+            usage_metadata = getattr(response, "usage_metadata", None) or {}
+            span["input_tokens"] = usage_metadata.get("input_tokens", 0)
+            span["output_tokens"] = usage_metadata.get("output_tokens", 0)
+            LLMUsageService.record_call(
+                new_messages[0].client_id, "analysis_gate", settings.analysis_gate_model,
+                span["input_tokens"], span["output_tokens"], timing.get("latency_ms", 0)
+            )
+
+        args = next(
+            (tool_call["args"] for tool_call in getattr(response, "tool_calls", None) or []
+             if tool_call["name"] == classify_new_messages.name),
+            None
+        )
+        if args is None:
+            logger.warning("Классификатор фильтра анализа не вызвал classify_new_messages")
+            return None
+        return {agent for agent in ALL_AGENTS if args.get(agent)}
+
+    def _record(self, decision: Dict[str, Any]) -> None:
+        with self._lock:
+            self._stats["decisions"] += 1
+            if not decision["agents"]:
+                self._stats["skipped_all"] += 1
+            for agent in ALL_AGENTS:
+                if agent in decision["agents"]:
+                    self._stats["agents_run"][agent] += 1
+                else:
+                    self._stats["agents_skipped"][agent] += 1
+            self._stats["stages"][decision["stage"]] += 1
+            self._stats["reasons"][decision["reason"]] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика решений фильтра с момента запуска процесса"""
+        with self._lock:
+            decisions = self._stats["decisions"]
+            agent_runs_possible = decisions * len(ALL_AGENTS)
+            agents_skipped_total = sum(self._stats["agents_skipped"].values())
+            return {
+                "decisions": decisions,
+                "skipped_all": self._stats["skipped_all"],
+                "agents_run": dict(self._stats["agents_run"]),
+                "agents_skipped": dict(self._stats["agents_skipped"]),
+                "agent_skip_rate": round(agents_skipped_total / agent_runs_possible, 3) if agent_runs_possible else 0.0,
+                "stages": dict(self._stats["stages"]),
+                "reasons": dict(self._stats["reasons"])
+            }
+
+
+# Глобальный экземпляр фильтра
+analysis_gate = AnalysisGate()
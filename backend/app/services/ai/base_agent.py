@@ -2,17 +2,23 @@
 
 import os
 import logging
+import threading
 import time
 from datetime import datetime
 from typing import Dict, Any, List, TypedDict, Optional, Literal
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, AIMessage, ToolMessage
-from langchain_openai import ChatOpenAI
-from langgraph.graph import StateGraph, END
+from langchain_core.messages import BaseMessage, SystemMessage, AIMessage, ToolMessage
 from sqlalchemy.orm import Session
 
 from ...core.config import settings
 from ...core.database import SessionLocal
 from ...models.message import Message
+from ..chat_history_cache import chat_history_cache
+from ..llm_usage_service import LLMUsageService
+from .result_cache import analysis_result_cache
+from .llm_scheduler import llm_scheduler, estimate_tokens
+from .llm_backends import create_chat_model
+from .telemetry import analysis_telemetry, SPAN_AGENT, SPAN_NODE, SPAN_LLM, SPAN_TOOLS
+from .model_router import model_router
 
 logger = logging.getLogger(__name__)
 
@@ -30,24 +36,56 @@ if settings.langchain_api_key and settings.langchain_tracing_v2:
 class BaseAnalysisAgent:
     """Базовый класс для всех агентов анализа"""
     
+    # Максимальное количество итераций agent_loop для безопасности
+    max_iterations = 10
+    
+    # Имя агента для кеша и статистики
+    agent_name = "base"
+    model_name = "gpt-4o-mini"
+    # Увеличивать при изменении промпта или инструментов, чтобы не брать старые результаты из кеша
+    prompt_version = "1"
+    
     def __init__(self, tools: List, state_class):
         self.tools = tools
         self.state_class = state_class
-        self.llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            api_key=settings.openai_api_key,
-            temperature=0.3  # Низкая температура для предсказуемого вызова tools
-        ).bind_tools(self.tools)
-        self.graph = self._create_graph()
+        # LLM клиенты (по модели) и граф создаются при первом анализе, чтобы импорт модуля не тормозил старт приложения
+        self._llms: Dict[str, Any] = {}
+        self._graph = None
+        self._init_lock = threading.Lock()
+    
+    @property
+    def llm(self):
+        return self.get_llm(self.model_name)
+    
+    def get_llm(self, model_name: str):
+        """LLM клиент для модели, выбранной маршрутизатором"""
+        llm = self._llms.get(model_name)
+        if llm is None:
+            with self._init_lock:
+                llm = self._llms.get(model_name)
+                if llm is None:
+                    # live / record / replay / fake - см. llm_backends
+                    llm = self._llms[model_name] = create_chat_model(model_name, self.tools)
+        return llm
+    
+    @property
+    def graph(self):
+        if self._graph is None:
+            with self._init_lock:
+                if self._graph is None:
+                    self._graph = self._create_graph()
+        return self._graph
     
-    def _create_graph(self) -> StateGraph:
+    def _create_graph(self):
         """Создает граф для tool calling агента"""
+        from langgraph.graph import StateGraph, END
+        
         workflow = StateGraph(self.state_class)
         
-        # Добавляем узлы
-        workflow.add_node("prepare_context", self._prepare_context)
-        workflow.add_node("agent_loop", self._agent_loop)  # Основной цикл агента
-        workflow.add_node("process_updates", self._process_updates)
+        # Добавляем узлы (каждый узел замеряется спаном телеметрии)
+        workflow.add_node("prepare_context", self._traced_node("prepare_context", self._prepare_context))
+        workflow.add_node("agent_loop", self._traced_node("agent_loop", self._agent_loop))  # Основной цикл агента
+        workflow.add_node("process_updates", self._traced_node("process_updates", self._process_updates))
         
         # Определяем последовательность
         workflow.set_entry_point("prepare_context")
@@ -57,6 +95,72 @@ class BaseAnalysisAgent:
         
         return workflow.compile()
     
+    def _traced_node(self, name: str, node):
+        """Оборачивает узел графа в спан телеметрии"""
+        def traced(state):
+            with analysis_telemetry.span(SPAN_NODE, name, agent=self.agent_name) as span:
+                errors_before = len(state.get("errors", []))
+                result = node(state)
+                new_errors = result.get("errors", [])[errors_before:] if isinstance(result, dict) else []
+                if new_errors:
+                    span["error"] = "; ".join(new_errors)
+                return result
+        return traced
+    
+    def _run_graph(self, initial_state, chat_messages: Optional[List[Message]] = None,
+                   last_analyzed_message_id: Optional[int] = None) -> dict:
+        """Запуск графа на модели от маршрутизатора; при неудаче на младшей модели - повтор на старшей
+        
+        last_analyzed_message_id передает вызывающий (клиент уже загружен в workflow) - по нему
+        маршрутизатор отделяет новые сообщения без отдельного запроса к БД.
+        """
+        decision = model_router.route(
+            self.agent_name, self.model_name, initial_state["client_id"], chat_messages or [], last_analyzed_message_id
+        )
+        tier = decision["tier"]
+        model = decision["model"]
+        usage_total: Dict[str, int] = {}
+        
+        while True:
+            # Каждой попытке - свои контейнеры (errors, usage, updates ...); сами сообщения истории
+            # не копируются: они общие с кешем истории чата и графом не изменяются
+            run_state = {
+                key: value.copy() if isinstance(value, (list, dict)) else value
+                for key, value in initial_state.items()
+            }
+            run_state["model"] = model
+            started = time.perf_counter()
+            result = self._invoke_graph(run_state, model)
+            duration_ms = (time.perf_counter() - started) * 1000
+            
+            for key, value in result.get("usage", {}).items():
+                usage_total[key] = usage_total.get(key, 0) + value
+            
+            next_tier = model_router.next_tier(decision, tier, result)
+            model_router.record_outcome(decision, tier, model, result, duration_ms, escalated=next_tier is not None)
+            if next_tier is None:
+                # Токены всех попыток, чтобы учет стоимости не терял повторы
+                result["usage"] = usage_total
+                # Модель, на которой получен принятый результат (для кеша результатов)
+                result["model"] = model
+                return result
+            
+            logger.warning(f"Агент {self.agent_name} для клиента {initial_state['client_id']}: повтор на уровне {next_tier} после {tier}")
+            tier = next_tier
+            model = model_router.tier_model(tier, self.model_name)
+    
+    def _invoke_graph(self, state, model: str) -> dict:
+        """Запуск графа агента в спане телеметрии с итогами по токенам и итерациям"""
+        with analysis_telemetry.analysis(state["client_id"]):
+            with analysis_telemetry.span(SPAN_AGENT, "total", agent=self.agent_name, model=model) as span:
+                result = self.graph.invoke(state)
+                usage = result.get("usage", {})
+                span.update(usage)
+                if result.get("errors"):
+                    span["error"] = "; ".join(result["errors"])
+                analysis_telemetry.increment(self.agent_name, "input_tokens", usage.get("input_tokens", 0))
+                analysis_telemetry.increment(self.agent_name, "output_tokens", usage.get("output_tokens", 0))
+                return result
     
     def _agent_loop(self, state) -> dict:
         """Основной цикл агента для tool calling с retry логикой"""
@@ -72,19 +176,20 @@ class BaseAnalysisAgent:
                 SystemMessage(content=system_prompt)
             ]
             
-            # Максимальное количество итераций для безопасности
-            max_iterations = 10
+            max_iterations = self.max_iterations
             iteration = 0
             
-            # Флаг завершения (когда вызван confirm_all)
+            # Флаг завершения (когда вызваны нужные confirm_all)
             is_confirmed = False
+            confirmed_tools = set()
+            validation_retries = 0
             
             while iteration < max_iterations and not is_confirmed:
                 iteration += 1
-                logger.info(f"Итерация {iteration} для клиента {client_id}")
+                logger.debug(f"Итерация {iteration} для клиента {client_id}")
                 
                 # Вызываем LLM с retry логикой
-                response = self._invoke_llm_with_retry(messages)
+                response = self._invoke_llm_with_retry(messages, client_id=client_id, model=state.get("model"))
                 if response is None:
                     error_msg = "Не удалось получить ответ от LLM после нескольких попыток"
                     logger.error(error_msg)
@@ -92,16 +197,21 @@ class BaseAnalysisAgent:
                     break
                     
                 messages.append(response)
+                self._accumulate_usage(state, response)
                 
                 # Проверяем, есть ли tool calls
                 if hasattr(response, "tool_calls") and response.tool_calls:
                     # Проверяем, есть ли confirm_all среди вызовов
                     for tool_call in response.tool_calls:
                         if tool_call["name"].startswith("confirm_all"):
-                            is_confirmed = True
+                            confirmed_tools.add(tool_call["name"])
+                    is_confirmed = self._confirmation_reached(confirmed_tools)
                     
                     # Выполняем tool calls с обработкой ошибок
-                    tool_results = self._execute_tool_calls_with_retry(state, response.tool_calls)
+                    with analysis_telemetry.span(SPAN_TOOLS, "tool_calls", agent=self.agent_name,
+                                                 iteration=iteration, count=len(response.tool_calls),
+                                                 tools=[tool_call["name"] for tool_call in response.tool_calls]):
+                        tool_results = self._execute_tool_calls_with_retry(state, response.tool_calls)
                     
                     # Добавляем результаты в историю
                     messages.extend(tool_results)
@@ -115,6 +225,7 @@ class BaseAnalysisAgent:
                     
                     if has_validation_errors and iteration < max_iterations - 1:
                         logger.info(f"Обнаружены ошибки валидации, даем агенту возможность исправить")
+                        validation_retries += 1
                         continue
                     
                     # Если не подтверждено, продолжаем цикл
@@ -128,6 +239,11 @@ class BaseAnalysisAgent:
             # Сохраняем финальную историю сообщений
             state["messages"] = messages
             
+            state.setdefault("usage", {})["validation_retries"] = validation_retries
+            analysis_telemetry.record_iterations(self.agent_name, iteration)
+            analysis_telemetry.increment(self.agent_name, "validation_retries", validation_retries)
+            logger.info(f"Агент {self.agent_name} для клиента {client_id}: итераций {iteration}, исправлений после ошибок валидации {validation_retries}")
+            
             if iteration >= max_iterations:
                 error_msg = f"Достигнут лимит итераций ({max_iterations})"
                 logger.error(error_msg)
@@ -140,40 +256,99 @@ class BaseAnalysisAgent:
         
         return state
     
-    def _format_chat_messages(self, chat_messages: List[Message]) -> List[BaseMessage]:
-        """Форматирует сообщения чата с временными метками и указанием отправителя"""
-        formatted_messages = []
-        for msg in chat_messages:
-            timestamp = msg.timestamp.strftime("%Y-%m-%d %H:%M:%S") if msg.timestamp else "unknown"
-            sender = "human" if msg.sender.value == "client" else "assistant"
-            sender_label = "КЛИЕНТ" if msg.sender.value == "client" else "ФЕРМЕР"
-            
-            if msg.content_type != "text":
-                content = f"[{timestamp}] [{sender_label}] [{msg.content_type.upper()}] {msg.content}"
-            else:
-                content = f"[{timestamp}] [{sender_label}] {msg.content}"
-            
-            if sender == "human":
-                formatted_messages.append(HumanMessage(content=content))
-            else:
-                formatted_messages.append(AIMessage(content=content))
+    def _confirmation_reached(self, confirmed_tools: set) -> bool:
+        """Достаточно ли вызванных confirm_all для завершения цикла"""
+        return bool(confirmed_tools)
+    
+    @staticmethod
+    def _accumulate_usage(state, response) -> None:
+        """Суммирует использование токенов из ответа LLM в state["usage"]"""
+        usage_metadata = getattr(response, "usage_metadata", None) or {}
+        usage = state.setdefault("usage", {})
+        usage["llm_calls"] = usage.get("llm_calls", 0) + 1
+        usage["input_tokens"] = usage.get("input_tokens", 0) + usage_metadata.get("input_tokens", 0)
+        usage["output_tokens"] = usage.get("output_tokens", 0) + usage_metadata.get("output_tokens", 0)
+        usage["tool_calls"] = usage.get("tool_calls", 0) + len(getattr(response, "tool_calls", None) or [])
+    
+    def _cache_key(self, client_id: int, formatted_messages: List[BaseMessage]) -> str:
+        """Ключ кеша: история чата и текущее состояние клиента, которое увидит агент"""
+        db = SessionLocal()
+        try:
+            context = self._load_context(db, client_id)
+        finally:
+            db.close()
+        return analysis_result_cache.make_key(
+            self.agent_name, self.model_name, self.prompt_version, formatted_messages, context
+        )
+    
+    def _get_cached(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Результат из кеша без вызова LLM"""
+        cached = analysis_result_cache.get(cache_key, self.agent_name)
+        if cached is None:
+            return None
+        analysis_telemetry.increment(self.agent_name, "cache_hits")
+        return {**cached, "usage": {"llm_calls": 0, "input_tokens": 0, "output_tokens": 0, "cache_hits": 1}, "cached": True}
+    
+    def _store_cached(self, cache_key: str, client_id: int, result: Dict[str, Any], model: Optional[str] = None) -> None:
+        """Кешируются только завершенные без ошибок результаты модели агента
         
-        return formatted_messages
+        Ключ строится по model_name до маршрутизации, поэтому результат быстрой или
+        старшей модели под ним отдавался бы запросам уровня default - такие не кешируются.
+        """
+        if model is not None and model != self.model_name:
+            return
+        if result["confirmed"] and not result["errors"]:
+            analysis_result_cache.put(cache_key, self.agent_name, client_id, {
+                key: value for key, value in result.items() if key != "usage"
+            })
     
-    def _invoke_llm_with_retry(self, messages: List[BaseMessage], max_retries: int = 3) -> Optional[AIMessage]:
-        """Вызывает LLM с retry логикой для обработки временных ошибок"""
-        for attempt in range(max_retries):
-            try:
-                response = self.llm.invoke(messages)
-                return response
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    wait_time = 2 ** attempt  # Экспоненциальная задержка: 1, 2, 4 секунды
-                    logger.warning(f"Ошибка вызова LLM (попытка {attempt + 1}/{max_retries}): {e}. Повтор через {wait_time}с")
-                    time.sleep(wait_time)
-                else:
-                    logger.error(f"Не удалось вызвать LLM после {max_retries} попыток: {e}")
-                    return None
+    def _format_chat_messages(self, chat_messages: List[Message]) -> List[BaseMessage]:
+        """Форматирует сообщения чата с временными метками и указанием отправителя (общий кеш истории)"""
+        return chat_history_cache.get_agent_messages(chat_messages)
+    
+    def _invoke_llm_with_retry(self, messages: List[BaseMessage], max_retries: int = 3,
+                               client_id: Optional[int] = None, model: Optional[str] = None) -> Optional[AIMessage]:
+        """Вызывает LLM через общий диспетчер с retry логикой для обработки временных ошибок
+        
+        Успешный вызов записывается в журнал использования LLM (токены, стоимость, задержка).
+        """
+        model = model or self.model_name
+        llm = self.get_llm(model)
+        estimated = estimate_tokens(messages)
+        timing = {}
+        
+        def invoke():
+            # Задержка самого запроса к модели, без ожидания в очереди диспетчера
+            started = time.perf_counter()
+            response = llm.invoke(messages)
+            timing["latency_ms"] = int((time.perf_counter() - started) * 1000)
+            return response
+        
+        with analysis_telemetry.span(SPAN_LLM, "llm_call", agent=self.agent_name, model=model,
+                                     estimated_tokens=estimated) as span:
+            for attempt in range(max_retries):
+                span["attempts"] = attempt + 1
+                try:
+                    response = llm_scheduler.call(invoke, estimated)
+                    usage_metadata = getattr(response, "usage_metadata", None) or {}
+                    span["input_tokens"] = usage_metadata.get("input_tokens", 0)
+                    span["output_tokens"] = usage_metadata.get("output_tokens", 0)
+                    span["tool_calls"] = len(getattr(response, "tool_calls", None) or [])
+                    LLMUsageService.record_call(
+                        client_id, self.agent_name, model,
+                        span["input_tokens"], span["output_tokens"], timing.get("latency_ms", 0)
+                    )
+                    return response
+                except Exception as e:
+                    analysis_telemetry.increment(self.agent_name, "llm_retries")
+                    if attempt < max_retries - 1:
+                        wait_time = 2 ** attempt  # Экспоненциальная задержка: 1, 2, 4 секунды
+                        logger.warning(f"Ошибка вызова LLM (попытка {attempt + 1}/{max_retries}): {e}. Повтор через {wait_time}с")
+                        time.sleep(wait_time)
+                    else:
+                        logger.error(f"Не удалось вызвать LLM после {max_retries} попыток: {e}")
+                        span["error"] = str(e)
+                        return None
         return None
     
     def _execute_tool_calls_with_retry(self, state, tool_calls) -> List[ToolMessage]:
@@ -253,6 +428,11 @@ class BaseAnalysisAgent:
         return tool_messages
     
     # Абстрактные методы которые должны быть реализованы в подклассах
+    @staticmethod
+    def _load_context(db: Session, client_id: int) -> Dict[str, Any]:
+        """Загрузка текущего состояния клиента из БД - должен быть реализован в подклассе"""
+        raise NotImplementedError
+    
     def _prepare_context(self, state) -> dict:
         """Подготовка контекста - должен быть реализован в подклассе"""
         raise NotImplementedError
@@ -265,6 +445,7 @@ class BaseAnalysisAgent:
         """Генерация system prompt - должен быть реализован в подклассе"""
         raise NotImplementedError
     
-    def analyze(self, client_id: int, client_name: str, chat_messages: List[Message]) -> Dict[str, Any]:
+    def analyze(self, client_id: int, client_name: str, chat_messages: List[Message],
+                last_analyzed_message_id: Optional[int] = None) -> Dict[str, Any]:
         """Базовый метод анализа - должен быть переопределен в подклассе"""
         raise NotImplementedError 
\ No newline at end of file
@@ -0,0 +1,646 @@
+"""Массовый повторный AI анализ клиентов (например, после изменения промптов)
+
+Вместо поклиентного ClientAnalysisWorkflow используется путь на пропускную способность:
+- один запрос на клиента: промпт единого агента, все вызовы инструментов одним ответом
+  (tool_choice="required"), без цикла агента;
+- запросы упаковываются в JSONL файлы формата OpenAI Batch API по чанкам;
+- файл исполняет OpenAI Batch API ("openai") или локальный исполнитель ("local"),
+  который прогоняет запросы через текущий LLM_BACKEND с ограниченной параллельностью;
+- результаты применяются теми же методами ClientAnalysisWorkflow, что и обычный анализ.
+
+Прогресс хранится в каталоге прогона (manifest.json и состояние каждого чанка), поэтому
+прерванный прогон продолжается с места остановки, а уже примененные клиенты не
+обрабатываются повторно. При продолжении неудавшиеся чанки возвращаются к последнему
+сохраненному состоянию, а неудавшиеся клиенты - в ожидание и отправляются заново.
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, BaseMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from sqlalchemy import or_
+from sqlalchemy.orm import Session, aliased
+
+from ...core.config import settings
+from ...core.database import SessionLocal
+from ...models.client import Client
+from ...models.message import Message
+from ..message_service import MessageService
+from ..llm_usage_service import LLMUsageService
+from ..chat_history_cache import chat_history_cache
+from .combined_agent import combined_agent, REQUIRED_CONFIRMATIONS
+from .llm_backends import create_chat_model
+from .llm_scheduler import llm_scheduler, estimate_tokens, PRIORITY_BACKGROUND
+from .tools import COMBINED_TOOLS
+from .workflows import ClientAnalysisWorkflow
+
+logger = logging.getLogger(__name__)
+
+BATCH_EXECUTOR_LOCAL = "local"
+BATCH_EXECUTOR_OPENAI = "openai"
+
+# Состояния чанка: pending -> built -> submitted -> completed -> applied
+CHUNK_PENDING = "pending"
+CHUNK_BUILT = "built"
+CHUNK_SUBMITTED = "submitted"
+CHUNK_COMPLETED = "completed"
+CHUNK_APPLIED = "applied"
+CHUNK_FAILED = "failed"
+
+# Состояния клиента в чанке
+CLIENT_PENDING = "pending"
+CLIENT_APPLIED = "applied"
+CLIENT_SKIPPED = "skipped"
+CLIENT_FAILED = "failed"
+
+_RUN_ID_PATTERN = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9a-f]{6}$")
+
+# Скидка OpenAI Batch API к обычной цене токенов
+OPENAI_BATCH_PRICE_FACTOR = 0.5
+
+STRUCTURED_OUTPUT_INSTRUCTION = """
+
+=============================================================================
+## РЕЖИМ ОДНОГО ОТВЕТА
+=============================================================================
+Результаты инструментов тебе не вернутся. Верни ВСЕ вызовы инструментов одним ответом:
+сначала изменения по каждой части, затем все три подтверждения
+`confirm_all_dossier()`, `confirm_all_car_interests()` и `confirm_all_tasks()`.
+"""
+
+
+class BatchExpiredError(RuntimeError):
+    """Batch завершился без результата (failed, expired, cancelled) - чанк нужно отправить заново"""
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    """Атомарная запись файла состояния: прерывание не оставляет его наполовину записанным"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _message_to_openai(message: BaseMessage) -> Dict[str, Any]:
+    if isinstance(message, SystemMessage):
+        role = "system"
+    elif isinstance(message, HumanMessage):
+        role = "user"
+    else:
+        role = "assistant"
+    return {"role": role, "content": message.content}
+
+
+def _message_from_openai(message: Dict[str, Any]) -> BaseMessage:
+    message_classes = {"system": SystemMessage, "user": HumanMessage, "assistant": AIMessage}
+    return message_classes[message["role"]](content=message["content"] or "")
+
+
+class LocalBatchExecutor:
+    """Исполнение batch файла на месте через текущий LLM_BACKEND (live / replay / fake)
+
+    Выходной файл в формате OpenAI Batch API, поэтому разбор результатов общий
+    для обоих исполнителей. Параллельность ограничена batch_reanalysis_concurrency,
+    вызовы идут через llm_scheduler с фоновым приоритетом.
+    """
+
+    name = BATCH_EXECUTOR_LOCAL
+    price_factor = 1.0
+
+    def __init__(self):
+        self._llm = None
+        self._lock = threading.Lock()
+
+    @property
+    def llm(self):
+        with self._lock:
+            if self._llm is None:
+                self._llm = create_chat_model(combined_agent.model_name, COMBINED_TOOLS)
+            return self._llm
+
+    def _execute_line(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        messages = [_message_from_openai(message) for message in request["body"]["messages"]]
+        try:
+            response = llm_scheduler.call(
+                lambda: self.llm.invoke(messages), estimate_tokens(messages), priority=PRIORITY_BACKGROUND
+            )
+        except Exception as e:
+            return {"custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}}
+
+        usage_metadata = getattr(response, "usage_metadata", None) or {}
+        return {
+            "custom_id": request["custom_id"],
+            "response": {
+                "status_code": 200,
+                "body": {
+                    "model": request["body"]["model"],
+                    "choices": [{
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": response.content or None,
+                            "tool_calls": [
+                                {
+                                    "id": tool_call.get("id"),
+                                    "type": "function",
+                                    "function": {
+                                        "name": tool_call["name"],
+                                        "arguments": json.dumps(tool_call["args"], ensure_ascii=False)
+                                    }
+                                }
+                                for tool_call in (response.tool_calls or [])
+                            ]
+                        }
+                    }],
+                    "usage": {
+                        "prompt_tokens": usage_metadata.get("input_tokens", 0),
+                        "completion_tokens": usage_metadata.get("output_tokens", 0)
+                    }
+                }
+            },
+            "error": None
+        }
+
+    def submit(self, input_path: str, output_path: str) -> str:
+        """Выполняет все запросы файла и сразу пишет выходной файл"""
+        with open(input_path, encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+
+        with ThreadPoolExecutor(max_workers=settings.batch_reanalysis_concurrency,
+                                thread_name_prefix="batch-reanalysis") as executor:
+            results = list(executor.map(self._execute_line, requests))
+
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, output_path)
+        return "local"
+
+    def wait(self, handle: str, output_path: str) -> None:
+        if not os.path.exists(output_path):
+            raise RuntimeError(f"Нет результата локального исполнения: {output_path}")
+
+
+class OpenAIBatchExecutor:
+    """Исполнение через OpenAI Batch API: отдельный лимит, окно 24 часа, половина цены"""
+
+    name = BATCH_EXECUTOR_OPENAI
+    price_factor = OPENAI_BATCH_PRICE_FACTOR
+
+    def __init__(self):
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(api_key=settings.openai_api_key)
+        return self._client
+
+    def submit(self, input_path: str, output_path: str) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"source": "batch_reanalysis"}
+        )
+        logger.info(f"Отправлен OpenAI batch {batch.id} ({input_path})")
+        return batch.id
+
+    def wait(self, handle: str, output_path: str) -> None:
+        """Ждет завершения batch и скачивает результат (и ошибки) в output_path"""
+        while True:
+            batch = self.client.batches.retrieve(handle)
+            if batch.status == "completed":
+                break
+            if batch.status in ("failed", "expired", "cancelled"):
+                raise BatchExpiredError(f"OpenAI batch {handle} завершился со статусом {batch.status}")
+            time.sleep(settings.batch_reanalysis_poll_seconds)
+
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.append(self.client.files.content(file_id).text.strip())
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(line for line in lines if line) + "\n")
+        os.replace(tmp_path, output_path)
+
+
+class BatchReanalysisService:
+    """Создание, выполнение и статус прогонов массового анализа"""
+
+    _running: Dict[str, threading.Thread] = {}
+    _running_lock = threading.Lock()
+
+    @staticmethod
+    def _run_dir(run_id: str) -> str:
+        if not _RUN_ID_PATTERN.match(run_id):
+            raise ValueError(f"Некорректный ID прогона: {run_id}")
+        return os.path.join(settings.batch_reanalysis_dir, run_id)
+
+    @staticmethod
+    def _chunk_path(run_id: str, index: int, suffix: str) -> str:
+        return os.path.join(BatchReanalysisService._run_dir(run_id), f"chunk_{index:04d}{suffix}")
+
+    @staticmethod
+    def _create_executor(name: str):
+        if name == BATCH_EXECUTOR_LOCAL:
+            return LocalBatchExecutor()
+        if name == BATCH_EXECUTOR_OPENAI:
+            return OpenAIBatchExecutor()
+        raise ValueError(f"Неизвестный исполнитель batch анализа: {name}")
+
+    @staticmethod
+    def select_clients(db: Session, provider: Optional[str] = None, stale_before: Optional[datetime] = None,
+                       client_ids: Optional[List[int]] = None, limit: Optional[int] = None) -> List[int]:
+        """ID клиентов с сообщениями: все, по провайдеру, по списку или не анализированные с даты
+
+        stale_before: клиенты без анализа или у которых последнее учтенное анализом
+        сообщение старше этой даты
+        """
+        query = db.query(Client.id).filter(Client.last_message_at.isnot(None))
+        if provider:
+            query = query.filter(Client.provider == provider)
+        if client_ids:
+            query = query.filter(Client.id.in_(client_ids))
+        if stale_before:
+            analyzed_message = aliased(Message)
+            query = query.outerjoin(analyzed_message, analyzed_message.id == Client.last_analyzed_message_id).filter(
+                or_(Client.last_analyzed_message_id.is_(None), analyzed_message.timestamp < stale_before)
+            )
+        query = query.order_by(Client.id)
+        if limit:
+            query = query.limit(limit)
+        return [row.id for row in query.all()]
+
+    @staticmethod
+    def create_run(db: Session, provider: Optional[str] = None, stale_before: Optional[datetime] = None,
+                   client_ids: Optional[List[int]] = None, limit: Optional[int] = None,
+                   executor: Optional[str] = None) -> Dict[str, Any]:
+        """Выбирает клиентов и сохраняет прогон, разбитый на чанки; запросы строятся при выполнении"""
+        executor = executor or settings.batch_reanalysis_executor
+        BatchReanalysisService._create_executor(executor)  # проверка имени исполнителя
+
+        selected = BatchReanalysisService.select_clients(db, provider, stale_before, client_ids, limit)
+        run_id = datetime.utcnow().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        run_dir = BatchReanalysisService._run_dir(run_id)
+        os.makedirs(run_dir, exist_ok=True)
+
+        chunk_size = settings.batch_reanalysis_chunk_size
+        chunks = [selected[start:start + chunk_size] for start in range(0, len(selected), chunk_size)]
+        for index, chunk_clients in enumerate(chunks):
+            _write_json(BatchReanalysisService._chunk_path(run_id, index, ".json"), {
+                "index": index,
+                "status": CHUNK_PENDING,
+                "handle": None,
+                "error": None,
+                "clients": {str(client_id): {"status": CLIENT_PENDING} for client_id in chunk_clients}
+            })
+
+        manifest = {
+            "run_id": run_id,
+            "created_at": datetime.utcnow().isoformat(),
+            "executor": executor,
+            "model": combined_agent.model_name,
+            "prompt_version": combined_agent.prompt_version,
+            "selection": {
+                "provider": provider,
+                "stale_before": stale_before.isoformat() if stale_before else None,
+                "client_ids": client_ids,
+                "limit": limit
+            },
+            "clients_total": len(selected),
+            "chunks_total": len(chunks),
+            "status": "created",
+            "finished_at": None
+        }
+        _write_json(os.path.join(run_dir, "manifest.json"), manifest)
+        logger.info(f"Создан прогон массового анализа {run_id}: {len(selected)} клиентов, {len(chunks)} чанков")
+        return manifest
+
+    @staticmethod
+    def _build_request(db: Session, client_id: int) -> Optional[Dict[str, Any]]:
+        """Строка batch файла для клиента; None если у клиента нет сообщений"""
+        client = db.query(Client).filter(Client.id == client_id).first()
+        if not client:
+            return None
+        chat_messages = MessageService.get_chat_history(db, client_id)
+        if not chat_messages:
+            return None
+
+        client_name = client.name or f"ID {client.pact_conversation_id}"
+        state = {"client_name": client_name, **combined_agent._load_context(db, client_id)}
+        system_prompt = combined_agent._generate_system_prompt(state) + STRUCTURED_OUTPUT_INSTRUCTION
+        messages = chat_history_cache.get_agent_messages(chat_messages) + [SystemMessage(content=system_prompt)]
+
+        return {
+            "custom_id": f"client-{client_id}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": combined_agent.model_name,
+                "temperature": 0.3,
+                "messages": [_message_to_openai(message) for message in messages],
+                "tools": [convert_to_openai_tool(tool) for tool in COMBINED_TOOLS],
+                "tool_choice": "required",
+                "parallel_tool_calls": True
+            },
+            "last_message_id": max(msg.id for msg in chat_messages)
+        }
+
+    @staticmethod
+    def _build_chunk(run_id: str, chunk: Dict[str, Any]) -> None:
+        """Пишет входной JSONL чанка; last_message_id запоминается для отметки анализа"""
+        input_path = BatchReanalysisService._chunk_path(run_id, chunk["index"], ".input.jsonl")
+        db = SessionLocal()
+        try:
+            with open(input_path, "w", encoding="utf-8") as f:
+                for client_id, client_state in chunk["clients"].items():
+                    if client_state["status"] != CLIENT_PENDING:
+                        continue
+                    request = BatchReanalysisService._build_request(db, int(client_id))
+                    if request is None:
+                        client_state["status"] = CLIENT_SKIPPED
+                        continue
+                    client_state["last_message_id"] = request.pop("last_message_id")
+                    f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        finally:
+            db.close()
+
+    @staticmethod
+    def _parse_output_line(line: Dict[str, Any]) -> Dict[str, Any]:
+        """Разбирает ответ batch в AIMessage с tool_calls и usage"""
+        if line.get("error") or not line.get("response") or line["response"].get("status_code") != 200:
+            error = line.get("error") or (line.get("response") or {}).get("body")
+            raise RuntimeError(f"Ошибка запроса в batch: {error}")
+
+        body = line["response"]["body"]
+        message = body["choices"][0]["message"]
+        tool_calls = []
+        for tool_call in message.get("tool_calls") or []:
+            try:
+                args = json.loads(tool_call["function"]["arguments"] or "{}")
+            except json.JSONDecodeError:
+                args = None
+            tool_calls.append({
+                "name": tool_call["function"]["name"],
+                "args": args,
+                "id": tool_call.get("id")
+            })
+        usage = body.get("usage") or {}
+        return {
+            "tool_calls": tool_calls,
+            "model": body.get("model") or combined_agent.model_name,
+            "input_tokens": usage.get("prompt_tokens", 0),
+            "output_tokens": usage.get("completion_tokens", 0)
+        }
+
+    @staticmethod
+    def _validate_tool_calls(tool_calls: List[Dict[str, Any]], errors: List[str]) -> List[Dict[str, Any]]:
+        """Проверяет аргументы схемами инструментов; без цикла агента некорректные вызовы отбрасываются"""
+        tools_map = {tool.name: tool for tool in COMBINED_TOOLS}
+        valid = []
+        for tool_call in tool_calls:
+            tool = tools_map.get(tool_call["name"])
+            if tool is None or tool_call["args"] is None:
+                errors.append(f"Некорректный вызов инструмента {tool_call['name']}")
+                continue
+            try:
+                tool_result = str(tool.invoke(tool_call["args"]))
+            except Exception as e:
+                errors.append(f"Ошибка валидации в {tool_call['name']}: {e}")
+                continue
+            if tool_result.startswith("Ошибка"):
+                errors.append(tool_result)
+                continue
+            valid.append(tool_call)
+        return valid
+
+    @staticmethod
+    def _apply_client(db: Session, client_id: int, parsed: Dict[str, Any], last_message_id: Optional[int]) -> Dict[str, Any]:
+        """Применяет результат клиента через сервисы, как обычный единый анализ"""
+        client = db.query(Client).filter(Client.id == client_id).first()
+        if not client:
+            raise RuntimeError(f"Клиент {client_id} не найден")
+        client_name = client.name or f"ID {client.pact_conversation_id}"
+
+        errors: List[str] = []
+        tool_calls = BatchReanalysisService._validate_tool_calls(parsed["tool_calls"], errors)
+
+        # Разбор тем же кодом, что и в едином агенте, по текущему состоянию клиента
+        state = {
+            "messages": [AIMessage(content="", tool_calls=tool_calls)],
+            **combined_agent._load_context(db, client_id)
+        }
+        combined_agent._process_updates(state)
+        confirmed_tools = {tool_call["name"] for tool_call in tool_calls} & REQUIRED_CONFIRMATIONS
+
+        results: Dict[str, Any] = {}
+        ClientAnalysisWorkflow._apply_dossier_result(db, client_id, client_name, state["dossier_result"], results)
+        ClientAnalysisWorkflow._apply_car_interest_result(db, client_id, client_name, state["car_interest_result"], results)
+        ClientAnalysisWorkflow._apply_task_result(db, client_id, client_name, state["task_result"], results)
+
+        # Анализ засчитывается только при всех трех подтверждениях; новые сообщения после построения
+        # запроса остаются непроанализированными
+        if confirmed_tools == REQUIRED_CONFIRMATIONS and last_message_id and (
+                client.last_analyzed_message_id is None or client.last_analyzed_message_id < last_message_id):
+            client.last_analyzed_message_id = last_message_id
+            db.commit()
+
+        if errors:
+            results["errors"] = errors
+        results["confirmed"] = sorted(confirmed_tools)
+        return results
+
+    @staticmethod
+    def _apply_chunk(run_id: str, chunk: Dict[str, Any], executor) -> None:
+        """Применяет выходной файл чанка, сохраняя состояние после каждого клиента"""
+        chunk_path = BatchReanalysisService._chunk_path(run_id, chunk["index"], ".json")
+        output_path = BatchReanalysisService._chunk_path(run_id, chunk["index"], ".output.jsonl")
+        with open(output_path, encoding="utf-8") as f:
+            lines = {line["custom_id"]: line for line in (json.loads(raw) for raw in f if raw.strip())}
+
+        for client_id, client_state in chunk["clients"].items():
+            if client_state["status"] != CLIENT_PENDING:
+                continue
+            line = lines.get(f"client-{client_id}")
+            db = SessionLocal()
+            try:
+                if line is None:
+                    raise RuntimeError("нет ответа в результате batch")
+                parsed = BatchReanalysisService._parse_output_line(line)
+                LLMUsageService.record(
+                    db, int(client_id), "batch", parsed["model"],
+                    parsed["input_tokens"], parsed["output_tokens"], 0,
+                    price_factor=executor.price_factor
+                )
+                results = BatchReanalysisService._apply_client(
+                    db, int(client_id), parsed, client_state.get("last_message_id")
+                )
+                client_state["status"] = CLIENT_APPLIED
+                client_state["errors"] = results.get("errors")
+            except Exception as e:
+                db.rollback()
+                logger.error(f"Массовый анализ {run_id}: ошибка клиента {client_id}: {e}")
+                client_state["status"] = CLIENT_FAILED
+                client_state["error"] = str(e)
+            finally:
+                db.close()
+            _write_json(chunk_path, chunk)
+
+    @staticmethod
+    def _run_chunk(run_id: str, chunk: Dict[str, Any], executor) -> None:
+        """Доводит чанк до applied, продолжая с сохраненного состояния"""
+        chunk_path = BatchReanalysisService._chunk_path(run_id, chunk["index"], ".json")
+        input_path = BatchReanalysisService._chunk_path(run_id, chunk["index"], ".input.jsonl")
+        output_path = BatchReanalysisService._chunk_path(run_id, chunk["index"], ".output.jsonl")
+
+        if chunk["status"] == CHUNK_PENDING:
+            BatchReanalysisService._build_chunk(run_id, chunk)
+            chunk["status"] = CHUNK_BUILT
+            _write_json(chunk_path, chunk)
+
+        if chunk["status"] == CHUNK_BUILT:
+            chunk["handle"] = executor.submit(input_path, output_path)
+            chunk["status"] = CHUNK_SUBMITTED
+            _write_json(chunk_path, chunk)
+
+        if chunk["status"] == CHUNK_SUBMITTED:
+            executor.wait(chunk["handle"], output_path)
+            chunk["status"] = CHUNK_COMPLETED
+            _write_json(chunk_path, chunk)
+
+        if chunk["status"] == CHUNK_COMPLETED:
+            BatchReanalysisService._apply_chunk(run_id, chunk, executor)
+            chunk["status"] = CHUNK_APPLIED
+            _write_json(chunk_path, chunk)
+
+    @staticmethod
+    def _reset_failed(chunk: Dict[str, Any]) -> bool:
+        """Подготовить чанк к продолжению: вернуть неудавшиеся чанк и клиентов в работу
+        
+        Чанк возвращается к состоянию, на котором произошла ошибка (BUILT или SUBMITTED
+        с сохраненным handle), а после завершившегося без результата batch - к BUILT.
+        Неудавшиеся клиенты снова ожидают; чанк с ними строится заново только из
+        ожидающих клиентов, уже примененные не отправляются повторно.
+        """
+        failed_clients = [
+            client_state for client_state in chunk["clients"].values()
+            if client_state["status"] == CLIENT_FAILED
+        ]
+        if chunk["status"] != CHUNK_FAILED and not failed_clients:
+            return False
+
+        if chunk["status"] == CHUNK_FAILED:
+            chunk["status"] = chunk.pop("failed_status", CHUNK_PENDING)
+            chunk.pop("error", None)
+        for client_state in failed_clients:
+            client_state["status"] = CLIENT_PENDING
+            client_state.pop("error", None)
+        if failed_clients and chunk["status"] in (CHUNK_COMPLETED, CHUNK_APPLIED):
+            chunk["status"] = CHUNK_PENDING
+            chunk.pop("handle", None)
+        return True
+
+    @staticmethod
+    def run(run_id: str) -> Dict[str, Any]:
+        """Выполняет (или продолжает) прогон; ошибка чанка не останавливает остальные"""
+        manifest_path = os.path.join(BatchReanalysisService._run_dir(run_id), "manifest.json")
+        manifest = _read_json(manifest_path)
+        executor = BatchReanalysisService._create_executor(manifest["executor"])
+
+        manifest["status"] = "running"
+        _write_json(manifest_path, manifest)
+
+        for index in range(manifest["chunks_total"]):
+            chunk_path = BatchReanalysisService._chunk_path(run_id, index, ".json")
+            chunk = _read_json(chunk_path)
+            if BatchReanalysisService._reset_failed(chunk):
+                _write_json(chunk_path, chunk)
+            if chunk["status"] == CHUNK_APPLIED:
+                continue
+            try:
+                BatchReanalysisService._run_chunk(run_id, chunk, executor)
+            except Exception as e:
+                logger.error(f"Массовый анализ {run_id}: ошибка чанка {index}: {e}")
+                # Состояние меняется только после успешного шага - это последнее сохраненное
+                chunk["failed_status"] = CHUNK_BUILT if isinstance(e, BatchExpiredError) else chunk["status"]
+                chunk["status"] = CHUNK_FAILED
+                chunk["error"] = str(e)
+                _write_json(chunk_path, chunk)
+            logger.info(f"Массовый анализ {run_id}: чанк {index + 1}/{manifest['chunks_total']} - {chunk['status']}")
+
+        manifest["status"] = "finished"
+        manifest["finished_at"] = datetime.utcnow().isoformat()
+        _write_json(manifest_path, manifest)
+        return BatchReanalysisService.get_status(run_id)
+
+    @staticmethod
+    def start(run_id: str) -> bool:
+        """Запуск прогона в фоновом потоке; False если он уже выполняется"""
+        with BatchReanalysisService._running_lock:
+            thread = BatchReanalysisService._running.get(run_id)
+            if thread is not None and thread.is_alive():
+                return False
+            thread = threading.Thread(
+                target=BatchReanalysisService.run, args=(run_id,),
+                name=f"batch-reanalysis-{run_id}", daemon=True
+            )
+            BatchReanalysisService._running[run_id] = thread
+            thread.start()
+            return True
+
+    @staticmethod
+    def get_status(run_id: str) -> Optional[Dict[str, Any]]:
+        """Манифест прогона со счетчиками чанков и клиентов по состояниям"""
+        if not _RUN_ID_PATTERN.match(run_id):
+            return None
+        manifest_path = os.path.join(BatchReanalysisService._run_dir(run_id), "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        manifest = _read_json(manifest_path)
+
+        chunk_counts: Dict[str, int] = {}
+        client_counts: Dict[str, int] = {}
+        for index in range(manifest["chunks_total"]):
+            chunk = _read_json(BatchReanalysisService._chunk_path(run_id, index, ".json"))
+            chunk_counts[chunk["status"]] = chunk_counts.get(chunk["status"], 0) + 1
+            for client_state in chunk["clients"].values():
+                client_counts[client_state["status"]] = client_counts.get(client_state["status"], 0) + 1
+
+        thread = BatchReanalysisService._running.get(run_id)
+        return {
+            **manifest,
+            "active": bool(thread and thread.is_alive()),
+            "chunks": chunk_counts,
+            "clients": client_counts
+        }
+
+    @staticmethod
+    def list_runs() -> List[Dict[str, Any]]:
+        if not os.path.isdir(settings.batch_reanalysis_dir):
+            return []
+        runs = []
+        for run_id in sorted(os.listdir(settings.batch_reanalysis_dir), reverse=True):
+            manifest_path = os.path.join(settings.batch_reanalysis_dir, run_id, "manifest.json")
+            if os.path.exists(manifest_path):
+                runs.append(_read_json(manifest_path))
+        return runs
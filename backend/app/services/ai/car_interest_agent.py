@@ -5,6 +5,8 @@ import logging
 from datetime import datetime
 from typing import Dict, Any, List, TypedDict, Optional
 
+from sqlalchemy.orm import Session
+
 from ...core.database import SessionLocal
 from ...models.car_interest import CarInterest
 from ...models.message import Message
@@ -24,14 +26,29 @@ class CarInterestAnalysisState(TypedDict):
     updates: Dict[str, Any]
     confirmed: bool
     errors: List[str]
+    usage: Dict[str, int]
+    model: str  # модель запуска, выбранная маршрутизатором
 
 
 class CarInterestAnalysisAgent(BaseAnalysisAgent):
     """Агент для анализа автомобильных интересов"""
     
+    agent_name = "car_interest"
+    
     def __init__(self):
         super().__init__(CAR_INTEREST_TOOLS, CarInterestAnalysisState)
     
+    @staticmethod
+    def _load_context(db: Session, client_id: int) -> Dict[str, Any]:
+        """Загружает текущие интересы и ручные изменения клиента из БД"""
+        car_interest = db.query(CarInterest).filter(CarInterest.client_id == client_id).first()
+        if car_interest and car_interest.structured_data:
+            return {
+                "current_interests": car_interest.structured_data.get("queries", []),
+                "manual_modifications": car_interest.structured_data.get("manual_modifications", {})
+            }
+        return {"current_interests": [], "manual_modifications": {}}
+    
     def _prepare_context(self, state: CarInterestAnalysisState) -> CarInterestAnalysisState:
         """Подготовка контекста для анализа"""
         logger.info(f"Подготовка контекста автомобильных интересов для клиента {state['client_id']}")
@@ -39,13 +56,7 @@ class CarInterestAnalysisAgent(BaseAnalysisAgent):
         # Получаем текущие интересы из БД
         db = SessionLocal()
         try:
-            car_interest = db.query(CarInterest).filter(CarInterest.client_id == state['client_id']).first()
-            if car_interest and car_interest.structured_data:
-                state["current_interests"] = car_interest.structured_data.get("queries", [])
-                state["manual_modifications"] = car_interest.structured_data.get("manual_modifications", {})
-            else:
-                state["current_interests"] = []
-                state["manual_modifications"] = {}
+            state.update(self._load_context(db, state['client_id']))
         finally:
             db.close()
         
@@ -64,7 +75,8 @@ class CarInterestAnalysisAgent(BaseAnalysisAgent):
             datetime.now().strftime("%Y-%m-%d %H:%M")
         )
     
-    def _process_updates(self, state: CarInterestAnalysisState) -> CarInterestAnalysisState:
+    @staticmethod
+    def _process_updates(state: CarInterestAnalysisState) -> CarInterestAnalysisState:
         """Обработка обновлений из вызовов инструментов"""
         state["updates"] = {
             "add_queries": [],
@@ -102,7 +114,8 @@ class CarInterestAnalysisAgent(BaseAnalysisAgent):
         
         return state
     
-    def _generate_car_interest_prompt(self, client_name: str, current_interests: List[Dict],
+    @staticmethod
+    def _generate_car_interest_prompt(client_name: str, current_interests: List[Dict],
                                      manual_modifications: Dict, current_time: str) -> str:
         """Создает промпт для анализа и фиксации автомобильных интересов клиента."""
 
@@ -188,10 +201,16 @@ class CarInterestAnalysisAgent(BaseAnalysisAgent):
 Текущая дата и время: {current_time}
 """
     
-    def analyze(self, client_id: int, client_name: str, chat_messages: List[Message]) -> Dict[str, Any]:
+    def analyze(self, client_id: int, client_name: str, chat_messages: List[Message],
+                last_analyzed_message_id: Optional[int] = None) -> Dict[str, Any]:
         """Запуск анализа автомобильных интересов"""
         formatted_messages = self._format_chat_messages(chat_messages)
         
+        cache_key = self._cache_key(client_id, formatted_messages)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        
         initial_state: CarInterestAnalysisState = {
             "client_id": client_id,
             "client_name": client_name,
@@ -200,16 +219,21 @@ class CarInterestAnalysisAgent(BaseAnalysisAgent):
             "manual_modifications": {},
             "updates": {},
             "confirmed": False,
-            "errors": []
+            "errors": [],
+            "usage": {}
         }
         
-        result = self.graph.invoke(initial_state)
+        result = self._run_graph(initial_state, chat_messages, last_analyzed_message_id)
         
-        return {
+        analysis_result = {
             "updates": result["updates"],
             "confirmed": result["confirmed"],
-            "errors": result["errors"]
+            "errors": result["errors"],
+            "usage": result["usage"]
         }
+        self._store_cached(cache_key, client_id, analysis_result, result.get("model"))
+        
+        return analysis_result
 
 
 # Глобальный экземпляр агента
@@ -0,0 +1,219 @@
+"""Агент для единого анализа клиента: досье, автомобильные интересы и задачи за один проход"""
+
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, TypedDict, Optional
+
+from sqlalchemy.orm import Session
+
+from ...core.database import SessionLocal
+from ...models.message import Message
+from .base_agent import BaseAnalysisAgent
+from .dossier_agent import DossierAnalysisAgent
+from .car_interest_agent import CarInterestAnalysisAgent
+from .task_agent import TaskAnalysisAgent
+from .tools import COMBINED_TOOLS
+
+logger = logging.getLogger(__name__)
+
+
+# Подтверждения, которые должны быть вызваны для завершения единого анализа
+REQUIRED_CONFIRMATIONS = {"confirm_all_dossier", "confirm_all_car_interests", "confirm_all_tasks"}
+
+
+class CombinedAnalysisState(TypedDict):
+    """Состояние для единого анализа клиента"""
+    client_id: int
+    client_name: str
+    messages: List
+    dossier_context: Dict[str, Any]
+    car_interest_context: Dict[str, Any]
+    task_context: Dict[str, Any]
+    dossier_result: Dict[str, Any]
+    car_interest_result: Dict[str, Any]
+    task_result: Dict[str, Any]
+    confirmed: bool
+    errors: List[str]
+    usage: Dict[str, int]
+    model: str  # модель запуска, выбранная маршрутизатором
+
+
+class CombinedAnalysisAgent(BaseAnalysisAgent):
+    """Агент, который получает историю чата один раз и обновляет досье, интересы и задачи"""
+
+    agent_name = "combined"
+
+    # Три набора обновлений требуют больше итераций, чем отдельный агент
+    max_iterations = 15
+
+    def __init__(self):
+        super().__init__(COMBINED_TOOLS, CombinedAnalysisState)
+
+    def _confirmation_reached(self, confirmed_tools: set) -> bool:
+        """Единый анализ завершен только после подтверждения всех трех разделов"""
+        return REQUIRED_CONFIRMATIONS.issubset(confirmed_tools)
+
+    @staticmethod
+    def _load_context(db: Session, client_id: int) -> Dict[str, Any]:
+        """Загружает контекст всех трех разделов в одной сессии БД"""
+        return {
+            "dossier_context": DossierAnalysisAgent._load_context(db, client_id),
+            "car_interest_context": CarInterestAnalysisAgent._load_context(db, client_id),
+            "task_context": TaskAnalysisAgent._load_context(db, client_id)
+        }
+
+    def _prepare_context(self, state: CombinedAnalysisState) -> CombinedAnalysisState:
+        """Подготовка контекста всех трех разделов"""
+        logger.info(f"Подготовка контекста единого анализа для клиента {state['client_id']}")
+
+        db = SessionLocal()
+        try:
+            state.update(self._load_context(db, state['client_id']))
+        finally:
+            db.close()
+
+        state["confirmed"] = False
+        state["errors"] = []
+
+        return state
+
+    def _generate_system_prompt(self, state: CombinedAnalysisState) -> str:
+        """Объединяет промпты трех агентов под общей инструкцией"""
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        dossier_prompt = DossierAnalysisAgent._generate_dossier_prompt(
+            state["client_name"],
+            state["dossier_context"]["current_dossier"],
+            state["dossier_context"]["manual_modifications"],
+            current_time
+        )
+        car_interest_prompt = CarInterestAnalysisAgent._generate_car_interest_prompt(
+            state["client_name"],
+            state["car_interest_context"]["current_interests"],
+            state["car_interest_context"]["manual_modifications"],
+            current_time
+        )
+        task_prompt = TaskAnalysisAgent._generate_task_prompt(
+            state["client_name"],
+            state["task_context"]["current_tasks"],
+            state["task_context"]["manual_modifications"],
+            current_time
+        )
+
+        return f"""Ты выполняешь ТРИ независимые задачи по одной и той же переписке с клиентом {state["client_name"]}:
+досье клиента, автомобильные интересы и задачи менеджера. Инструкции для каждой части приведены ниже.
+
+**КРИТИЧЕСКИ ВАЖНО**: Ты можешь взаимодействовать ТОЛЬКО через вызов инструментов (tools). Не смешивай инструменты разных частей.
+Работа считается завершенной, только когда вызваны ВСЕ ТРИ подтверждения: `confirm_all_dossier()`, `confirm_all_car_interests()` и `confirm_all_tasks()`.
+
+=============================================================================
+## ЧАСТЬ 1. ДОСЬЕ
+=============================================================================
+{dossier_prompt}
+
+=============================================================================
+## ЧАСТЬ 2. АВТОМОБИЛЬНЫЕ ИНТЕРЕСЫ
+=============================================================================
+{car_interest_prompt}
+
+=============================================================================
+## ЧАСТЬ 3. ЗАДАЧИ
+=============================================================================
+{task_prompt}
+"""
+
+    def _process_updates(self, state: CombinedAnalysisState) -> CombinedAnalysisState:
+        """Разбирает вызовы инструментов тем же кодом, что и отдельные агенты"""
+        dossier_state = {
+            "messages": state["messages"],
+            "current_dossier": state["dossier_context"]["current_dossier"],
+            "updates": {},
+            "confirmed": False
+        }
+        DossierAnalysisAgent._process_updates(dossier_state)
+
+        car_interest_state = {
+            "messages": state["messages"],
+            "updates": {},
+            "confirmed": False
+        }
+        CarInterestAnalysisAgent._process_updates(car_interest_state)
+
+        task_state = {
+            "messages": state["messages"],
+            "new_tasks": [],
+            "updated_tasks": [],
+            "completed_task_ids": [],
+            "deleted_task_ids": [],
+            "confirmed": False
+        }
+        TaskAnalysisAgent._process_updates(task_state)
+
+        state["dossier_result"] = {
+            "updates": dossier_state["updates"],
+            "confirmed": dossier_state["confirmed"],
+            "errors": []
+        }
+        state["car_interest_result"] = {
+            "updates": car_interest_state["updates"],
+            "confirmed": car_interest_state["confirmed"],
+            "errors": []
+        }
+        state["task_result"] = {
+            "new_tasks": task_state["new_tasks"],
+            "updated_tasks": task_state["updated_tasks"],
+            "completed_task_ids": task_state["completed_task_ids"],
+            "deleted_task_ids": task_state["deleted_task_ids"],
+            "confirmed": task_state["confirmed"],
+            "errors": []
+        }
+        state["confirmed"] = all([
+            dossier_state["confirmed"],
+            car_interest_state["confirmed"],
+            task_state["confirmed"]
+        ])
+
+        return state
+
+    def analyze(self, client_id: int, client_name: str, chat_messages: List[Message],
+                last_analyzed_message_id: Optional[int] = None) -> Dict[str, Any]:
+        """Запуск единого анализа. Результаты разделов совместимы с отдельными агентами"""
+        formatted_messages = self._format_chat_messages(chat_messages)
+
+        cache_key = self._cache_key(client_id, formatted_messages)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+
+        initial_state: CombinedAnalysisState = {
+            "client_id": client_id,
+            "client_name": client_name,
+            "messages": formatted_messages,
+            "dossier_context": {},
+            "car_interest_context": {},
+            "task_context": {},
+            "dossier_result": {},
+            "car_interest_result": {},
+            "task_result": {},
+            "confirmed": False,
+            "errors": [],
+            "usage": {}
+        }
+
+        result = self._run_graph(initial_state, chat_messages, last_analyzed_message_id)
+
+        analysis_result = {
+            "dossier": result["dossier_result"],
+            "car_interest": result["car_interest_result"],
+            "task": result["task_result"],
+            "confirmed": result["confirmed"],
+            "errors": result["errors"],
+            "usage": result["usage"]
+        }
+        self._store_cached(cache_key, client_id, analysis_result, result.get("model"))
+
+        return analysis_result
+
+
+# Глобальный экземпляр агента
+combined_agent = CombinedAnalysisAgent()
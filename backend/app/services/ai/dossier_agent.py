@@ -24,15 +24,20 @@ class DossierAnalysisState(TypedDict):
     updates: Dict[str, Any]
     confirmed: bool
     errors: List[str]
+    usage: Dict[str, int]
+    model: str  # модель запуска, выбранная маршрутизатором
 
 
 class DossierAnalysisAgent(BaseAnalysisAgent):
     """Агент для анализа досье клиента"""
     
+    agent_name = "dossier"
+    
     def __init__(self):
         super().__init__(DOSSIER_TOOLS, DossierAnalysisState)
     
-    def _get_field_display_name(self, field: str) -> str:
+    @staticmethod
+    def _get_field_display_name(field: str) -> str:
         """Возвращает отображаемое название поля"""
         field_names = {
             'phone': 'Телефон',
@@ -45,6 +50,32 @@ class DossierAnalysisAgent(BaseAnalysisAgent):
         }
         return field_names.get(field, field)
     
+    @staticmethod
+    def _load_context(db: Session, client_id: int) -> Dict[str, Any]:
+        """Загружает текущее досье и ручные изменения клиента из БД"""
+        dossier = db.query(Dossier).filter(Dossier.client_id == client_id).first()
+        if dossier and dossier.structured_data:
+            current_dossier = None
+            # Извлекаем данные клиента
+            if "client_info" in dossier.structured_data:
+                client_info = dossier.structured_data["client_info"]
+                current_dossier = {
+                    "phone": client_info.get("phone"),
+                    "current_location": client_info.get("current_location"),
+                    "birthday": client_info.get("birthday"),
+                    "gender": client_info.get("gender"),
+                    "client_type": client_info.get("client_type"),
+                    "personal_notes": client_info.get("personal_notes"),
+                    "business_profile": client_info.get("business_profile")
+                }
+            
+            return {
+                "current_dossier": current_dossier,
+                "manual_modifications": dossier.structured_data.get("manual_modifications", {})
+            }
+        
+        return {"current_dossier": None, "manual_modifications": {}}
+    
     def _prepare_context(self, state: DossierAnalysisState) -> DossierAnalysisState:
         """Подготовка контекста для анализа"""
         logger.info(f"Подготовка контекста досье для клиента {state['client_id']}")
@@ -52,28 +83,7 @@ class DossierAnalysisAgent(BaseAnalysisAgent):
         # Получаем текущее досье из БД
         db = SessionLocal()
         try:
-            dossier = db.query(Dossier).filter(Dossier.client_id == state['client_id']).first()
-            if dossier and dossier.structured_data:
-                # Извлекаем данные клиента
-                if "client_info" in dossier.structured_data:
-                    client_info = dossier.structured_data["client_info"]
-                    state["current_dossier"] = {
-                        "phone": client_info.get("phone"),
-                        "current_location": client_info.get("current_location"),
-                        "birthday": client_info.get("birthday"),
-                        "gender": client_info.get("gender"),
-                        "client_type": client_info.get("client_type"),
-                        "personal_notes": client_info.get("personal_notes"),
-                        "business_profile": client_info.get("business_profile")
-                    }
-                else:
-                    state["current_dossier"] = None
-                
-                # Извлекаем manual_modifications
-                state["manual_modifications"] = dossier.structured_data.get("manual_modifications", {})
-            else:
-                state["current_dossier"] = None
-                state["manual_modifications"] = {}
+            state.update(self._load_context(db, state['client_id']))
         finally:
             db.close()
         
@@ -92,7 +102,8 @@ class DossierAnalysisAgent(BaseAnalysisAgent):
             datetime.now().strftime("%Y-%m-%d %H:%M")
         )
     
-    def _process_updates(self, state: DossierAnalysisState) -> DossierAnalysisState:
+    @staticmethod
+    def _process_updates(state: DossierAnalysisState) -> DossierAnalysisState:
         """Обработка обновлений из вызовов инструментов"""
         # Ищем вызовы инструментов в последних сообщениях
         for message in reversed(state["messages"]):
@@ -140,7 +151,8 @@ class DossierAnalysisAgent(BaseAnalysisAgent):
         
         return state
     
-    def _generate_dossier_prompt(self, client_name: str, current_dossier: Optional[Dict], 
+    @staticmethod
+    def _generate_dossier_prompt(client_name: str, current_dossier: Optional[Dict], 
                                  manual_modifications: Dict, current_time: str) -> str:
         """Создает промпт для анализа досье клиента автодилера с учетом его типа."""
 
@@ -160,7 +172,7 @@ class DossierAnalysisAgent(BaseAnalysisAgent):
         # Информация о защищенных полях
         protected_info = ""
         if manual_modifications:
-            protected_fields = [self._get_field_display_name(f) for f in manual_modifications.keys()]
+            protected_fields = [DossierAnalysisAgent._get_field_display_name(f) for f in manual_modifications.keys()]
             protected_info = f"\n⚠️ Поля {', '.join(protected_fields)} подтверждены вручную - обновляй только при явных изменениях в переписке."
 
         return f"""Ты — ИИ-ассистент в автодилерской компании, которая привозит машины из США.
@@ -237,10 +249,16 @@ class DossierAnalysisAgent(BaseAnalysisAgent):
 Текущее время: {current_time}
 """
     
-    def analyze(self, client_id: int, client_name: str, chat_messages: List[Message]) -> Dict[str, Any]:
+    def analyze(self, client_id: int, client_name: str, chat_messages: List[Message],
+                last_analyzed_message_id: Optional[int] = None) -> Dict[str, Any]:
         """Запуск анализа досье"""
         formatted_messages = self._format_chat_messages(chat_messages)
         
+        cache_key = self._cache_key(client_id, formatted_messages)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        
         initial_state: DossierAnalysisState = {
             "client_id": client_id,
             "client_name": client_name,
@@ -249,16 +267,21 @@ class DossierAnalysisAgent(BaseAnalysisAgent):
             "manual_modifications": {},
             "updates": {},
             "confirmed": False,
-            "errors": []
+            "errors": [],
+            "usage": {}
         }
         
-        result = self.graph.invoke(initial_state)
+        result = self._run_graph(initial_state, chat_messages, last_analyzed_message_id)
         
-        return {
+        analysis_result = {
             "updates": result["updates"],
             "confirmed": result["confirmed"],
-            "errors": result["errors"]
+            "errors": result["errors"],
+            "usage": result["usage"]
         }
+        self._store_cached(cache_key, client_id, analysis_result, result.get("model"))
+        
+        return analysis_result
 
 
 # Глобальный экземпляр агента
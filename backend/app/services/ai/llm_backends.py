@@ -0,0 +1,172 @@
+"""Подключаемые LLM бэкенды для агентов анализа
+
+- live: реальный ChatOpenAI
+- record: ChatOpenAI, каждая пара запрос/ответ сохраняется в кассету
+- replay: ответы из кассет без сети, детерминированно; нет кассеты - ошибка
+- fake: синтетическая модель, сразу подтверждающая все разделы (замер накладных расходов цикла агента)
+
+Бэкенд выбирается настройкой LLM_BACKEND, кассеты лежат в LLM_CASSETTE_DIR.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import List
+
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage, message_to_dict, messages_from_dict
+
+from ...core.config import settings
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKEND_LIVE = "live"
+LLM_BACKEND_RECORD = "record"
+LLM_BACKEND_REPLAY = "replay"
+LLM_BACKEND_FAKE = "fake"
+
+# Строка с текущими датой и временем в системном промпте меняется от запуска к запуску и не должна
+# влиять на ключ кассеты. Даты из данных клиента (сроки задач, даты из досье) остаются в ключе
+_PROMPT_CURRENT_TIME_PATTERN = re.compile(
+    r"^(Текущее время|Текущая дата и время): (\d{4}-\d{2}-\d{2})(?: \d{2}:\d{2}(?::\d{2})?)?$",
+    re.MULTILINE
+)
+
+
+def _mask_current_time(content: str) -> str:
+    """Маскирует строку текущего времени и сегодняшнюю дату, которую промпт задач подставляет в пример срока"""
+    match = _PROMPT_CURRENT_TIME_PATTERN.search(content)
+    if match is None:
+        return content
+    content = _PROMPT_CURRENT_TIME_PATTERN.sub(lambda m: f"{m.group(1)}: <datetime>", content)
+    return content.replace(match.group(2), "<today>")
+
+
+class CassetteMissError(RuntimeError):
+    """В режиме replay нет записанного ответа на запрос"""
+
+
+def cassette_key(model_name: str, tools: List, messages: List[BaseMessage]) -> str:
+    """Ключ запроса: модель, набор инструментов и сообщения без текущей даты в системном промпте"""
+    serialized = []
+    for msg in messages:
+        content = msg.content
+        if isinstance(msg, SystemMessage) and isinstance(content, str):
+            content = _mask_current_time(content)
+        serialized.append([
+            msg.type,
+            content,
+            getattr(msg, "tool_calls", None) or [],
+            getattr(msg, "tool_call_id", None)
+        ])
+    payload = {
+        "model": model_name,
+        "tools": sorted(tool.name for tool in tools),
+        "messages": serialized
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class RecordingChatModel:
+    """Обертка над живой моделью, сохраняющая ответы в кассеты"""
+
+    def __init__(self, llm, model_name: str, tools: List, cassette_dir: str):
+        self._llm = llm
+        self._model_name = model_name
+        self._tools = tools
+        self._cassette_dir = cassette_dir
+        os.makedirs(cassette_dir, exist_ok=True)
+
+    def invoke(self, messages: List[BaseMessage]) -> AIMessage:
+        response = self._llm.invoke(messages)
+        key = cassette_key(self._model_name, self._tools, messages)
+        path = os.path.join(self._cassette_dir, f"{key}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "model": self._model_name,
+                "request": [message_to_dict(msg) for msg in messages],
+                "response": message_to_dict(response)
+            }, f, ensure_ascii=False, indent=2, default=str)
+        return response
+
+
+class ReplayChatModel:
+    """Модель, отвечающая записанными ответами из кассет"""
+
+    def __init__(self, model_name: str, tools: List, cassette_dir: str):
+        self._model_name = model_name
+        self._tools = tools
+        self._cassette_dir = cassette_dir
+
+    def invoke(self, messages: List[BaseMessage]) -> AIMessage:
+        key = cassette_key(self._model_name, self._tools, messages)
+        path = os.path.join(self._cassette_dir, f"{key}.json")
+        if not os.path.exists(path):
+            raise CassetteMissError(f"Нет кассеты {key} для запроса к {self._model_name}")
+        with open(path, encoding="utf-8") as f:
+            cassette = json.load(f)
+        return messages_from_dict([cassette["response"]])[0]
+
+
+class FakeChatModel:
+    """Синтетическая модель: вызывает все confirm_all_* инструменты агента за одну итерацию
+
+    Токены оцениваются по длине запроса, поэтому бенчмарк видит реалистичный размер промптов.
+    """
+
+    def __init__(self, model_name: str, tools: List):
+        self._model_name = model_name
+        self._confirm_tools = [tool.name for tool in tools if tool.name.startswith("confirm_all")]
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, messages: List[BaseMessage]) -> AIMessage:
+        with self._lock:
+            self._counter += 1
+            call_number = self._counter
+
+        input_tokens = sum(len(str(msg.content)) for msg in messages) // 4
+        tool_calls = [
+            {"name": name, "args": {}, "id": f"fake_{call_number}_{index}", "type": "tool_call"}
+            for index, name in enumerate(self._confirm_tools)
+        ]
+        output_tokens = 10 * len(tool_calls)
+        return AIMessage(
+            content="",
+            tool_calls=tool_calls,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens
+            },
+            response_metadata={"model_name": f"fake:{self._model_name}"}
+        )
+
+
+def _create_live_model(model_name: str, tools: List):
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(
+        model=model_name,
+        api_key=settings.openai_api_key,
+        temperature=0.3,  # Низкая температура для предсказуемого вызова tools
+        max_retries=0,  # Повторы и паузы при 429 выполняют _invoke_llm_with_retry и llm_scheduler
+        include_response_headers=True  # x-ratelimit-* заголовки для llm_scheduler
+    ).bind_tools(tools)
+
+
+def create_chat_model(model_name: str, tools: List):
+    """Модель с методом invoke(messages) -> AIMessage для выбранного LLM_BACKEND"""
+    backend = settings.llm_backend
+    if backend == LLM_BACKEND_LIVE:
+        return _create_live_model(model_name, tools)
+    if backend == LLM_BACKEND_RECORD:
+        return RecordingChatModel(_create_live_model(model_name, tools), model_name, tools, settings.llm_cassette_dir)
+    if backend == LLM_BACKEND_REPLAY:
+        return ReplayChatModel(model_name, tools, settings.llm_cassette_dir)
+    if backend == LLM_BACKEND_FAKE:
+        return FakeChatModel(model_name, tools)
+    raise ValueError(f"Неизвестный LLM_BACKEND: {backend}")
@@ -0,0 +1,310 @@
+"""Общий диспетчер вызовов LLM с бюджетами RPM/TPM и приоритетами
+
+Все агенты вызывают OpenAI через один экземпляр LLMScheduler. Диспетчер держит
+очередь с приоритетами (ручной анализ раньше фонового), не пропускает запросы сверх
+бюджета запросов и токенов в минуту и приостанавливает отправку по заголовкам
+x-ratelimit-* и ответам 429, вместо того чтобы каждый поток повторял запросы сам.
+"""
+
+import heapq
+import itertools
+import logging
+import re
+import threading
+import time
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from ...core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Чем меньше число, тем раньше запрос покидает очередь
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_BACKGROUND: "background"
+}
+
+# Окно, в котором считаются бюджеты RPM/TPM
+WINDOW_SECONDS = 60.0
+# Запас на ответ модели и описание инструментов при оценке токенов запроса
+OUTPUT_TOKENS_RESERVE = 1000
+
+_current_priority: ContextVar[int] = ContextVar("llm_priority", default=PRIORITY_BACKGROUND)
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+@contextmanager
+def llm_priority(priority: int):
+    """Задает приоритет всех вызовов LLM внутри блока (в текущем потоке)"""
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+def estimate_tokens(messages: List[Any]) -> int:
+    """Грубая оценка токенов запроса: ~3 символа на токен для смешанного русского/английского текста"""
+    chars = sum(len(str(getattr(msg, "content", msg))) for msg in messages)
+    return chars // 3 + OUTPUT_TOKENS_RESERVE
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """Разбирает длительность из заголовков OpenAI: "1s", "6m0s", "20ms", "0.5" """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PATTERN.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _Ticket:
+    """Запрос, ожидающий отправки"""
+    __slots__ = ("priority", "estimated_tokens", "enqueued_at", "token_record")
+
+    def __init__(self, priority: int, estimated_tokens: int):
+        self.priority = priority
+        self.estimated_tokens = estimated_tokens
+        self.enqueued_at = time.monotonic()
+        self.token_record = None
+
+
+class LLMScheduler:
+    """Очередь вызовов LLM с бюджетами запросов/токенов в минуту и адаптацией к rate limit"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._request_times = deque()
+        self._token_records = deque()  # [время, токены] - токены уточняются после ответа
+        self._in_flight = 0
+        self._paused_until = 0.0
+        # Лимиты аккаунта из заголовков ответа, если они ниже настроенных
+        self._header_rpm_limit = None
+        self._header_tpm_limit = None
+        self._stats = {
+            "dispatched": defaultdict(int),
+            "wait_total": defaultdict(float),
+            "wait_max": defaultdict(float),
+            "rate_limit_errors": 0,
+            "header_pauses": 0
+        }
+
+    # ------------------------------------------------------------------
+    # Публичный интерфейс
+    # ------------------------------------------------------------------
+
+    def call(self, fn: Callable[[], Any], estimated_tokens: int, priority: Optional[int] = None) -> Any:
+        """Выполняет fn(), когда бюджет позволяет. Приоритет по умолчанию берется из llm_priority()"""
+        if priority is None:
+            priority = _current_priority.get()
+
+        ticket = self._acquire(priority, estimated_tokens)
+        actual_tokens = estimated_tokens
+        try:
+            response = fn()
+        except Exception as e:
+            if self._is_rate_limit_error(e):
+                self._pause(self._retry_after(e), "429")
+                with self._cond:
+                    self._stats["rate_limit_errors"] += 1
+            raise
+        else:
+            usage = getattr(response, "usage_metadata", None) or {}
+            actual_tokens = usage.get("total_tokens") or estimated_tokens
+            self._adapt_to_headers(response, estimated_tokens)
+            return response
+        finally:
+            self._release(ticket, actual_tokens)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Глубина очереди, время ожидания по приоритетам и текущая загрузка бюджетов"""
+        with self._cond:
+            now = time.monotonic()
+            self._prune(now)
+            queued = defaultdict(int)
+            for _, _, ticket in self._queue:
+                queued[PRIORITY_NAMES.get(ticket.priority, str(ticket.priority))] += 1
+
+            wait = {}
+            for priority, dispatched in self._stats["dispatched"].items():
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                wait[name] = {
+                    "dispatched": dispatched,
+                    "avg_wait_seconds": round(self._stats["wait_total"][priority] / dispatched, 3) if dispatched else 0.0,
+                    "max_wait_seconds": round(self._stats["wait_max"][priority], 3)
+                }
+
+            return {
+                "queue_depth": len(self._queue),
+                "queued_by_priority": dict(queued),
+                "in_flight": self._in_flight,
+                "requests_last_minute": len(self._request_times),
+                "tokens_last_minute": sum(record[1] for record in self._token_records),
+                "rpm_limit": self._rpm_limit(),
+                "tpm_limit": self._tpm_limit(),
+                "max_concurrency": settings.llm_max_concurrency,
+                "paused_for_seconds": round(max(0.0, self._paused_until - now), 1),
+                "rate_limit_errors": self._stats["rate_limit_errors"],
+                "header_pauses": self._stats["header_pauses"],
+                "wait_by_priority": wait
+            }
+
+    # ------------------------------------------------------------------
+    # Очередь и бюджеты
+    # ------------------------------------------------------------------
+
+    def _rpm_limit(self) -> int:
+        if self._header_rpm_limit:
+            return min(settings.llm_rpm_limit, self._header_rpm_limit)
+        return settings.llm_rpm_limit
+
+    def _tpm_limit(self) -> int:
+        if self._header_tpm_limit:
+            return min(settings.llm_tpm_limit, self._header_tpm_limit)
+        return settings.llm_tpm_limit
+
+    def _prune(self, now: float) -> None:
+        """Убирает из окна запросы старше минуты"""
+        while self._request_times and now - self._request_times[0] >= WINDOW_SECONDS:
+            self._request_times.popleft()
+        while self._token_records and now - self._token_records[0][0] >= WINDOW_SECONDS:
+            self._token_records.popleft()
+
+    def _seconds_until_allowed(self, estimated_tokens: int, now: float) -> float:
+        """0 - запрос можно отправлять, иначе сколько ждать до освобождения бюджета"""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._in_flight >= settings.llm_max_concurrency:
+            return 1.0  # разбудит _release
+
+        if len(self._request_times) >= self._rpm_limit():
+            return WINDOW_SECONDS - (now - self._request_times[0])
+
+        used_tokens = sum(record[1] for record in self._token_records)
+        # Пустое окно пропускает даже запрос больше TPM, иначе он ждал бы вечно
+        if self._token_records and used_tokens + estimated_tokens > self._tpm_limit():
+            return WINDOW_SECONDS - (now - self._token_records[0][0])
+
+        return 0.0
+
+    def _acquire(self, priority: int, estimated_tokens: int) -> _Ticket:
+        ticket = _Ticket(priority, estimated_tokens)
+        with self._cond:
+            heapq.heappush(self._queue, (priority, next(self._seq), ticket))
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+                if self._queue[0][2] is ticket:
+                    delay = self._seconds_until_allowed(estimated_tokens, now)
+                    if delay <= 0:
+                        break
+                    self._cond.wait(timeout=min(delay, 1.0))
+                else:
+                    self._cond.wait(timeout=1.0)
+
+            heapq.heappop(self._queue)
+            ticket.token_record = [now, estimated_tokens]
+            self._request_times.append(now)
+            self._token_records.append(ticket.token_record)
+            self._in_flight += 1
+
+            waited = now - ticket.enqueued_at
+            self._stats["dispatched"][priority] += 1
+            self._stats["wait_total"][priority] += waited
+            self._stats["wait_max"][priority] = max(self._stats["wait_max"][priority], waited)
+            # Следующий в очереди проверяет бюджет сам
+            self._cond.notify_all()
+
+        if waited > 1.0:
+            logger.info(f"Вызов LLM ({PRIORITY_NAMES.get(priority, priority)}) ждал в очереди {waited:.1f}с")
+        return ticket
+
+    def _release(self, ticket: _Ticket, actual_tokens: int) -> None:
+        with self._cond:
+            ticket.token_record[1] = actual_tokens
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # Адаптация к лимитам OpenAI
+    # ------------------------------------------------------------------
+
+    def _pause(self, seconds: float, reason: str) -> None:
+        """Останавливает отправку всех запросов на seconds"""
+        with self._cond:
+            until = time.monotonic() + seconds
+            if until > self._paused_until:
+                self._paused_until = until
+                logger.warning(f"Диспетчер LLM: пауза {seconds:.1f}с ({reason})")
+            self._cond.notify_all()
+
+    def _adapt_to_headers(self, response: Any, estimated_tokens: int) -> None:
+        """Учитывает x-ratelimit-* заголовки ответа OpenAI"""
+        headers = (getattr(response, "response_metadata", None) or {}).get("headers") or {}
+        if not headers:
+            return
+        headers = {key.lower(): value for key, value in headers.items()}
+
+        with self._cond:
+            self._header_rpm_limit = _parse_int(headers.get("x-ratelimit-limit-requests")) or self._header_rpm_limit
+            self._header_tpm_limit = _parse_int(headers.get("x-ratelimit-limit-tokens")) or self._header_tpm_limit
+
+        remaining_requests = _parse_int(headers.get("x-ratelimit-remaining-requests"))
+        remaining_tokens = _parse_int(headers.get("x-ratelimit-remaining-tokens"))
+
+        pause = 0.0
+        if remaining_requests is not None and remaining_requests <= 0:
+            pause = max(pause, _parse_duration(headers.get("x-ratelimit-reset-requests")) or 1.0)
+        if remaining_tokens is not None and remaining_tokens < estimated_tokens:
+            pause = max(pause, _parse_duration(headers.get("x-ratelimit-reset-tokens")) or 1.0)
+
+        if pause > 0:
+            with self._cond:
+                self._stats["header_pauses"] += 1
+            self._pause(pause, "x-ratelimit")
+
+    @staticmethod
+    def _is_rate_limit_error(error: Exception) -> bool:
+        if getattr(error, "status_code", None) == 429:
+            return True
+        text = str(error).lower()
+        return "rate limit" in text or "429" in text
+
+    @staticmethod
+    def _retry_after(error: Exception) -> float:
+        """Пауза из заголовков ответа 429, иначе несколько секунд"""
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        retry_after_ms = _parse_int(headers.get("retry-after-ms"))
+        if retry_after_ms:
+            return retry_after_ms / 1000
+        retry_after = _parse_duration(headers.get("retry-after"))
+        if retry_after:
+            return retry_after
+        return settings.llm_rate_limit_pause_seconds
+
+
+# Глобальный экземпляр диспетчера
+llm_scheduler = LLMScheduler()
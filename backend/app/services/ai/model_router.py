@@ -0,0 +1,199 @@
+"""Выбор модели для запуска агента по сложности переписки
+
+Уровни моделей:
+- fast: короткие простые обновления (мало новых сообщений, нет цифр, цен и дат)
+- default: модель агента (model_name)
+- strong: повтор после неудачного запуска
+
+Запуск на fast повышается до default при ошибке, отсутствии подтверждения или
+исправлениях после ошибок валидации (низкая уверенность); default - до strong только
+при ошибке. Режимы (settings.model_routing_mode):
+- off: всегда модель агента
+- shadow: решение считается и логируется, но запуск идет на модели агента
+- on: решение применяется
+"""
+
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+from ...core.config import settings
+from ...models.message import Message
+
+logger = logging.getLogger(__name__)
+
+TIER_FAST = "fast"
+TIER_DEFAULT = "default"
+TIER_STRONG = "strong"
+TIER_ORDER = [TIER_FAST, TIER_DEFAULT, TIER_STRONG]
+
+ROUTING_OFF = "off"
+ROUTING_SHADOW = "shadow"
+ROUTING_ON = "on"
+
+# Единому агенту нужны все три раздела за один проход - быстрая модель для него не выбирается
+AGENTS_WITHOUT_FAST_TIER = {"combined"}
+
+_PRICE_PATTERN = re.compile(r"\d[\d\s.,]*\s*(?:₽|руб|р\.|тыс|млн|k\b|к\b|\$|€|usd|eur)", re.IGNORECASE)
+_DATE_PATTERN = re.compile(
+    r"\b\d{1,2}[./]\d{1,2}(?:[./]\d{2,4})?\b|\b\d{1,2}:\d{2}\b"
+    r"|завтра|послезавтра|сегодня|понедельник|вторник|сред[уа]|четверг|пятниц|суббот|воскресень"
+    r"|январ|феврал|март|апрел|ма[яй]\b|июн|июл|август|сентябр|октябр|ноябр|декабр|недел|месяц",
+    re.IGNORECASE
+)
+_NUMBER_PATTERN = re.compile(r"\d{2,}")
+
+
+class ModelRouter:
+    """Решения о модели для запуска агента и статистика их исходов"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Был ли последний запуск агента для клиента неудачным: (client_id, agent) -> bool
+        self._last_failed: "OrderedDict[tuple, bool]" = OrderedDict()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def tier_model(tier: str, default_model: str) -> str:
+        if tier == TIER_FAST:
+            return settings.llm_model_fast
+        if tier == TIER_STRONG:
+            return settings.llm_model_strong
+        return default_model
+
+    @staticmethod
+    def collect_signals(chat_messages: List[Message], last_analyzed_message_id: Optional[int]) -> Dict[str, Any]:
+        """Признаки сложности по сообщениям, которые еще не учтены анализом"""
+        if last_analyzed_message_id is None:
+            new_messages = chat_messages
+        else:
+            new_messages = [msg for msg in chat_messages if msg.id > last_analyzed_message_id]
+        text = "\n".join(msg.content or "" for msg in new_messages if msg.content_type == "text")
+        return {
+            "first_analysis": last_analyzed_message_id is None,
+            "new_messages": len(new_messages),
+            "new_chars": len(text),
+            "has_media": any(msg.content_type != "text" for msg in new_messages),
+            "has_prices": bool(_PRICE_PATTERN.search(text)),
+            "has_dates": bool(_DATE_PATTERN.search(text)),
+            "has_numbers": bool(_NUMBER_PATTERN.search(text))
+        }
+
+    def route(self, agent: str, default_model: str, client_id: int, chat_messages: List[Message],
+              last_analyzed_message_id: Optional[int] = None) -> Dict[str, Any]:
+        """Выбор уровня модели для запуска агента
+        
+        last_analyzed_message_id - из загруженного клиента; без него все сообщения считаются
+        новыми, как при первом анализе (быстрая модель не выбирается).
+        """
+        mode = settings.model_routing_mode
+        if mode == ROUTING_OFF:
+            return {"agent": agent, "client_id": client_id, "mode": mode, "tier": TIER_DEFAULT,
+                    "model": default_model, "reason": "маршрутизация отключена", "signals": {}}
+
+        signals = self.collect_signals(chat_messages, last_analyzed_message_id)
+        with self._lock:
+            signals["previous_failed"] = self._last_failed.get((client_id, agent), False)
+
+        if signals["previous_failed"]:
+            tier, reason = TIER_STRONG, "предыдущий запуск с ошибками"
+        elif agent in AGENTS_WITHOUT_FAST_TIER:
+            tier, reason = TIER_DEFAULT, "единый агент"
+        elif signals["first_analysis"]:
+            tier, reason = TIER_DEFAULT, "первый анализ клиента"
+        elif signals["has_prices"] or signals["has_dates"] or signals["has_numbers"]:
+            tier, reason = TIER_DEFAULT, "цифры, цены или даты в новых сообщениях"
+        elif signals["has_media"]:
+            tier, reason = TIER_DEFAULT, "вложения в новых сообщениях"
+        elif (signals["new_messages"] <= settings.model_routing_fast_max_messages
+              and signals["new_chars"] <= settings.model_routing_fast_max_chars):
+            tier, reason = TIER_FAST, "короткое простое обновление"
+        else:
+            tier, reason = TIER_DEFAULT, "много новых сообщений"
+
+        decision = {
+            "agent": agent,
+            "client_id": client_id,
+            "mode": mode,
+            "tier": tier,
+            "model": self.tier_model(tier, default_model) if mode == ROUTING_ON else default_model,
+            "reason": reason,
+            "signals": signals
+        }
+        logger.info(f"Маршрутизация {agent} для клиента {client_id}: {tier} ({reason}), модель {decision['model']}, режим {mode}")
+        return decision
+
+    @staticmethod
+    def is_successful(result: Dict[str, Any]) -> bool:
+        return bool(result.get("confirmed")) and not result.get("errors")
+
+    def next_tier(self, decision: Dict[str, Any], tier: str, result: Dict[str, Any]) -> Optional[str]:
+        """Уровень для повторного запуска или None, если результат принимается"""
+        if decision["mode"] != ROUTING_ON or tier == TIER_STRONG:
+            return None
+        if not self.is_successful(result):
+            return TIER_ORDER[TIER_ORDER.index(tier) + 1]
+        # Исправления после ошибок валидации на быстрой модели - признак низкой уверенности
+        if tier == TIER_FAST and result.get("usage", {}).get("validation_retries", 0) > 0:
+            return TIER_DEFAULT
+        return None
+
+    def record_outcome(self, decision: Dict[str, Any], tier: str, model: str, result: Dict[str, Any],
+                       duration_ms: float, escalated: bool) -> None:
+        """Исход запуска для статистики и признака previous_failed следующего решения"""
+        success = self.is_successful(result)
+        usage = result.get("usage", {})
+        key = f"{decision['agent']}:{tier}" if decision["mode"] == ROUTING_ON else f"{decision['agent']}:{decision['mode']}:{tier}"
+
+        with self._lock:
+            client_key = (decision["client_id"], decision["agent"])
+            self._last_failed[client_key] = not success
+            self._last_failed.move_to_end(client_key)
+            while len(self._last_failed) > settings.analysis_trace_clients * 4:
+                self._last_failed.popitem(last=False)
+
+            stats = self._stats.setdefault(key, {
+                "runs": 0, "successes": 0, "escalations": 0, "duration_ms_total": 0.0,
+                "input_tokens": 0, "output_tokens": 0, "models": {}, "reasons": {}
+            })
+            stats["runs"] += 1
+            stats["successes"] += int(success)
+            stats["escalations"] += int(escalated)
+            stats["duration_ms_total"] += duration_ms
+            stats["input_tokens"] += usage.get("input_tokens", 0)
+            stats["output_tokens"] += usage.get("output_tokens", 0)
+            stats["models"][model] = stats["models"].get(model, 0) + 1
+            stats["reasons"][decision["reason"]] = stats["reasons"].get(decision["reason"], 0) + 1
+
+        logger.info(
+            f"Исход маршрутизации {decision['agent']} для клиента {decision['client_id']}: {tier}/{model}, "
+            f"успех {success}, {round(duration_ms)}мс, токены {usage.get('input_tokens', 0)}+{usage.get('output_tokens', 0)}"
+            f"{', повышение уровня' if escalated else ''}"
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Исходы по агенту и уровню: доля успехов, повышения, среднее время и токены"""
+        with self._lock:
+            return {
+                "mode": settings.model_routing_mode,
+                "models": {
+                    TIER_FAST: settings.llm_model_fast,
+                    TIER_STRONG: settings.llm_model_strong
+                },
+                "routes": {
+                    key: {
+                        **stats,
+                        "models": dict(stats["models"]),
+                        "reasons": dict(stats["reasons"]),
+                        "success_rate": round(stats["successes"] / stats["runs"], 3) if stats["runs"] else 0.0,
+                        "avg_duration_ms": round(stats["duration_ms_total"] / stats["runs"]) if stats["runs"] else 0
+                    }
+                    for key, stats in sorted(self._stats.items())
+                }
+            }
+
+
+# Глобальный экземпляр маршрутизатора
+model_router = ModelRouter()
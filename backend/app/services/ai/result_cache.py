@@ -0,0 +1,173 @@
+"""Кеш результатов AI агентов по хешу входных данных
+
+Повторный анализ той же истории при том же состоянии клиента (повторный webhook,
+ручной перезапуск, рестарт процесса) возвращает сохраненный результат без вызова LLM.
+В ключ входит текущее состояние клиента, поэтому после применения результата
+ключ меняется и повторное применение тех же изменений невозможно.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from ...core.config import settings
+from ...core.database import SessionLocal
+from ...models.analysis_cache import AnalysisCacheEntry
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisResultCache:
+    """Кеш в БД с вытеснением давно не используемых записей (LRU) и временем жизни (TTL)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = Counter()
+        self._misses = Counter()
+
+    @staticmethod
+    def make_key(agent: str, model: str, prompt_version: str, formatted_messages: List, context: Dict[str, Any]) -> str:
+        """Хеш (агент, модель, версия промпта, история чата, текущее состояние)"""
+        payload = {
+            "agent": agent,
+            "model": model,
+            "prompt_version": prompt_version,
+            # Промпты содержат текущую дату, от нее зависят относительные сроки задач
+            "date": datetime.now().date().isoformat(),
+            "messages": [[msg.type, msg.content] for msg in formatted_messages],
+            "context": context
+        }
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, cache_key: str, agent: str) -> Optional[Dict[str, Any]]:
+        """Возвращает сохраненный результат или None"""
+        if not settings.analysis_cache_enabled:
+            return None
+
+        db = SessionLocal()
+        try:
+            entry = db.query(AnalysisCacheEntry).filter(AnalysisCacheEntry.cache_key == cache_key).first()
+            if entry is None:
+                self._count(self._misses, agent)
+                return None
+
+            now = datetime.utcnow()
+            if entry.created_at and entry.created_at.replace(tzinfo=None) < now - timedelta(hours=settings.analysis_cache_ttl_hours):
+                db.delete(entry)
+                db.commit()
+                self._count(self._misses, agent)
+                return None
+
+            entry.hit_count += 1
+            entry.last_accessed_at = now
+            db.commit()
+            self._count(self._hits, agent)
+            logger.info(f"Кеш анализа: найден результат агента {agent} (клиент {entry.client_id})")
+            return entry.result
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Ошибка чтения кеша анализа: {e}")
+            return None
+        finally:
+            db.close()
+
+    def put(self, cache_key: str, agent: str, client_id: int, result: Dict[str, Any]) -> None:
+        """Сохраняет результат и вытесняет устаревшие записи"""
+        if not settings.analysis_cache_enabled:
+            return
+
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            entry = db.query(AnalysisCacheEntry).filter(AnalysisCacheEntry.cache_key == cache_key).first()
+            if entry is None:
+                entry = AnalysisCacheEntry(cache_key=cache_key, agent=agent, client_id=client_id, created_at=now)
+                db.add(entry)
+            entry.result = result
+            entry.last_accessed_at = now
+            db.commit()
+
+            self._evict(db, now)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Ошибка записи в кеш анализа: {e}")
+        finally:
+            db.close()
+
+    @staticmethod
+    def _evict(db, now: datetime) -> None:
+        """Удаляет записи старше TTL и самые давно использованные сверх лимита"""
+        expired = db.query(AnalysisCacheEntry).filter(
+            AnalysisCacheEntry.created_at < now - timedelta(hours=settings.analysis_cache_ttl_hours)
+        ).delete(synchronize_session=False)
+
+        overflow = db.query(AnalysisCacheEntry).count() - settings.analysis_cache_max_entries
+        evicted = 0
+        if overflow > 0:
+            stale_ids = [
+                entry_id for (entry_id,) in db.query(AnalysisCacheEntry.id)
+                .order_by(AnalysisCacheEntry.last_accessed_at.asc())
+                .limit(overflow)
+            ]
+            evicted = db.query(AnalysisCacheEntry).filter(
+                AnalysisCacheEntry.id.in_(stale_ids)
+            ).delete(synchronize_session=False)
+
+        if expired or evicted:
+            db.commit()
+            logger.info(f"Кеш анализа: удалено устаревших {expired}, вытеснено {evicted}")
+
+    def clear(self) -> int:
+        """Очищает кеш полностью, возвращает количество удаленных записей"""
+        db = SessionLocal()
+        try:
+            deleted = db.query(AnalysisCacheEntry).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def _count(self, counter: Counter, agent: str) -> None:
+        with self._lock:
+            counter[agent] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Доля попаданий в кеш по агентам с момента запуска процесса и размер кеша"""
+        with self._lock:
+            agents = set(self._hits) | set(self._misses)
+            by_agent = {}
+            for agent in sorted(agents):
+                lookups = self._hits[agent] + self._misses[agent]
+                by_agent[agent] = {
+                    "hits": self._hits[agent],
+                    "misses": self._misses[agent],
+                    "hit_rate": round(self._hits[agent] / lookups, 3) if lookups else 0.0
+                }
+            total_hits = sum(self._hits.values())
+            total_lookups = total_hits + sum(self._misses.values())
+
+        db = SessionLocal()
+        try:
+            entries = db.query(AnalysisCacheEntry).count()
+        finally:
+            db.close()
+
+        return {
+            "enabled": settings.analysis_cache_enabled,
+            "entries": entries,
+            "max_entries": settings.analysis_cache_max_entries,
+            "ttl_hours": settings.analysis_cache_ttl_hours,
+            "hits": total_hits,
+            "lookups": total_lookups,
+            "hit_rate": round(total_hits / total_lookups, 3) if total_lookups else 0.0,
+            "by_agent": by_agent
+        }
+
+
+# Глобальный экземпляр кеша
+analysis_result_cache = AnalysisResultCache()
@@ -4,6 +4,8 @@ import logging
 from datetime import datetime
 from typing import Dict, Any, List, TypedDict, Optional
 
+from sqlalchemy.orm import Session
+
 from ...core.database import SessionLocal
 from ...models.task import Task
 from ...models.message import Message
@@ -26,14 +28,47 @@ class TaskAnalysisState(TypedDict):
     deleted_task_ids: List[int]
     confirmed: bool
     errors: List[str]
+    usage: Dict[str, int]
+    model: str  # модель запуска, выбранная маршрутизатором
 
 
 class TaskAnalysisAgent(BaseAnalysisAgent):
     """Агент для анализа задач"""
     
+    agent_name = "task"
+    
     def __init__(self):
         super().__init__(TASK_TOOLS, TaskAnalysisState)
     
+    @staticmethod
+    def _load_context(db: Session, client_id: int) -> Dict[str, Any]:
+        """Загружает активные задачи и ручные изменения задач клиента из БД"""
+        tasks = db.query(Task).filter(
+            Task.client_id == client_id,
+            Task.is_completed == False
+        ).all()
+        
+        current_tasks = [
+            {
+                "id": task.id,
+                "description": task.description,
+                "due_date": task.due_date.isoformat() if task.due_date else None,
+                "priority": task.priority,
+                "created_at": task.created_at.isoformat()
+            }
+            for task in tasks
+        ]
+        
+        # Собираем manual_modifications из всех задач клиента
+        all_tasks = db.query(Task).filter(Task.client_id == client_id).all()
+        manual_modifications = {}
+        for task in all_tasks:
+            if task.extra_data and "manual_modifications" in task.extra_data:
+                for field, info in task.extra_data["manual_modifications"].items():
+                    manual_modifications[f"task_{task.id}_{field}"] = info
+        
+        return {"current_tasks": current_tasks, "manual_modifications": manual_modifications}
+    
     def _prepare_context(self, state: TaskAnalysisState) -> TaskAnalysisState:
         """Подготовка контекста для анализа"""
         logger.info(f"Подготовка контекста задач для клиента {state['client_id']}")
@@ -41,29 +76,7 @@ class TaskAnalysisAgent(BaseAnalysisAgent):
         # Получаем текущие задачи из БД
         db = SessionLocal()
         try:
-            tasks = db.query(Task).filter(
-                Task.client_id == state['client_id'],
-                Task.is_completed == False
-            ).all()
-            
-            state["current_tasks"] = [
-                {
-                    "id": task.id,
-                    "description": task.description,
-                    "due_date": task.due_date.isoformat() if task.due_date else None,
-                    "priority": task.priority,
-                    "created_at": task.created_at.isoformat()
-                }
-                for task in tasks
-            ]
-            
-            # Собираем manual_modifications из всех задач клиента
-            all_tasks = db.query(Task).filter(Task.client_id == state['client_id']).all()
-            state["manual_modifications"] = {}
-            for task in all_tasks:
-                if task.extra_data and "manual_modifications" in task.extra_data:
-                    for field, info in task.extra_data["manual_modifications"].items():
-                        state["manual_modifications"][f"task_{task.id}_{field}"] = info
+            state.update(self._load_context(db, state['client_id']))
         finally:
             db.close()
         
@@ -85,7 +98,8 @@ class TaskAnalysisAgent(BaseAnalysisAgent):
             datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         )
     
-    def _process_updates(self, state: TaskAnalysisState) -> TaskAnalysisState:
+    @staticmethod
+    def _process_updates(state: TaskAnalysisState) -> TaskAnalysisState:
         """Обработка обновлений из вызовов инструментов"""
         # Проверяем tool_calls для извлечения информации
         for message in reversed(state["messages"]):
@@ -119,7 +133,8 @@ class TaskAnalysisAgent(BaseAnalysisAgent):
         
         return state
     
-    def _generate_task_prompt(self, client_name: str, current_tasks: List[Dict],
+    @staticmethod
+    def _generate_task_prompt(client_name: str, current_tasks: List[Dict],
                              manual_modifications: Dict, current_time: str) -> str:
         """Создает промпт для анализа и управления задачами по клиенту."""
 
@@ -237,10 +252,16 @@ class TaskAnalysisAgent(BaseAnalysisAgent):
     
 
     
-    def analyze(self, client_id: int, client_name: str, chat_messages: List[Message]) -> Dict[str, Any]:
+    def analyze(self, client_id: int, client_name: str, chat_messages: List[Message],
+                last_analyzed_message_id: Optional[int] = None) -> Dict[str, Any]:
         """Запуск анализа задач"""
         formatted_messages = self._format_chat_messages(chat_messages)
         
+        cache_key = self._cache_key(client_id, formatted_messages)
+        cached = self._get_cached(cache_key)
+        if cached is not None:
+            return cached
+        
         initial_state: TaskAnalysisState = {
             "client_id": client_id,
             "client_name": client_name,
@@ -252,19 +273,24 @@ class TaskAnalysisAgent(BaseAnalysisAgent):
             "completed_task_ids": [],
             "deleted_task_ids": [],
             "confirmed": False,
-            "errors": []
+            "errors": [],
+            "usage": {}
         }
         
-        result = self.graph.invoke(initial_state)
+        result = self._run_graph(initial_state, chat_messages, last_analyzed_message_id)
         
-        return {
+        analysis_result = {
             "new_tasks": result["new_tasks"],
             "updated_tasks": result["updated_tasks"],
             "completed_task_ids": result["completed_task_ids"],
             "deleted_task_ids": result["deleted_task_ids"],
             "confirmed": result["confirmed"],
-            "errors": result["errors"]
+            "errors": result["errors"],
+            "usage": result["usage"]
         }
+        self._store_cached(cache_key, client_id, analysis_result, result.get("model"))
+        
+        return analysis_result
 
 
 # Глобальный экземпляр агента
@@ -0,0 +1,230 @@
+"""Телеметрия AI анализа: спаны узлов графа и вызовов LLM, гистограммы по агентам
+
+Каждый анализ клиента собирается в трассу из вложенных спанов:
+analysis -> agent -> node (prepare_context, agent_loop, process_updates) -> llm / tools.
+Длительности агрегируются в гистограммы по агенту и имени спана, последняя трасса
+каждого клиента доступна через админ API.
+"""
+
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from ...core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы длительностей, мс
+DURATION_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000]
+# Границы корзин гистограммы числа итераций agent_loop
+ITERATION_BUCKETS = [1, 2, 3, 4, 5, 6, 8, 10]
+
+SPAN_ANALYSIS = "analysis"
+SPAN_AGENT = "agent"
+SPAN_NODE = "node"
+SPAN_LLM = "llm"
+SPAN_TOOLS = "tools"
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами и оценкой квантилей по ним"""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина - выше верхней границы
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль q"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        labels = [f"<={bound}" for bound in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 2) if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": round(self.max, 2),
+            "buckets": {label: count for label, count in zip(labels, self.counts) if count}
+        }
+
+
+class AnalysisTrace:
+    """Трасса одного анализа клиента"""
+
+    def __init__(self, client_id: int, attributes: Dict[str, Any]):
+        self.client_id = client_id
+        self.attributes = attributes
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "client_id": self.client_id,
+            "started_at": self.started_at.isoformat(),
+            "attributes": self.attributes,
+            "spans": self.spans
+        }
+
+
+class AnalysisTelemetry:
+    """Сбор спанов анализа и агрегированные метрики по агентам"""
+
+    def __init__(self):
+        self._trace: ContextVar[Optional[AnalysisTrace]] = ContextVar("analysis_trace", default=None)
+        self._parent: ContextVar[Optional[int]] = ContextVar("analysis_span_parent", default=None)
+        self._agent: ContextVar[Optional[str]] = ContextVar("analysis_span_agent", default=None)
+        self._lock = threading.Lock()
+        self._durations: Dict[str, Dict[str, Histogram]] = {}
+        self._iterations: Dict[str, Histogram] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._last_traces: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+
+    @contextmanager
+    def analysis(self, client_id: int, **attributes):
+        """Трасса анализа клиента; вложенный вызов для того же клиента продолжает текущую трассу"""
+        current = self._trace.get()
+        if current is not None and current.client_id == client_id:
+            yield current
+            return
+
+        trace = AnalysisTrace(client_id, attributes)
+        trace_token = self._trace.set(trace)
+        parent_token = self._parent.set(None)
+        try:
+            with self.span(SPAN_ANALYSIS, "total", agent="analysis"):
+                yield trace
+        finally:
+            self._parent.reset(parent_token)
+            self._trace.reset(trace_token)
+            with self._lock:
+                self._last_traces[client_id] = trace.to_dict()
+                self._last_traces.move_to_end(client_id)
+                while len(self._last_traces) > settings.analysis_trace_clients:
+                    self._last_traces.popitem(last=False)
+
+    @contextmanager
+    def span(self, kind: str, name: str, agent: Optional[str] = None, **attributes):
+        """Спан с замером длительности; yield возвращает атрибуты, которые можно дополнить внутри"""
+        agent = agent or self._agent.get() or "unknown"
+        trace = self._trace.get()
+        span_id = None
+        if trace is not None:
+            with self._lock:
+                span_id = len(trace.spans)
+                trace.spans.append({
+                    "id": span_id,
+                    "parent_id": self._parent.get(),
+                    "kind": kind,
+                    "name": name,
+                    "agent": agent,
+                    "offset_ms": round((time.perf_counter() - trace.started) * 1000, 1)
+                })
+        parent_token = self._parent.set(span_id) if span_id is not None else None
+        agent_token = self._agent.set(agent)
+        started = time.perf_counter()
+        error = None
+        try:
+            yield attributes
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            self._agent.reset(agent_token)
+            if parent_token is not None:
+                self._parent.reset(parent_token)
+            if error is None:
+                error = attributes.pop("error", None)
+            self._record(agent, kind, name, duration_ms, error)
+            if span_id is not None:
+                with self._lock:
+                    trace.spans[span_id].update({
+                        "duration_ms": round(duration_ms, 1),
+                        "attributes": attributes,
+                        "error": error
+                    })
+
+    def record_iterations(self, agent: str, iterations: int) -> None:
+        """Число итераций agent_loop одного запуска агента"""
+        with self._lock:
+            histogram = self._iterations.get(agent)
+            if histogram is None:
+                histogram = self._iterations[agent] = Histogram(ITERATION_BUCKETS)
+            histogram.observe(iterations)
+
+    def increment(self, agent: str, counter: str, value: int = 1) -> None:
+        """Счетчики агента: повторы LLM, итерации исправления ошибок валидации, токены"""
+        if not value:
+            return
+        with self._lock:
+            counters = self._counters.setdefault(agent, {})
+            counters[counter] = counters.get(counter, 0) + value
+
+    def _record(self, agent: str, kind: str, name: str, duration_ms: float, error: Optional[str]) -> None:
+        key = f"{kind}:{name}"
+        with self._lock:
+            histograms = self._durations.setdefault(agent, {})
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = Histogram(DURATION_BUCKETS_MS)
+            histogram.observe(duration_ms)
+            if error:
+                counters = self._counters.setdefault(agent, {})
+                counters[f"{key}:errors"] = counters.get(f"{key}:errors", 0) + 1
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Гистограммы длительностей (мс), итераций и счетчики по агентам"""
+        with self._lock:
+            agents = set(self._durations) | set(self._iterations) | set(self._counters)
+            return {
+                agent: {
+                    "durations_ms": {
+                        key: histogram.to_dict()
+                        for key, histogram in sorted(self._durations.get(agent, {}).items())
+                    },
+                    "iterations": self._iterations[agent].to_dict() if agent in self._iterations else None,
+                    "counters": dict(self._counters.get(agent, {}))
+                }
+                for agent in sorted(agents)
+            }
+
+    def get_last_trace(self, client_id: int) -> Optional[Dict[str, Any]]:
+        """Трасса последнего анализа клиента"""
+        with self._lock:
+            return self._last_traces.get(client_id)
+
+    def reset(self) -> None:
+        """Сбросить агрегированные метрики (трассы клиентов сохраняются)"""
+        with self._lock:
+            self._durations.clear()
+            self._iterations.clear()
+            self._counters.clear()
+
+
+# Глобальный экземпляр телеметрии
+analysis_telemetry = AnalysisTelemetry()
@@ -124,6 +124,23 @@ def confirm_all_tasks() -> str:
     return "Все задачи подтверждены"
 
 
+# =============================================================================
+# ИНСТРУМЕНТ КЛАССИФИКАТОРА ФИЛЬТРА АНАЛИЗА
+# =============================================================================
+
+@tool
+def classify_new_messages(dossier: bool, car_interest: bool, task: bool) -> str:
+    """
+    Отметить разделы CRM, которые могут измениться из-за новых сообщений.
+    
+    Args:
+        dossier: Новые сообщения содержат факты о клиенте: контакты, город, семья, тип бизнеса
+        car_interest: Новые сообщения меняют автомобильные интересы: марка, модель, бюджет, год, пробег, цвет
+        task: Новые сообщения содержат договоренности, сроки, даты или выполнение обещаний
+    """
+    return "Разделы отмечены"
+
+
 # =============================================================================
 # ГРУППИРОВКА ИНСТРУМЕНТОВ ПО ТИПАМ
 # =============================================================================
@@ -146,4 +163,7 @@ TASK_TOOLS = [
     complete_task,
     delete_task,
     confirm_all_tasks
-] 
\ No newline at end of file
+] 
+
+# Объединенный набор для режима единого анализа (досье + интересы + задачи за один вызов)
+COMBINED_TOOLS = DOSSIER_TOOLS + CAR_INTEREST_TOOLS + TASK_TOOLS
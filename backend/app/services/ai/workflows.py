@@ -2,12 +2,13 @@
 
 import asyncio
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from datetime import datetime, date
 
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 
+from ...core.config import settings
 from ...core.database import SessionLocal
 from ...models.client import Client
 from ...models.message import Message
@@ -19,15 +20,25 @@ from ..task_service import TaskService
 from .dossier_agent import dossier_agent
 from .car_interest_agent import car_interest_agent
 from .task_agent import task_agent
+from .combined_agent import combined_agent
+from .analysis_gate import analysis_gate, ALL_AGENTS, AGENT_DOSSIER, AGENT_CAR_INTEREST, AGENT_TASK
+from .telemetry import analysis_telemetry, SPAN_NODE
 from ..notification_service import (
     sync_send_dossier_notification,
     sync_send_car_interest_notification,
     sync_send_task_notification
 )
+from ..analysis_job_service import AnalysisJobService, analysis_job_workers
 from ..timer_service import analysis_timers
+from ..chat_history_cache import chat_history_cache
+from ..llm_usage_service import LLMUsageService, BUDGET_DOWNGRADE, BUDGET_SKIP
 
 logger = logging.getLogger(__name__)
 
+# Режимы полного анализа клиента (settings.analysis_mode)
+ANALYSIS_MODE_PER_AGENT = "per_agent"
+ANALYSIS_MODE_COMBINED = "combined"
+
 
 def _parse_due_date_for_update(due_date_str: str) -> datetime:
     """Преобразует строку datetime в объект datetime для обновлений задач с временем по умолчанию 8:00"""
@@ -60,25 +71,319 @@ class ClientAnalysisWorkflow:
     @staticmethod
     def format_chat_history(messages) -> str:
         """Форматирует историю чата для анализа AI"""
-        formatted_messages = []
-        for msg in messages:
-            sender = "Клиент" if msg.sender.value == "client" else "Менеджер"
-            content = msg.content
+        return chat_history_cache.get_text(messages)
+    
+    @staticmethod
+    def _apply_dossier_result(db: Session, client_id: int, client_name: str,
+                              dossier_result: Dict[str, Any], results: Dict[str, Any]) -> None:
+        """Применяет результат анализа досье через DossierService"""
+        if dossier_result["updates"]:
+            # Обновляем только измененные поля
+            DossierService.update_or_create_dossier(
+                db, client_id, {"client_info": dossier_result["updates"]}, 
+                notify_callback=sync_send_dossier_notification
+            )
+            results["dossier"] = f"Досье для клиента {client_name} обновлено: {', '.join(dossier_result['updates'].keys())}"
+            logger.info(results["dossier"])
+        elif dossier_result["confirmed"]:
+            results["dossier"] = f"Досье для клиента {client_name} подтверждено без изменений"
+            logger.info(results["dossier"])
+        
+        if dossier_result["errors"]:
+            results["dossier_errors"] = dossier_result["errors"]
+        if not dossier_result["confirmed"]:
+            results.setdefault("unconfirmed", []).append("dossier")
+    
+    @staticmethod
+    def _apply_car_interest_result(db: Session, client_id: int, client_name: str,
+                                   car_interest_result: Dict[str, Any], results: Dict[str, Any]) -> None:
+        """Применяет результат анализа автомобильных интересов через CarInterestService"""
+        if car_interest_result["updates"]:
+            updates = car_interest_result["updates"]
+            
+            # Получаем текущие запросы
+            current_car_interest = CarInterestService.get_car_interest_by_client(db, client_id)
+            current_queries = []
+            if current_car_interest and current_car_interest.structured_data:
+                current_queries = current_car_interest.structured_data.get("queries", [])
+            
+            # Применяем удаления (в обратном порядке чтобы не сбить индексы)
+            for index in sorted(updates.get("delete_indices", []), reverse=True):
+                if 0 <= index < len(current_queries):
+                    current_queries.pop(index)
+            
+            # Применяем обновления
+            for update in updates.get("update_queries", []):
+                index = update["index"]
+                if 0 <= index < len(current_queries):
+                    current_queries[index] = update["query"]
+            
+            # Добавляем новые запросы
+            current_queries.extend(updates.get("add_queries", []))
+            
+            # Сохраняем обновленные запросы
+            CarInterestService.update_or_create_car_interest(
+                db, client_id, {"queries": current_queries}, 
+                notify_callback=sync_send_car_interest_notification
+            )
             
-            # Добавляем информацию о типе контента
-            if msg.content_type != "text":
-                content = f"[{msg.content_type.upper()}] {content}"
+            changes = []
+            if updates.get("add_queries"):
+                changes.append(f"добавлено {len(updates['add_queries'])}")
+            if updates.get("update_queries"):
+                changes.append(f"обновлено {len(updates['update_queries'])}")
+            if updates.get("delete_indices"):
+                changes.append(f"удалено {len(updates['delete_indices'])}")
             
-            formatted_messages.append(f"{sender}: {content}")
+            if changes:
+                results["car_interests"] = f"Автомобильные интересы для клиента {client_name}: {', '.join(changes)}"
+            
+            logger.info(results.get("car_interests", "Автомобильные интересы обновлены"))
+            
+        elif car_interest_result["confirmed"]:
+            results["car_interests"] = f"Автомобильные интересы для клиента {client_name} подтверждены без изменений"
+            logger.info(results["car_interests"])
+        
+        if car_interest_result["errors"]:
+            results["car_interests_errors"] = car_interest_result["errors"]
+        if not car_interest_result["confirmed"]:
+            results.setdefault("unconfirmed", []).append("car_interests")
+    
+    @staticmethod
+    def _task_notification_data(task) -> Dict[str, Any]:
+        """Данные задачи для WebSocket уведомления"""
+        return {
+            "id": task.id,
+            "client_id": task.client_id,
+            "description": task.description,
+            "due_date": task.due_date.isoformat() if task.due_date else None,
+            "is_completed": task.is_completed,
+            "priority": task.priority,
+            "source": task.source,
+            "created_at": task.created_at.isoformat() if task.created_at else None,
+            "updated_at": task.updated_at.isoformat() if task.updated_at else None
+        }
+    
+    @staticmethod
+    def _apply_task_result(db: Session, client_id: int, client_name: str,
+                           task_result: Dict[str, Any], results: Dict[str, Any]) -> None:
+        """Применяет результат анализа задач через TaskService"""
+        # Создаем новые задачи
+        if task_result["new_tasks"]:
+            created_tasks = TaskService.create_multiple_tasks(
+                db, client_id, task_result["new_tasks"], 
+                notify_callback=sync_send_task_notification
+            )
+            results["new_tasks"] = f"Создано {len(created_tasks)} новых задач для клиента {client_name}"
+            logger.info(results["new_tasks"])
+        
+        # Обновляем существующие задачи
+        if task_result["updated_tasks"]:
+            for update in task_result["updated_tasks"]:
+                update = dict(update)
+                task_id = update.pop("task_id")
+                
+                # Преобразуем due_date если он есть
+                if "due_date" in update and update["due_date"]:
+                    update["due_date"] = _parse_due_date_for_update(update["due_date"])
+                
+                # Создаем объект TaskUpdate из оставшихся полей
+                task_update = TaskUpdate(**update)
+                updated_task = TaskService.update_task(db, task_id, task_update)
+                
+                # Отправляем WebSocket уведомление
+                if updated_task:
+                    sync_send_task_notification(
+                        client_id, ClientAnalysisWorkflow._task_notification_data(updated_task)
+                    )
+            results["updated_tasks"] = f"Обновлено {len(task_result['updated_tasks'])} задач для клиента {client_name}"
+            logger.info(results["updated_tasks"])
+        
+        # Отмечаем выполненные задачи
+        if task_result["completed_task_ids"]:
+            for task_id in task_result["completed_task_ids"]:
+                completed_task = TaskService.complete_task(db, task_id)
+                
+                # Отправляем WebSocket уведомление
+                if completed_task:
+                    sync_send_task_notification(
+                        client_id, ClientAnalysisWorkflow._task_notification_data(completed_task)
+                    )
+            results["completed_tasks"] = f"Выполнено {len(task_result['completed_task_ids'])} задач для клиента {client_name}"
+            logger.info(results["completed_tasks"])
+        
+        # Удаляем неактуальные задачи
+        if task_result["deleted_task_ids"]:
+            for task_id in task_result["deleted_task_ids"]:
+                deleted = TaskService.delete_task(db, task_id)
+                
+                # Отправляем WebSocket уведомление об удалении
+                if deleted:
+                    sync_send_task_notification(
+                        client_id,
+                        {
+                            "deleted_task_id": task_id
+                        }
+                    )
+            results["deleted_tasks"] = f"Удалено {len(task_result['deleted_task_ids'])} задач для клиента {client_name}"
+            logger.info(results["deleted_tasks"])
+        
+        if task_result["confirmed"] and not any([
+            task_result["new_tasks"],
+            task_result["updated_tasks"],
+            task_result["completed_task_ids"],
+            task_result["deleted_task_ids"]
+        ]):
+            results["tasks"] = f"Задачи для клиента {client_name} подтверждены без изменений"
+            logger.info(results["tasks"])
+        
+        if task_result["errors"]:
+            results["tasks_errors"] = task_result["errors"]
+        if not task_result["confirmed"]:
+            results.setdefault("unconfirmed", []).append("tasks")
+    
+    @staticmethod
+    def _total_usage(usage_by_agent: Dict[str, Dict[str, int]]) -> Dict[str, int]:
+        """Суммарное использование токенов по всем агентам прогона"""
+        total = {"llm_calls": 0, "input_tokens": 0, "output_tokens": 0, "tool_calls": 0, "cache_hits": 0}
+        for usage in usage_by_agent.values():
+            for key in total:
+                total[key] += usage.get(key, 0)
+        return total
+    
+    @staticmethod
+    def analysis_error(results: Dict[str, Any]) -> Optional[str]:
+        """Причина неудачного анализа или None, если все запущенные разделы выполнены и подтверждены
+        
+        Неудачей считаются исключения (ключи *_error), ошибки агентов - отказ LLM, лимит
+        итераций (списки *_errors) и раздел, который агент не подтвердил.
+        """
+        if results.get("error"):
+            return str(results["error"])
+        for key, value in results.items():
+            if key.endswith("_error") and value:
+                return str(value)
+            if key.endswith("_errors") and value:
+                return "; ".join(str(error) for error in value)
+        if results.get("unconfirmed"):
+            return f"Анализ не подтвержден агентом: {', '.join(results['unconfirmed'])}"
+        return None
+    
+    @staticmethod
+    def _mark_analyzed(db: Session, client: Client, messages: List[Message]) -> None:
+        """Запоминает последнее сообщение, учтенное анализом, для фильтра следующего запуска"""
+        client.last_analyzed_message_id = max(msg.id for msg in messages)
+        db.commit()
+    
+    @staticmethod
+    def _run_per_agent_analysis(db: Session, client_id: int, client_name: str, messages: List[Message],
+                                agents: List[str] = ALL_AGENTS,
+                                last_analyzed_message_id: Optional[int] = None) -> Dict[str, Any]:
+        """Анализ отдельными агентами, каждый со своей копией истории чата"""
+        results = {}
+        usage = {}
+        
+        # Анализ досье
+        if AGENT_DOSSIER in agents:
+            try:
+                dossier_result = dossier_agent.analyze(client_id, client_name, messages, last_analyzed_message_id)
+                usage["dossier"] = dossier_result.get("usage", {})
+                ClientAnalysisWorkflow._apply_dossier_result(db, client_id, client_name, dossier_result, results)
+            except Exception as e:
+                error_msg = f"Ошибка анализа досье: {str(e)}"
+                logger.error(error_msg)
+                results["dossier_error"] = error_msg
+        
+        # Анализ автомобильных интересов
+        if AGENT_CAR_INTEREST in agents:
+            try:
+                car_interest_result = car_interest_agent.analyze(client_id, client_name, messages, last_analyzed_message_id)
+                usage["car_interest"] = car_interest_result.get("usage", {})
+                ClientAnalysisWorkflow._apply_car_interest_result(db, client_id, client_name, car_interest_result, results)
+            except Exception as e:
+                error_msg = f"Ошибка анализа автомобильных интересов: {str(e)}"
+                logger.error(error_msg)
+                results["car_interests_error"] = error_msg
+        
+        # Анализ задач
+        if AGENT_TASK in agents:
+            try:
+                task_result = task_agent.analyze(client_id, client_name, messages, last_analyzed_message_id)
+                usage["task"] = task_result.get("usage", {})
+                ClientAnalysisWorkflow._apply_task_result(db, client_id, client_name, task_result, results)
+            except Exception as e:
+                error_msg = f"Ошибка анализа задач: {str(e)}"
+                logger.error(error_msg)
+                results["tasks_error"] = error_msg
+        
+        results["usage"] = {**usage, "total": ClientAnalysisWorkflow._total_usage(usage)}
+        return results
+    
+    @staticmethod
+    def _run_combined_analysis(db: Session, client_id: int, client_name: str, messages: List[Message],
+                               last_analyzed_message_id: Optional[int] = None) -> Dict[str, Any]:
+        """Анализ одним вызовом: история чата передается в LLM один раз для всех разделов"""
+        results = {}
+        
+        try:
+            combined_result = combined_agent.analyze(client_id, client_name, messages, last_analyzed_message_id)
+        except Exception as e:
+            error_msg = f"Ошибка единого анализа: {str(e)}"
+            logger.error(error_msg)
+            results["combined_error"] = error_msg
+            return results
         
-        return "\n".join(formatted_messages)
+        # Каждый раздел применяется независимо, ошибка одного не блокирует остальные
+        try:
+            ClientAnalysisWorkflow._apply_dossier_result(db, client_id, client_name, combined_result["dossier"], results)
+        except Exception as e:
+            error_msg = f"Ошибка применения досье: {str(e)}"
+            logger.error(error_msg)
+            results["dossier_error"] = error_msg
+        
+        try:
+            ClientAnalysisWorkflow._apply_car_interest_result(db, client_id, client_name, combined_result["car_interest"], results)
+        except Exception as e:
+            error_msg = f"Ошибка применения автомобильных интересов: {str(e)}"
+            logger.error(error_msg)
+            results["car_interests_error"] = error_msg
+        
+        try:
+            ClientAnalysisWorkflow._apply_task_result(db, client_id, client_name, combined_result["task"], results)
+        except Exception as e:
+            error_msg = f"Ошибка применения задач: {str(e)}"
+            logger.error(error_msg)
+            results["tasks_error"] = error_msg
+        
+        if combined_result["errors"]:
+            results["combined_errors"] = combined_result["errors"]
+        
+        usage = {"combined": combined_result["usage"]}
+        results["usage"] = {**usage, "total": ClientAnalysisWorkflow._total_usage(usage)}
+        return results
+    
+    @staticmethod
+    def analyze_client_complete(client_id: int, mode: Optional[str] = None, force: bool = False) -> Dict[str, Any]:
+        """Полный анализ клиента: досье, автомобильные интересы и задачи
+        
+        Args:
+            client_id: ID клиента
+            mode: "per_agent" или "combined"; по умолчанию settings.analysis_mode
+            force: запустить все агенты, минуя фильтр новых сообщений (ручной анализ)
+        """
+        mode = mode or settings.analysis_mode
+        with analysis_telemetry.analysis(client_id, mode=mode, force=force) as trace:
+            results = ClientAnalysisWorkflow._analyze_client(client_id, mode, force)
+            trace.attributes["agents"] = results.get("gate", {}).get("agents", [])
+            trace.attributes["usage"] = results.get("usage", {}).get("total")
+            return results
     
     @staticmethod
-    def analyze_client_complete(client_id: int) -> Dict[str, Any]:
-        """Полный анализ клиента: досье, автомобильные интересы и задачи"""
+    def _analyze_client(client_id: int, mode: str, force: bool) -> Dict[str, Any]:
+        """Полный анализ клиента в трассе телеметрии (см. analyze_client_complete)"""
         db = SessionLocal()
         try:
-            logger.info(f"Начинаем полный анализ для клиента {client_id}")
+            logger.info(f"Начинаем полный анализ для клиента {client_id} (режим: {mode})")
             
             # Получаем клиента
             client = db.query(Client).filter(Client.id == client_id).first()
@@ -95,192 +400,51 @@ class ClientAnalysisWorkflow:
                 return {"info": info_msg}
 
             client_name = client.name or f"ID {client.pact_conversation_id}"
-            results = {}
             
-            # Анализ досье
-            try:
-                dossier_result = dossier_agent.analyze(client_id, client_name, messages)
-                
-                if dossier_result["updates"]:
-                    # Обновляем только измененные поля
-                    dossier = DossierService.update_or_create_dossier(
-                        db, client_id, {"client_info": dossier_result["updates"]}, 
-                        notify_callback=sync_send_dossier_notification
-                    )
-                    results["dossier"] = f"Досье для клиента {client_name} обновлено: {', '.join(dossier_result['updates'].keys())}"
-                    logger.info(results["dossier"])
-                elif dossier_result["confirmed"]:
-                    results["dossier"] = f"Досье для клиента {client_name} подтверждено без изменений"
-                    logger.info(results["dossier"])
-                
-                if dossier_result["errors"]:
-                    results["dossier_errors"] = dossier_result["errors"]
-                    
-            except Exception as e:
-                error_msg = f"Ошибка анализа досье: {str(e)}"
-                logger.error(error_msg)
-                results["dossier_error"] = error_msg
+            # Решаем, какие агенты нужны для новых сообщений
+            if force:
+                gate_decision = {"agents": list(ALL_AGENTS), "stage": "forced", "reason": "ручной запуск"}
+            else:
+                with analysis_telemetry.span(SPAN_NODE, "gate", agent="analysis") as span:
+                    gate_decision = analysis_gate.decide(messages, client.last_analyzed_message_id)
+                    span.update(stage=gate_decision["stage"], agents=gate_decision["agents"])
+            agents = gate_decision["agents"]
             
-            # Анализ автомобильных интересов
-            try:
-                car_interest_result = car_interest_agent.analyze(client_id, client_name, messages)
-                
-                if car_interest_result["updates"]:
-                    updates = car_interest_result["updates"]
-                    
-                    # Получаем текущие запросы
-                    current_car_interest = CarInterestService.get_car_interest_by_client(db, client_id)
-                    current_queries = []
-                    if current_car_interest and current_car_interest.structured_data:
-                        current_queries = current_car_interest.structured_data.get("queries", [])
-                    
-                    # Применяем удаления (в обратном порядке чтобы не сбить индексы)
-                    for index in sorted(updates.get("delete_indices", []), reverse=True):
-                        if 0 <= index < len(current_queries):
-                            current_queries.pop(index)
-                    
-                    # Применяем обновления
-                    for update in updates.get("update_queries", []):
-                        index = update["index"]
-                        if 0 <= index < len(current_queries):
-                            current_queries[index] = update["query"]
-                    
-                    # Добавляем новые запросы
-                    current_queries.extend(updates.get("add_queries", []))
-                    
-                    # Сохраняем обновленные запросы
-                    car_interest = CarInterestService.update_or_create_car_interest(
-                        db, client_id, {"queries": current_queries}, 
-                        notify_callback=sync_send_car_interest_notification
-                    )
-                    
-                    changes = []
-                    if updates.get("add_queries"):
-                        changes.append(f"добавлено {len(updates['add_queries'])}")
-                    if updates.get("update_queries"):
-                        changes.append(f"обновлено {len(updates['update_queries'])}")
-                    if updates.get("delete_indices"):
-                        changes.append(f"удалено {len(updates['delete_indices'])}")
-                    
-                    if changes:
-                        results["car_interests"] = f"Автомобильные интересы для клиента {client_name}: {', '.join(changes)}"
-                    
-                    logger.info(results.get("car_interests", "Автомобильные интересы обновлены"))
-                    
-                elif car_interest_result["confirmed"]:
-                    results["car_interests"] = f"Автомобильные интересы для клиента {client_name} подтверждены без изменений"
-                    logger.info(results["car_interests"])
-                
-                if car_interest_result["errors"]:
-                    results["car_interests_errors"] = car_interest_result["errors"]
-                    
-            except Exception as e:
-                error_msg = f"Ошибка анализа автомобильных интересов: {str(e)}"
-                logger.error(error_msg)
-                results["car_interests_error"] = error_msg
+            if not agents:
+                ClientAnalysisWorkflow._mark_analyzed(db, client, messages)
+                return {"skipped": gate_decision["reason"], "gate": gate_decision, "analysis_mode": mode}
             
-            # Анализ задач
-            try:
-                task_result = task_agent.analyze(client_id, client_name, messages)
-                
-                # Создаем новые задачи
-                if task_result["new_tasks"]:
-                    created_tasks = TaskService.create_multiple_tasks(
-                        db, client_id, task_result["new_tasks"], 
-                        notify_callback=sync_send_task_notification
-                    )
-                    results["new_tasks"] = f"Создано {len(created_tasks)} новых задач для клиента {client_name}"
-                    logger.info(results["new_tasks"])
-                
-                # Обновляем существующие задачи
-                if task_result["updated_tasks"]:
-                    for update in task_result["updated_tasks"]:
-                        task_id = update.pop("task_id")
-                        
-                        # Преобразуем due_date если он есть
-                        if "due_date" in update and update["due_date"]:
-                            update["due_date"] = _parse_due_date_for_update(update["due_date"])
-                        
-                        # Создаем объект TaskUpdate из оставшихся полей
-                        task_update = TaskUpdate(**update)
-                        updated_task = TaskService.update_task(db, task_id, task_update)
-                        
-                        # Отправляем WebSocket уведомление
-                        if updated_task:
-                            sync_send_task_notification(
-                                client_id,
-                                {
-                                    "id": updated_task.id,
-                                    "client_id": updated_task.client_id,
-                                    "description": updated_task.description,
-                                    "due_date": updated_task.due_date.isoformat() if updated_task.due_date else None,
-                                    "is_completed": updated_task.is_completed,
-                                    "priority": updated_task.priority,
-                                    "source": updated_task.source,
-                                    "created_at": updated_task.created_at.isoformat() if updated_task.created_at else None,
-                                    "updated_at": updated_task.updated_at.isoformat() if updated_task.updated_at else None
-                                }
-                            )
-                    results["updated_tasks"] = f"Обновлено {len(task_result['updated_tasks'])} задач для клиента {client_name}"
-                    logger.info(results["updated_tasks"])
-                
-                # Отмечаем выполненные задачи
-                if task_result["completed_task_ids"]:
-                    for task_id in task_result["completed_task_ids"]:
-                        completed_task = TaskService.complete_task(db, task_id)
-                        
-                        # Отправляем WebSocket уведомление
-                        if completed_task:
-                            sync_send_task_notification(
-                                client_id,
-                                {
-                                    "id": completed_task.id,
-                                    "client_id": completed_task.client_id,
-                                    "description": completed_task.description,
-                                    "due_date": completed_task.due_date.isoformat() if completed_task.due_date else None,
-                                    "is_completed": completed_task.is_completed,
-                                    "priority": completed_task.priority,
-                                    "source": completed_task.source,
-                                    "created_at": completed_task.created_at.isoformat() if completed_task.created_at else None,
-                                    "updated_at": completed_task.updated_at.isoformat() if completed_task.updated_at else None
-                                }
-                            )
-                    results["completed_tasks"] = f"Выполнено {len(task_result['completed_task_ids'])} задач для клиента {client_name}"
-                    logger.info(results["completed_tasks"])
-                
-                # Удаляем неактуальные задачи
-                if task_result["deleted_task_ids"]:
-                    for task_id in task_result["deleted_task_ids"]:
-                        deleted = TaskService.delete_task(db, task_id)
-                        
-                        # Отправляем WebSocket уведомление об удалении
-                        if deleted:
-                            sync_send_task_notification(
-                                client_id,
-                                {
-                                    "deleted_task_id": task_id
-                                }
-                            )
-                    results["deleted_tasks"] = f"Удалено {len(task_result['deleted_task_ids'])} задач для клиента {client_name}"
-                    logger.info(results["deleted_tasks"])
-                
-                if task_result["confirmed"] and not any([
-                    task_result["new_tasks"],
-                    task_result["updated_tasks"],
-                    task_result["completed_task_ids"],
-                    task_result["deleted_task_ids"]
-                ]):
-                    results["tasks"] = f"Задачи для клиента {client_name} подтверждены без изменений"
-                    logger.info(results["tasks"])
-                
-                if task_result["errors"]:
-                    results["tasks_errors"] = task_result["errors"]
-                    
-            except Exception as e:
-                error_msg = f"Ошибка анализа задач: {str(e)}"
-                logger.error(error_msg)
-                results["tasks_error"] = error_msg
+            # Месячный бюджет клиента: при превышении анализ пропускается или идет одним вызовом.
+            # Ручной запуск бюджетом не ограничивается
+            budget = None
+            if not force:
+                budget = LLMUsageService.check_budget(db, client)
+                if budget["action"] == BUDGET_SKIP:
+                    logger.warning(f"Анализ клиента {client_id} пропущен: бюджет {budget['budget_usd']}$ исчерпан ({budget['spent_usd']}$)")
+                    # Сообщения не отмечаются проанализированными - их учтет анализ после пополнения бюджета
+                    return {"skipped": "бюджет LLM исчерпан", "gate": gate_decision, "budget": budget, "analysis_mode": mode}
+                if budget["action"] == BUDGET_DOWNGRADE:
+                    mode = ANALYSIS_MODE_COMBINED
             
+            # Единый вызов выгоден только когда нужно больше одного раздела
+            if mode == ANALYSIS_MODE_COMBINED and len(agents) > 1:
+                results = ClientAnalysisWorkflow._run_combined_analysis(
+                    db, client_id, client_name, messages, client.last_analyzed_message_id
+                )
+            else:
+                results = ClientAnalysisWorkflow._run_per_agent_analysis(
+                    db, client_id, client_name, messages, agents, client.last_analyzed_message_id
+                )
+            
+            # Неудачный анализ оставляет сообщения неучтенными, чтобы следующий анализ их повторил
+            if ClientAnalysisWorkflow.analysis_error(results) is None:
+                ClientAnalysisWorkflow._mark_analyzed(db, client, messages)
+            
+            results["gate"] = gate_decision
+            results["analysis_mode"] = mode
+            if budget is not None:
+                results["budget"] = budget
+            logger.info(f"Токены анализа клиента {client_id} ({mode}): {results['usage'].get('total') if 'usage' in results else 'нет данных'}")
             return results
         
         except Exception as e:
@@ -290,6 +454,52 @@ class ClientAnalysisWorkflow:
         finally:
             db.close()
     
+    @staticmethod
+    def compare_analysis_modes(client_id: int) -> Dict[str, Any]:
+        """Прогоняет оба режима анализа без применения результатов, для сравнения качества и стоимости"""
+        db = SessionLocal()
+        try:
+            client = db.query(Client).filter(Client.id == client_id).first()
+            if not client:
+                return {"error": f"Клиент {client_id} не найден"}
+            
+            messages = MessageService.get_chat_history(db, client_id)
+            if not messages:
+                return {"info": f"Нет сообщений для клиента {client_id}"}
+            
+            client_name = client.name or f"ID {client.pact_conversation_id}"
+            last_analyzed_message_id = client.last_analyzed_message_id
+        finally:
+            db.close()
+        
+        per_agent = {
+            "dossier": dossier_agent.analyze(client_id, client_name, messages, last_analyzed_message_id),
+            "car_interest": car_interest_agent.analyze(client_id, client_name, messages, last_analyzed_message_id),
+            "task": task_agent.analyze(client_id, client_name, messages, last_analyzed_message_id)
+        }
+        per_agent_usage = {name: result.get("usage", {}) for name, result in per_agent.items()}
+        
+        combined = combined_agent.analyze(client_id, client_name, messages, last_analyzed_message_id)
+        combined_usage = {"combined": combined["usage"]}
+        
+        return {
+            "client_id": client_id,
+            "messages_count": len(messages),
+            ANALYSIS_MODE_PER_AGENT: {
+                "results": per_agent,
+                "usage": ClientAnalysisWorkflow._total_usage(per_agent_usage)
+            },
+            ANALYSIS_MODE_COMBINED: {
+                "results": {
+                    "dossier": combined["dossier"],
+                    "car_interest": combined["car_interest"],
+                    "task": combined["task"],
+                    "errors": combined["errors"]
+                },
+                "usage": ClientAnalysisWorkflow._total_usage(combined_usage)
+            }
+        }
+    
     @staticmethod
     def analyze_client_dossier(client_id: int) -> str:
         """Анализ только досье клиента"""
@@ -311,24 +521,11 @@ class ClientAnalysisWorkflow:
 
             client_name = client.name or f"ID {client.pact_conversation_id}"
 
-            # Запускаем анализ досье
-            dossier_result = dossier_agent.analyze(client_id, client_name, messages)
-            
-            if dossier_result["updates"]:
-                # Обновляем только измененные поля
-                dossier = DossierService.update_or_create_dossier(
-                    db, client_id, {"client_info": dossier_result["updates"]}, 
-                    notify_callback=sync_send_dossier_notification
-                )
-                result = f"Досье для клиента {client_name} обновлено: {', '.join(dossier_result['updates'].keys())}"
-                logger.info(result)
-                return result
-            elif dossier_result["confirmed"]:
-                result = f"Досье для клиента {client_name} подтверждено без изменений"
-                logger.info(result)
-                return result
-            else:
-                return f"Не удалось проанализировать досье для клиента {client_name}"
+            # Запускаем анализ досье и применяем результат общим путем
+            dossier_result = dossier_agent.analyze(client_id, client_name, messages, client.last_analyzed_message_id)
+            results = {}
+            ClientAnalysisWorkflow._apply_dossier_result(db, client_id, client_name, dossier_result, results)
+            return results.get("dossier") or f"Не удалось проанализировать досье для клиента {client_name}"
         
         except Exception as e:
             error_msg = f"Ошибка при анализе досье клиента {client_id}: {str(e)}"
@@ -358,57 +555,11 @@ class ClientAnalysisWorkflow:
 
             client_name = client.name or f"ID {client.pact_conversation_id}"
 
-            # Запускаем анализ автомобильных интересов
-            car_interest_result = car_interest_agent.analyze(client_id, client_name, messages)
-            
-            if car_interest_result["updates"]:
-                updates = car_interest_result["updates"]
-                
-                # Получаем текущие запросы
-                current_car_interest = CarInterestService.get_car_interest_by_client(db, client_id)
-                current_queries = []
-                if current_car_interest and current_car_interest.structured_data:
-                    current_queries = current_car_interest.structured_data.get("queries", [])
-                
-                # Применяем удаления (в обратном порядке)
-                for index in sorted(updates.get("delete_indices", []), reverse=True):
-                    if 0 <= index < len(current_queries):
-                        current_queries.pop(index)
-                
-                # Применяем обновления
-                for update in updates.get("update_queries", []):
-                    index = update["index"]
-                    if 0 <= index < len(current_queries):
-                        current_queries[index] = update["query"]
-                
-                # Добавляем новые запросы
-                current_queries.extend(updates.get("add_queries", []))
-                
-                # Сохраняем обновленные запросы
-                car_interest = CarInterestService.update_or_create_car_interest(
-                    db, client_id, {"queries": current_queries}, 
-                    notify_callback=sync_send_car_interest_notification
-                )
-                
-                changes = []
-                if updates.get("add_queries"):
-                    changes.append(f"добавлено {len(updates['add_queries'])}")
-                if updates.get("update_queries"):
-                    changes.append(f"обновлено {len(updates['update_queries'])}")
-                if updates.get("delete_indices"):
-                    changes.append(f"удалено {len(updates['delete_indices'])}")
-                
-                result = f"Автомобильные интересы для клиента {client_name}: {', '.join(changes)}"
-                
-                logger.info(result)
-                return result
-                
-            elif car_interest_result["confirmed"]:
-                result = f"Автомобильные интересы для клиента {client_name} подтверждены без изменений"
-                logger.info(result)
-                return result
-            else:
-                return f"Не удалось проанализировать автомобильные интересы для клиента {client_name}"
+            # Запускаем анализ автомобильных интересов и применяем результат общим путем
+            car_interest_result = car_interest_agent.analyze(client_id, client_name, messages, client.last_analyzed_message_id)
+            results = {}
+            ClientAnalysisWorkflow._apply_car_interest_result(db, client_id, client_name, car_interest_result, results)
+            return results.get("car_interests") or f"Не удалось проанализировать автомобильные интересы для клиента {client_name}"
         
         except Exception as e:
             error_msg = f"Ошибка при анализе автомобильных интересов клиента {client_id}: {str(e)}"
@@ -438,59 +589,16 @@ class ClientAnalysisWorkflow:
 
             client_name = client.name or f"ID {client.pact_conversation_id}"
 
-            # Запускаем анализ задач
-            task_result = task_agent.analyze(client_id, client_name, messages)
-            
-            results = []
-            
-            # Создаем новые задачи
-            if task_result["new_tasks"]:
-                created_tasks = TaskService.create_multiple_tasks(
-                    db, client_id, task_result["new_tasks"], 
-                    notify_callback=sync_send_task_notification
-                )
-                results.append(f"Создано {len(created_tasks)} новых задач")
-                logger.info(f"Создано {len(created_tasks)} новых задач для клиента {client_name}")
-            
-            # Обновляем существующие задачи
-            if task_result["updated_tasks"]:
-                for update in task_result["updated_tasks"]:
-                    task_id = update.pop("task_id")
-                    
-                    # Преобразуем due_date если он есть
-                    if "due_date" in update and update["due_date"]:
-                        update["due_date"] = _parse_due_date_for_update(update["due_date"])
-                    
-                    task_update = TaskUpdate(**update)
-                    TaskService.update_task(db, task_id, task_update)
-                results.append(f"Обновлено {len(task_result['updated_tasks'])} задач")
-                logger.info(f"Обновлено {len(task_result['updated_tasks'])} задач для клиента {client_name}")
-            
-            # Отмечаем выполненные задачи
-            if task_result["completed_task_ids"]:
-                for task_id in task_result["completed_task_ids"]:
-                    TaskService.complete_task(db, task_id)
-                results.append(f"Выполнено {len(task_result['completed_task_ids'])} задач")
-                logger.info(f"Выполнено {len(task_result['completed_task_ids'])} задач для клиента {client_name}")
-            
-            # Удаляем неактуальные задачи
-            if task_result["deleted_task_ids"]:
-                for task_id in task_result["deleted_task_ids"]:
-                    TaskService.delete_task(db, task_id)
-                results.append(f"Удалено {len(task_result['deleted_task_ids'])} задач")
-                logger.info(f"Удалено {len(task_result['deleted_task_ids'])} задач для клиента {client_name}")
+            # Запускаем анализ задач и применяем результат общим путем
+            task_result = task_agent.analyze(client_id, client_name, messages, client.last_analyzed_message_id)
+            results = {}
+            ClientAnalysisWorkflow._apply_task_result(db, client_id, client_name, task_result, results)
             
-            if task_result["confirmed"] and not any([
-                task_result["new_tasks"],
-                task_result["updated_tasks"],
-                task_result["completed_task_ids"],
-                task_result["deleted_task_ids"]
-            ]):
-                result = f"Задачи для клиента {client_name} подтверждены без изменений"
-                logger.info(result)
-                return result
-            elif results:
-                return f"Задачи для клиента {client_name}: {', '.join(results)}"
+            changes = [results[key] for key in ("new_tasks", "updated_tasks", "completed_tasks", "deleted_tasks") if key in results]
+            if "tasks" in results:
+                return results["tasks"]
+            elif changes:
+                return "; ".join(changes)
             else:
                 return f"Не удалось проанализировать задачи для клиента {client_name}"
         
@@ -502,15 +610,25 @@ class ClientAnalysisWorkflow:
             db.close()
     
     @staticmethod
-    def schedule_analysis_after_delay(client_id: int, delay_minutes: int = 5) -> None:
-        """Запланировать анализ диалога, автомобильных интересов и задач через указанное время"""
-        def perform_analysis():
-            try:
-                logger.info(f"Выполняется запланированный анализ для клиента {client_id}")
-                ClientAnalysisWorkflow.analyze_client_complete(client_id)
-            except Exception as e:
-                logger.error(f"Ошибка при запланированном анализе клиента {client_id}: {e}")
+    def schedule_analysis_after_delay(client_id: int, delay_minutes: Optional[float] = None) -> None:
+        """Запланировать анализ диалога, автомобильных интересов и задач после нового сообщения
+        
+        Анализ ставится в очередь analysis_jobs: новое сообщение переносит срок ожидающей задачи
+        по AnalysisDebouncePolicy (пауза в переписке, но не дольше максимального ожидания),
+        а саму задачу выполнит воркер любой реплики, даже после рестарта.
         
-        # Используем механизм таймеров
-        delay_seconds = delay_minutes * 60
-        analysis_timers.schedule(client_id, perform_analysis, delay_seconds) 
\ No newline at end of file
+        Args:
+            delay_minutes: явная задержка вместо адаптивной (максимальное ожидание соблюдается всегда)
+        """
+        delay_seconds = delay_minutes * 60 if delay_minutes is not None else None
+        db = SessionLocal()
+        try:
+            job = AnalysisJobService.enqueue(db, client_id, delay_seconds)
+            wait_seconds = max(0.0, (job.run_after - datetime.utcnow()).total_seconds())
+        except Exception as e:
+            logger.error(f"Ошибка постановки анализа клиента {client_id} в очередь: {e}")
+            return
+        finally:
+            db.close()
+        # Локальные воркеры просыпаются ровно к сроку задачи, не дожидаясь очередного опроса БД
+        analysis_timers.schedule(client_id, analysis_job_workers.wake, wait_seconds)
@@ -0,0 +1,353 @@
+"""Очередь отложенного AI анализа клиентов в таблице analysis_jobs
+
+Задачи хранятся в БД, поэтому переживают деплой и рестарт, а несколько реплик
+backend разбирают одну очередь: задача захватывается атомарным условным UPDATE
+(на PostgreSQL дополнительно SELECT ... FOR UPDATE SKIP LOCKED).
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any
+
+from sqlalchemy import func, exists
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..models.analysis_job import AnalysisJob, AnalysisJobStatus
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisDebouncePolicy:
+    """Когда запускать анализ клиента после очередного сообщения
+
+    Trailing debounce: анализ ждет паузу в переписке. Длина паузы подстраивается под темп
+    клиента (примерно два средних интервала между его сообщениями), а общий срок ожидания
+    ограничен max_wait от первого непроанализированного сообщения, чтобы активный
+    собеседник не откладывал анализ бесконечно.
+    """
+
+    @staticmethod
+    def trailing_delay(job: Optional[AnalysisJob], now: datetime) -> float:
+        """Задержка после последнего сообщения с учетом темпа переписки"""
+        if job is None or not job.first_requested_at or job.request_count < 2:
+            return settings.analysis_debounce_seconds
+
+        # Средний интервал между сообщениями: request_count уже включает текущее,
+        # и от первого до текущего request_count - 1 интервалов
+        average_gap = (now - job.first_requested_at).total_seconds() / (job.request_count - 1)
+        return min(
+            max(2 * average_gap, settings.analysis_debounce_min_seconds),
+            settings.analysis_debounce_max_seconds
+        )
+
+    @staticmethod
+    def run_after(job: Optional[AnalysisJob], now: datetime, delay_seconds: Optional[float] = None) -> datetime:
+        """Срок запуска: trailing debounce, но не позже max_wait от первого сообщения"""
+        if delay_seconds is None:
+            delay_seconds = AnalysisDebouncePolicy.trailing_delay(job, now)
+        first_requested_at = job.first_requested_at if job and job.first_requested_at else now
+        deadline = first_requested_at + timedelta(seconds=settings.analysis_max_wait_seconds)
+        return min(now + timedelta(seconds=delay_seconds), deadline)
+
+
+class AnalysisJobService:
+    """Операции с очередью задач анализа"""
+
+    @staticmethod
+    def debounce_key(client_id: int) -> str:
+        return f"client_analysis_{client_id}"
+
+    @staticmethod
+    def enqueue(db: Session, client_id: int, delay_seconds: Optional[float] = None) -> AnalysisJob:
+        """Поставить анализ клиента в очередь или перенести уже ожидающую задачу (debounce)
+
+        Args:
+            delay_seconds: явная задержка; по умолчанию ее выбирает AnalysisDebouncePolicy
+        """
+        key = AnalysisJobService.debounce_key(client_id)
+        now = datetime.utcnow()
+
+        job = AnalysisJobService._get_queued(db, key)
+        if job:
+            AnalysisJobService._postpone(job, now, delay_seconds)
+        else:
+            job = AnalysisJob(
+                client_id=client_id,
+                debounce_key=key,
+                status=AnalysisJobStatus.QUEUED,
+                run_after=AnalysisDebouncePolicy.run_after(None, now, delay_seconds),
+                first_requested_at=now,
+                last_requested_at=now,
+                request_count=1,
+                max_attempts=settings.analysis_job_max_attempts
+            )
+            db.add(job)
+            logger.info(f"Анализ клиента {client_id} поставлен в очередь на {job.run_after:%H:%M:%S}")
+
+        try:
+            db.commit()
+        except IntegrityError:
+            # Ожидающую задачу клиента одновременно поставил другой запрос (уникальный индекс
+            # по debounce_key среди queued) - переносим ее
+            db.rollback()
+            job = AnalysisJobService._get_queued(db, key)
+            if job is None:
+                raise
+            AnalysisJobService._postpone(job, now, delay_seconds)
+            db.commit()
+        db.refresh(job)
+        return job
+
+    @staticmethod
+    def _get_queued(db: Session, key: str) -> Optional[AnalysisJob]:
+        return db.query(AnalysisJob).filter(
+            AnalysisJob.debounce_key == key,
+            AnalysisJob.status == AnalysisJobStatus.QUEUED
+        ).first()
+
+    @staticmethod
+    def _postpone(job: AnalysisJob, now: datetime, delay_seconds: Optional[float]) -> None:
+        """Учесть новое сообщение в ожидающей задаче и перенести ее запуск"""
+        job.request_count += 1
+        job.run_after = AnalysisDebouncePolicy.run_after(job, now, delay_seconds)
+        job.last_requested_at = now
+        logger.info(f"Анализ клиента {job.client_id} перенесен на {job.run_after:%H:%M:%S} (задача {job.id})")
+
+    @staticmethod
+    def claim_next(db: Session, worker_id: str) -> Optional[AnalysisJob]:
+        """Захватить одну готовую к запуску задачу. None - нет задач или ее забрал другой воркер"""
+        now = datetime.utcnow()
+        # Не больше одного выполняющегося анализа на клиента: следующий ждет в очереди
+        running = aliased(AnalysisJob)
+        client_busy = exists().where(
+            running.debounce_key == AnalysisJob.debounce_key,
+            running.status == AnalysisJobStatus.RUNNING
+        )
+        query = db.query(AnalysisJob).filter(
+            AnalysisJob.status == AnalysisJobStatus.QUEUED,
+            AnalysisJob.run_after <= now,
+            ~client_busy
+        ).order_by(AnalysisJob.run_after.asc())
+
+        if db.bind.dialect.name == "postgresql":
+            query = query.with_for_update(skip_locked=True)
+
+        job = query.first()
+        if job is None:
+            db.rollback()
+            return None
+
+        # Условный UPDATE атомарен и на SQLite: задачу получит только один воркер
+        claimed = db.query(AnalysisJob).filter(
+            AnalysisJob.id == job.id,
+            AnalysisJob.status == AnalysisJobStatus.QUEUED
+        ).update({
+            AnalysisJob.status: AnalysisJobStatus.RUNNING,
+            AnalysisJob.locked_by: worker_id,
+            AnalysisJob.locked_at: now,
+            AnalysisJob.attempts: AnalysisJob.attempts + 1
+        }, synchronize_session=False)
+        db.commit()
+
+        if not claimed:
+            return None
+
+        db.refresh(job)
+        return job
+
+    @staticmethod
+    def complete(db: Session, job_id: int) -> None:
+        db.query(AnalysisJob).filter(AnalysisJob.id == job_id).update({
+            AnalysisJob.status: AnalysisJobStatus.DONE,
+            AnalysisJob.last_error: None,
+            AnalysisJob.finished_at: datetime.utcnow()
+        }, synchronize_session=False)
+        db.commit()
+
+    @staticmethod
+    def fail(db: Session, job_id: int, error: str) -> None:
+        """Вернуть задачу в очередь с экспоненциальной задержкой или пометить как failed"""
+        job = db.query(AnalysisJob).filter(AnalysisJob.id == job_id).first()
+        if not job:
+            return
+
+        job.last_error = error
+        job.locked_by = None
+        # Сообщения, пришедшие во время анализа, уже поставили новую задачу - она и повторит анализ
+        newer_job_queued = db.query(AnalysisJob.id).filter(
+            AnalysisJob.debounce_key == job.debounce_key,
+            AnalysisJob.status == AnalysisJobStatus.QUEUED,
+            AnalysisJob.id != job.id
+        ).first() is not None
+
+        if job.attempts < job.max_attempts and not newer_job_queued:
+            backoff = settings.analysis_job_retry_base_seconds * 2 ** (job.attempts - 1)
+            job.status = AnalysisJobStatus.QUEUED
+            job.run_after = datetime.utcnow() + timedelta(seconds=backoff)
+            logger.warning(f"Задача анализа {job.id} (клиент {job.client_id}) повторится через {backoff}с: {error}")
+        else:
+            job.status = AnalysisJobStatus.FAILED
+            job.finished_at = datetime.utcnow()
+            logger.error(f"Задача анализа {job.id} (клиент {job.client_id}) не выполнена после {job.attempts} попыток: {error}")
+        try:
+            db.commit()
+        except IntegrityError:
+            # Пока задача возвращалась в очередь, новое сообщение поставило свою - повтор выполнит она
+            db.rollback()
+            db.query(AnalysisJob).filter(AnalysisJob.id == job_id).update({
+                AnalysisJob.status: AnalysisJobStatus.FAILED,
+                AnalysisJob.last_error: error,
+                AnalysisJob.locked_by: None,
+                AnalysisJob.finished_at: datetime.utcnow()
+            }, synchronize_session=False)
+            db.commit()
+
+    @staticmethod
+    def requeue_stale(db: Session) -> int:
+        """Вернуть в очередь задачи, зависшие в running (реплика упала посреди анализа)"""
+        cutoff = datetime.utcnow() - timedelta(minutes=settings.analysis_job_lease_minutes)
+        stale = db.query(AnalysisJob).filter(
+            AnalysisJob.status == AnalysisJobStatus.RUNNING,
+            AnalysisJob.locked_at < cutoff
+        ).all()
+        for job in stale:
+            AnalysisJobService.fail(db, job.id, f"Воркер {job.locked_by} не завершил задачу")
+        return len(stale)
+
+    @staticmethod
+    def purge_finished(db: Session) -> int:
+        """Удалить выполненные задачи старше срока хранения"""
+        cutoff = datetime.utcnow() - timedelta(days=settings.analysis_job_retention_days)
+        deleted = db.query(AnalysisJob).filter(
+            AnalysisJob.status == AnalysisJobStatus.DONE,
+            AnalysisJob.finished_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+
+    @staticmethod
+    def get_jobs(db: Session, status: Optional[AnalysisJobStatus] = None, limit: int = 100) -> List[AnalysisJob]:
+        query = db.query(AnalysisJob)
+        if status:
+            query = query.filter(AnalysisJob.status == status)
+        return query.order_by(AnalysisJob.run_after.desc()).limit(limit).all()
+
+    @staticmethod
+    def get_status_counts(db: Session) -> Dict[str, int]:
+        counts = {status.value: 0 for status in AnalysisJobStatus}
+        for status, count in db.query(AnalysisJob.status, func.count(AnalysisJob.id)).group_by(AnalysisJob.status):
+            counts[status.value] = count
+        return counts
+
+
+class AnalysisJobWorkerPool:
+    """Корутины-воркеры, которые разбирают очередь analysis_jobs в event loop приложения"""
+
+    # Как часто воркеры возвращают зависшие задачи и чистят старые
+    MAINTENANCE_INTERVAL_SECONDS = 60
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_maintenance = 0.0
+
+    def start(self) -> None:
+        """Запустить воркеры в текущем event loop (вызывается в lifespan)"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        for index in range(settings.analysis_job_workers):
+            self._tasks.append(asyncio.create_task(self._run(index)))
+        logger.info(f"Запущено воркеров анализа: {settings.analysis_job_workers} ({self.worker_id})")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self) -> None:
+        """Разбудить воркеры раньше следующего опроса. Можно вызывать из любого потока"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self, index: int) -> None:
+        worker_id = f"{self.worker_id}-{index}"
+        while True:
+            try:
+                await asyncio.to_thread(self._maintenance)
+                job = await asyncio.to_thread(self._claim, worker_id)
+                if job is None:
+                    await self._sleep()
+                    continue
+                await asyncio.to_thread(self._execute, job["id"], job["client_id"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка воркера анализа {worker_id}: {e}")
+                await asyncio.sleep(settings.analysis_job_poll_seconds)
+
+    async def _sleep(self) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=settings.analysis_job_poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    def _maintenance(self) -> None:
+        if time.monotonic() - self._last_maintenance < self.MAINTENANCE_INTERVAL_SECONDS:
+            return
+        self._last_maintenance = time.monotonic()
+
+        db = SessionLocal()
+        try:
+            requeued = AnalysisJobService.requeue_stale(db)
+            purged = AnalysisJobService.purge_finished(db)
+            if requeued or purged:
+                logger.info(f"Очередь анализа: возвращено зависших задач {requeued}, удалено старых {purged}")
+        finally:
+            db.close()
+
+    @staticmethod
+    def _claim(worker_id: str) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            job = AnalysisJobService.claim_next(db, worker_id)
+            return {"id": job.id, "client_id": job.client_id} if job else None
+        finally:
+            db.close()
+
+    @staticmethod
+    def _execute(job_id: int, client_id: int) -> None:
+        from .ai.workflows import ClientAnalysisWorkflow
+
+        logger.info(f"Выполняется задача анализа {job_id} для клиента {client_id}")
+        try:
+            result = ClientAnalysisWorkflow.analyze_client_complete(client_id)
+            error = ClientAnalysisWorkflow.analysis_error(result)
+        except Exception as e:
+            error = str(e)
+
+        db = SessionLocal()
+        try:
+            if error:
+                AnalysisJobService.fail(db, job_id, error)
+            else:
+                AnalysisJobService.complete(db, job_id)
+        finally:
+            db.close()
+
+        # Задача клиента, пришедшая во время анализа, могла уже созреть
+        analysis_job_workers.wake()
+
+
+# Глобальный пул воркеров
+analysis_job_workers = AnalysisJobWorkerPool()
@@ -0,0 +1,139 @@
+"""Кеш отформатированной истории чата клиента
+
+Агенты, workflow и будущие обработчики получают одну и ту же историю в виде
+HumanMessage/AIMessage и текстовых строк. Кеш хранит отформатированную историю
+по клиенту вместе с ID и отпечатком содержимого каждого сообщения и при появлении
+новых сообщений форматирует только их. Отпечаток сверяется при каждом обращении,
+поэтому сообщение, отредактированное через другую реплику, тоже попадает в историю.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
+
+from ..core.config import settings
+from ..models.message import Message
+
+logger = logging.getLogger(__name__)
+
+
+class FormattedHistory:
+    """Отформатированная история одного клиента"""
+    __slots__ = ("message_keys", "agent_messages", "text_lines")
+
+    def __init__(self):
+        # (ID, отпечаток полей, от которых зависит форматирование) по каждому сообщению
+        self.message_keys: List[Tuple[int, int]] = []
+        self.agent_messages: List[BaseMessage] = []
+        self.text_lines: List[str] = []
+
+    @property
+    def last_message_id(self) -> Optional[int]:
+        return self.message_keys[-1][0] if self.message_keys else None
+
+
+class ChatHistoryCache:
+    """LRU кеш отформатированной истории по client_id"""
+
+    def __init__(self):
+        self._entries: "OrderedDict[int, FormattedHistory]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "appends": 0, "rebuilds": 0, "formatted_messages": 0}
+
+    @staticmethod
+    def message_key(msg: Message) -> Tuple[int, int]:
+        """ID сообщения и отпечаток всего, что попадает в отформатированную строку"""
+        return msg.id, hash((msg.content, msg.content_type, msg.sender.value, msg.timestamp))
+
+    @staticmethod
+    def format_agent_message(msg: Message) -> BaseMessage:
+        """Сообщение чата с временной меткой и отправителем для агентов"""
+        timestamp = msg.timestamp.strftime("%Y-%m-%d %H:%M:%S") if msg.timestamp else "unknown"
+        sender_label = "КЛИЕНТ" if msg.sender.value == "client" else "ФЕРМЕР"
+
+        if msg.content_type != "text":
+            content = f"[{timestamp}] [{sender_label}] [{msg.content_type.upper()}] {msg.content}"
+        else:
+            content = f"[{timestamp}] [{sender_label}] {msg.content}"
+
+        if msg.sender.value == "client":
+            return HumanMessage(content=content)
+        return AIMessage(content=content)
+
+    @staticmethod
+    def format_text_line(msg: Message) -> str:
+        """Сообщение чата одной строкой для текстовых промптов"""
+        sender = "Клиент" if msg.sender.value == "client" else "Менеджер"
+        content = msg.content
+
+        # Добавляем информацию о типе контента
+        if msg.content_type != "text":
+            content = f"[{msg.content_type.upper()}] {content}"
+
+        return f"{sender}: {content}"
+
+    def _sync(self, chat_messages: List[Message]) -> FormattedHistory:
+        """Возвращает историю, дополненную до chat_messages (вызывается под self._lock)"""
+        client_id = chat_messages[0].client_id
+        entry = self._entries.get(client_id)
+        message_keys = [self.message_key(msg) for msg in chat_messages]
+
+        if entry is not None:
+            cached_count = len(entry.message_keys)
+            if cached_count == len(chat_messages) and entry.message_keys == message_keys:
+                self._stats["hits"] += 1
+                self._entries.move_to_end(client_id)
+                return entry
+            if cached_count < len(chat_messages) and entry.message_keys == message_keys[:cached_count]:
+                new_messages = chat_messages[cached_count:]
+                self._stats["appends"] += 1
+            else:
+                # Сообщение вставлено в середину, удалено или отредактировано - форматируем заново
+                entry = None
+
+        if entry is None:
+            entry = FormattedHistory()
+            new_messages = chat_messages
+            self._stats["rebuilds"] += 1
+
+        for msg in new_messages:
+            entry.message_keys.append(self.message_key(msg))
+            entry.agent_messages.append(self.format_agent_message(msg))
+            entry.text_lines.append(self.format_text_line(msg))
+        self._stats["formatted_messages"] += len(new_messages)
+
+        self._entries[client_id] = entry
+        self._entries.move_to_end(client_id)
+        while len(self._entries) > settings.chat_history_cache_clients:
+            self._entries.popitem(last=False)
+        return entry
+
+    def get_agent_messages(self, chat_messages: List[Message]) -> List[BaseMessage]:
+        """История в формате сообщений LangChain для агентов (новый список на каждый вызов)"""
+        if not chat_messages:
+            return []
+        with self._lock:
+            return list(self._sync(chat_messages).agent_messages)
+
+    def get_text(self, chat_messages: List[Message]) -> str:
+        """История одним текстом: "Клиент: ..." / "Менеджер: ..." """
+        if not chat_messages:
+            return ""
+        with self._lock:
+            return "\n".join(self._sync(chat_messages).text_lines)
+
+    def invalidate(self, client_id: int) -> None:
+        """Сбросить историю клиента, например после редактирования сообщения"""
+        with self._lock:
+            self._entries.pop(client_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"clients": len(self._entries), **self._stats}
+
+
+# Глобальный экземпляр кеша
+chat_history_cache = ChatHistoryCache()
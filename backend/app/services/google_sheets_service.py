@@ -1,22 +1,31 @@
 import os
+import json
+import hashlib
 import logging
+import threading
+from functools import cached_property
 from typing import List, Dict, Any, Optional
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google.oauth2.service_account import Credentials as ServiceCredentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from ..core.config import settings
-import json
+from .trigger_engine import InventoryIndex, trigger_condition_compiler
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
 
 class CarData:
-    """Класс для представления данных об автомобиле из Google Sheets"""
+    """Класс для представления данных об автомобиле из Google Sheets
+
+    Год, цена и пробег разбираются из строк один раз и кешируются в экземпляре.
+    """
     def __init__(self, row_data: List[str], headers: List[str]):
         self.raw_data = dict(zip(headers, row_data))
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CarData":
+        """Восстанавливает автомобиль из сохраненного to_dict()"""
+        raw_data = data.get('raw_data') or {}
+        return cls(list(raw_data.values()), list(raw_data.keys()))
         
     @property
     def car_id(self) -> Optional[str]:
@@ -32,7 +41,7 @@ class CarData:
                 return self.raw_data[key]
         return None
     
-    @property
+    @cached_property
     def year(self) -> Optional[int]:
         """Год автомобиля"""
         year_str = self.raw_data.get('Год') or self.raw_data.get('Year')
@@ -53,7 +62,7 @@ class CarData:
         """Модель автомобиля"""
         return self.raw_data.get(' МОДЕЛЬ') or self.raw_data.get('Model')
     
-    @property
+    @cached_property
     def price(self) -> Optional[float]:
         """Цена автомобиля"""
         price_str = self.raw_data.get(' ЦЕНА ПРОДАЖИ В ГРУЗИИ $') or self.raw_data.get('Price')
@@ -66,7 +75,7 @@ class CarData:
                 return None
         return None
     
-    @property
+    @cached_property
     def mileage(self) -> Optional[int]:
         """Пробег автомобиля"""
         mileage_str = self.raw_data.get('Пробег') or self.raw_data.get('Mileage')
@@ -100,19 +109,36 @@ class CarData:
 
 class GoogleSheetsService:
     def __init__(self):
-        self.service = None
+        self._service = None
+        self._connect_attempted = False
+        self._connect_lock = threading.Lock()
         self.spreadsheet_id = settings.google_sheets_spreadsheet_id
         self.range_name = settings.google_sheets_range or "Sheet1!A:Z"
-        
-        # Проверяем наличие необходимых настроек
-        if not self.spreadsheet_id or self.spreadsheet_id == "your_spreadsheet_id_here":
-            logger.warning("Google Sheets Spreadsheet ID не настроен. Сервис Google Sheets будет отключен.")
-            return
-            
-        self._connect()
+        # Последний снимок склада: хеш значений листа, объекты CarData и индекс по ним
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_hash: Optional[str] = None
+        self._snapshot_cars: List[CarData] = []
+        self._index: Optional[InventoryIndex] = None
+    
+    @property
+    def service(self):
+        """Клиент Sheets API, создается при первом обращении, а не при импорте модуля"""
+        if not self._connect_attempted:
+            with self._connect_lock:
+                if not self._connect_attempted:
+                    # Проверяем наличие необходимых настроек
+                    if not self.spreadsheet_id or self.spreadsheet_id == "your_spreadsheet_id_here":
+                        logger.warning("Google Sheets Spreadsheet ID не настроен. Сервис Google Sheets будет отключен.")
+                    else:
+                        self._connect()
+                    self._connect_attempted = True
+        return self._service
     
     def _connect(self):
         """Подключение к Google Sheets API"""
+        from google.oauth2.service_account import Credentials as ServiceCredentials
+        from googleapiclient.discovery import build
+        
         try:
             creds = None
             
@@ -131,12 +157,12 @@ class GoogleSheetsService:
                 logger.warning(f"Файл учетных данных не найден: {settings.google_sheets_credentials_file}")
                 return
             
-            self.service = build('sheets', 'v4', credentials=creds)
+            self._service = build('sheets', 'v4', credentials=creds)
             logger.info("Успешно подключились к Google Sheets API")
             
         except Exception as e:
             logger.error(f"Ошибка подключения к Google Sheets API: {e}")
-            self.service = None
+            self._service = None
     
     def is_connected(self) -> bool:
         """Проверяет, подключен ли сервис к Google Sheets"""
@@ -158,6 +184,13 @@ class GoogleSheetsService:
                 logger.warning("Google Sheets не содержит данных")
                 return []
             
+            # Неизменившийся лист возвращает тот же список CarData - индекс склада не перестраивается
+            snapshot_hash = hashlib.sha1(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()
+            with self._snapshot_lock:
+                if snapshot_hash == self._snapshot_hash:
+                    logger.debug(f"Данные Google Sheets не изменились ({len(self._snapshot_cars)} записей)")
+                    return self._snapshot_cars
+            
             # Первая строка - заголовки
             headers = values[0] if values else []
             car_data_list = []
@@ -169,6 +202,10 @@ class GoogleSheetsService:
                 car_data = CarData(padded_row, headers)
                 car_data_list.append(car_data)
             
+            with self._snapshot_lock:
+                self._snapshot_hash = snapshot_hash
+                self._snapshot_cars = car_data_list
+            
             logger.info(f"Получено {len(car_data_list)} записей из Google Sheets")
             return car_data_list
             
@@ -179,13 +216,29 @@ class GoogleSheetsService:
             logger.error(f"Неожиданная ошибка при работе с Google Sheets: {e}")
             return []
     
+    def get_inventory_index(self, cars: Optional[List[CarData]] = None) -> InventoryIndex:
+        """Индекс склада для списка cars (по умолчанию - свежие данные листа)
+        
+        Индекс строится заново только когда меняется снимок склада: для того же
+        списка CarData возвращается уже построенный индекс.
+        """
+        if cars is None:
+            cars = self.get_sheet_data()
+        with self._snapshot_lock:
+            index = self._index
+        if index is not None and index.cars is cars:
+            return index
+        
+        index = InventoryIndex(cars)
+        logger.info(f"Построен индекс склада: {index.size} записей")
+        with self._snapshot_lock:
+            if cars is self._snapshot_cars:
+                self._index = index
+        return index
+    
     def get_car_by_id(self, car_id: str) -> Optional[CarData]:
         """Получает данные конкретного автомобиля по ID"""
-        cars = self.get_sheet_data()
-        for car in cars:
-            if car.car_id == car_id:
-                return car
-        return None
+        return self.get_inventory_index().get(car_id)
     
     def filter_cars(self, **filters) -> List[CarData]:
         """Фильтрует автомобили по заданным критериям
@@ -201,71 +254,11 @@ class GoogleSheetsService:
             mileage_max: int - максимальный пробег
             status: str или List[str] - статус или список статусов
         """
-        cars = self.get_sheet_data()
-        filtered_cars = []
-        
-        for car in cars:
-            match = True
-            
-            # Проверяем марку
-            if 'brand' in filters and filters['brand']:
-                brands = filters['brand'] if isinstance(filters['brand'], list) else [filters['brand']]
-                if car.brand not in brands:
-                    match = False
-                    continue
-            
-            # Проверяем модель
-            if 'model' in filters and filters['model']:
-                models = filters['model'] if isinstance(filters['model'], list) else [filters['model']]
-                if car.model not in models:
-                    match = False
-                    continue
-            
-            # Проверяем локацию
-            if 'location' in filters and filters['location']:
-                if car.location != filters['location']:
-                    match = False
-                    continue
-            
-            # Проверяем цену
-            if 'price_min' in filters and filters['price_min'] is not None:
-                if car.price is None or car.price < filters['price_min']:
-                    match = False
-                    continue
-            
-            if 'price_max' in filters and filters['price_max'] is not None:
-                if car.price is None or car.price > filters['price_max']:
-                    match = False
-                    continue
-            
-            # Проверяем год
-            if 'year_min' in filters and filters['year_min'] is not None:
-                if car.year is None or car.year < filters['year_min']:
-                    match = False
-                    continue
-            
-            if 'year_max' in filters and filters['year_max'] is not None:
-                if car.year is None or car.year > filters['year_max']:
-                    match = False
-                    continue
-            
-            # Проверяем пробег
-            if 'mileage_max' in filters and filters['mileage_max'] is not None:
-                if car.mileage is None or car.mileage > filters['mileage_max']:
-                    match = False
-                    continue
-            
-            # Проверяем статус
-            if 'status' in filters and filters['status']:
-                statuses = filters['status'] if isinstance(filters['status'], list) else [filters['status']]
-                if car.status not in statuses:
-                    match = False
-                    continue
-            
-            if match:
-                filtered_cars.append(car)
-        
-        return filtered_cars
+        # car_id не входит в критерии поиска
+        conditions = {key: value for key, value in filters.items() if key != 'car_id'}
+        index = self.get_inventory_index()
+        compiled = trigger_condition_compiler.compile(conditions)
+        return [index.cars[position] for position in index.match_indices(compiled)]
     
     def get_headers(self) -> List[str]:
         """Получает заголовки столбцов из Google Sheets"""
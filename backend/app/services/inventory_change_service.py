@@ -0,0 +1,237 @@
+"""Поиск изменений склада между загрузками Google Sheets
+
+Для каждого car_id хранится отпечаток строки листа (inventory_car_states). Новая
+загрузка сравнивается с сохраненными отпечатками, и отличия записываются в журнал
+inventory_events: новый автомобиль, изменившийся (с полями цены, статуса и т.д.)
+или пропавший из листа. Триггеры обрабатывают только события после своего
+last_event_id, а не весь склад при каждой проверке.
+
+Первая загрузка при пустой таблице состояний считается базовой: состояния
+сохраняются без событий, чтобы не разослать уведомления по всему складу.
+
+Для бэктеста триггеров склад дополнительно сохраняется снимками (inventory_snapshots):
+полный снимок раз в inventory_snapshot_base_hours, а между ними - только новые,
+измененные и пропавшие автомобили каждой загрузки.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models.inventory import InventoryCarState, InventoryEvent, InventorySnapshot
+from .google_sheets_service import CarData
+
+logger = logging.getLogger(__name__)
+
+EVENT_NEW = "new"
+EVENT_CHANGED = "changed"
+EVENT_REMOVED = "removed"
+
+# Поля, изменения которых попадают в событие "changed"
+TRACKED_FIELDS = ("price", "status", "location", "mileage", "year", "brand", "model")
+
+
+class InventoryChangeDetector:
+    """Сравнение загрузки склада с сохраненными состояниями и запись событий"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Последний обработанный список CarData: неизменившийся лист не сравнивается повторно
+        self._last_cars: Optional[List[CarData]] = None
+        # Время последнего полного снимка; None - еще не читалось из БД
+        self._last_base_at: Optional[datetime] = None
+
+    @staticmethod
+    def fingerprint(car: CarData) -> str:
+        return hashlib.sha1(
+            json.dumps(car.raw_data, sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    @staticmethod
+    def _diff(previous: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, List[Any]]:
+        return {
+            field: [previous.get(field), current.get(field)]
+            for field in TRACKED_FIELDS
+            if previous.get(field) != current.get(field)
+        }
+
+    def detect(self, db: Session, cars: List[CarData]) -> Dict[str, Any]:
+        """Сравнить загрузку склада с сохраненными состояниями и записать события
+
+        Returns:
+            {"baseline", "new", "changed", "removed", "skipped"}
+        """
+        summary = {"baseline": False, "new": 0, "changed": 0, "removed": 0, "skipped": False}
+        with self._lock:
+            if cars is self._last_cars:
+                summary["skipped"] = True
+                return summary
+
+            now = datetime.now(timezone.utc)
+            states = {state.car_id: state for state in db.query(InventoryCarState).all()}
+            baseline = not states
+            summary["baseline"] = baseline
+
+            # Строки листа по car_id и изменения этой загрузки для снимка склада
+            current: Dict[str, Dict[str, Any]] = {}
+            upserts: Dict[str, Dict[str, Any]] = {}
+            removed: List[str] = []
+
+            seen = set()
+            for car in cars:
+                car_id = car.car_id
+                # Строки без ID не отслеживаются; повторный ID - как при поиске, берется первая строка
+                if not car_id or car_id in seen:
+                    continue
+                seen.add(car_id)
+                current[car_id] = car.raw_data
+
+                fingerprint = self.fingerprint(car)
+                state = states.get(car_id)
+                if state is not None and state.removed_at is None and state.fingerprint == fingerprint:
+                    continue
+
+                data = car.to_dict()
+                upserts[car_id] = car.raw_data
+                if state is None:
+                    db.add(InventoryCarState(
+                        car_id=car_id,
+                        fingerprint=fingerprint,
+                        price=car.price,
+                        status=car.status,
+                        data=data
+                    ))
+                    if not baseline:
+                        db.add(InventoryEvent(car_id=car_id, kind=EVENT_NEW, data=data))
+                        summary["new"] += 1
+                    continue
+
+                previous = state.data or {}
+                if state.removed_at is not None:
+                    # Вернулся в лист после удаления - снова новый
+                    db.add(InventoryEvent(car_id=car_id, kind=EVENT_NEW, data=data, previous_data=previous))
+                    summary["new"] += 1
+                    state.removed_at = None
+                else:
+                    db.add(InventoryEvent(
+                        car_id=car_id,
+                        kind=EVENT_CHANGED,
+                        changes=self._diff(previous, data),
+                        data=data,
+                        previous_data=previous
+                    ))
+                    summary["changed"] += 1
+                state.fingerprint = fingerprint
+                state.price = car.price
+                state.status = car.status
+                state.data = data
+                state.changed_at = now
+
+            for car_id, state in states.items():
+                if car_id not in seen and state.removed_at is None:
+                    db.add(InventoryEvent(car_id=car_id, kind=EVENT_REMOVED, data=state.data))
+                    state.removed_at = now
+                    removed.append(car_id)
+                    summary["removed"] += 1
+
+            base_taken = self._add_snapshot(db, now, current, upserts, removed)
+            db.commit()
+            self._last_cars = cars
+            if base_taken:
+                self._last_base_at = now
+
+        if baseline:
+            logger.info(f"Базовый снимок склада: сохранено {len(seen)} автомобилей без событий")
+        elif summary["new"] or summary["changed"] or summary["removed"]:
+            logger.info(
+                f"Изменения склада: новых {summary['new']}, измененных {summary['changed']}, "
+                f"пропавших {summary['removed']}"
+            )
+        return summary
+
+    def _add_snapshot(
+        self,
+        db: Session,
+        now: datetime,
+        current: Dict[str, Dict[str, Any]],
+        upserts: Dict[str, Dict[str, Any]],
+        removed: List[str]
+    ) -> bool:
+        """Добавить снимок склада в сессию; True - полный снимок"""
+        if self._last_base_at is None:
+            self._last_base_at = db.query(func.max(InventorySnapshot.taken_at)).filter(
+                InventorySnapshot.is_base.is_(True)
+            ).scalar()
+        last_base_at = self._last_base_at
+        # SQLite возвращает время без зоны - оно сохранялось в UTC
+        if last_base_at is not None and last_base_at.tzinfo is None:
+            last_base_at = last_base_at.replace(tzinfo=timezone.utc)
+
+        if last_base_at is None or now - last_base_at >= timedelta(hours=settings.inventory_snapshot_base_hours):
+            db.add(InventorySnapshot(taken_at=now, is_base=True, car_count=len(current), cars=current))
+            return True
+        if upserts or removed:
+            db.add(InventorySnapshot(
+                taken_at=now,
+                is_base=False,
+                car_count=len(current),
+                cars=upserts,
+                removed=removed
+            ))
+        return False
+
+    @staticmethod
+    def cleanup_snapshots(db: Session, retention_days: Optional[int] = None) -> int:
+        """Удалить снимки старше срока хранения, кроме последнего полного снимка до границы"""
+        retention_days = settings.inventory_snapshot_retention_days if retention_days is None else retention_days
+        if retention_days <= 0:
+            return 0
+        cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+        # Изменения после границы восстанавливаются от этого полного снимка
+        anchor = db.query(InventorySnapshot).filter(
+            InventorySnapshot.is_base.is_(True),
+            InventorySnapshot.taken_at <= cutoff
+        ).order_by(InventorySnapshot.taken_at.desc()).first()
+        if anchor is None:
+            return 0
+        deleted = db.query(InventorySnapshot).filter(
+            InventorySnapshot.id < anchor.id
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+
+    @staticmethod
+    def get_latest_event_id(db: Session) -> int:
+        return db.query(func.coalesce(func.max(InventoryEvent.id), 0)).scalar() or 0
+
+    @staticmethod
+    def get_events(db: Session, after_id: int, up_to_id: int) -> List[InventoryEvent]:
+        """События с after_id < id <= up_to_id в порядке записи"""
+        return db.query(InventoryEvent).filter(
+            InventoryEvent.id > after_id,
+            InventoryEvent.id <= up_to_id
+        ).order_by(InventoryEvent.id).all()
+
+    @staticmethod
+    def cleanup_events(db: Session, retention_days: Optional[int] = None) -> int:
+        """Удалить события старше срока хранения"""
+        retention_days = settings.inventory_event_retention_days if retention_days is None else retention_days
+        if retention_days <= 0:
+            return 0
+        cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+        deleted = db.query(InventoryEvent).filter(
+            InventoryEvent.detected_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+
+
+# Глобальный экземпляр детектора изменений склада
+inventory_change_detector = InventoryChangeDetector()
@@ -0,0 +1,304 @@
+"""Выбор ведущего экземпляра для фоновых задач по аренде в БД
+
+Каждый процесс (воркер uvicorn, контейнер) запускает свой AsyncIOScheduler и
+планировщик триггеров, поэтому при нескольких экземплярах проверки триггеров,
+напоминания и сводки выполнялись бы несколько раз. Фоновые задачи выполняет
+только держатель аренды из scheduler_leases.
+
+Аренда выдается на scheduler_lease_ttl_seconds и продлевается каждые
+scheduler_lease_renew_seconds. Захват и продление - один условный UPDATE
+(свободна, истекла или уже наша), поэтому аренду одновременно держит не больше
+одного экземпляра. Если ведущий упал, аренду забирает другой экземпляр после ее
+истечения; при штатной остановке аренда освобождается сразу.
+
+Время аренды сравнивается по часам экземпляров (UTC) - они должны быть
+синхронизированы с точностью заметно лучше scheduler_lease_ttl_seconds.
+
+LeaseLock - та же аренда под своим именем как блокировка на время операции:
+проверки триггеров ведущего и ручные проверки на любом экземпляре выполняются
+по одной.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional, Callable, Awaitable, AsyncIterator
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..models.scheduler_lease import SchedulerLease
+
+logger = logging.getLogger(__name__)
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    # SQLite возвращает время без зоны - оно сохранялось в UTC
+    if value is not None and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class LeaderElection:
+    """Аренда роли ведущего и корутина, которая ее захватывает и продлевает"""
+
+    def __init__(self, name: str = "scheduler"):
+        self.name = name
+        self.instance_id = settings.scheduler_instance_id or (
+            f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        )
+        self.is_leader = False
+        self._lease_expires_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._on_elected: Optional[Callable[[], Awaitable[None]]] = None
+        self._on_demoted: Optional[Callable[[], Awaitable[None]]] = None
+        self._stats = {
+            "elected_at": None,
+            "elections": 0,
+            "last_renewed_at": None,
+            "last_error": None
+        }
+
+    # Аренда
+
+    def try_acquire(self) -> bool:
+        """Захватить или продлить аренду; True - этот экземпляр ведущий до expires_at"""
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=settings.scheduler_lease_ttl_seconds)
+        db = SessionLocal()
+        try:
+            lease = db.query(SchedulerLease).filter(SchedulerLease.name == self.name).first()
+            if lease is None:
+                try:
+                    db.add(SchedulerLease(
+                        name=self.name,
+                        holder=self.instance_id,
+                        acquired_at=now,
+                        renewed_at=now,
+                        expires_at=expires_at
+                    ))
+                    db.commit()
+                except IntegrityError:
+                    # Строку аренды одновременно создал другой экземпляр
+                    db.rollback()
+                    return False
+                self._lease_expires_at = expires_at
+                return True
+
+            renewing = lease.holder == self.instance_id
+            updated = db.query(SchedulerLease).filter(
+                SchedulerLease.name == self.name,
+                or_(
+                    SchedulerLease.holder == self.instance_id,
+                    SchedulerLease.holder.is_(None),
+                    SchedulerLease.expires_at.is_(None),
+                    SchedulerLease.expires_at < now
+                )
+            ).update({
+                SchedulerLease.holder: self.instance_id,
+                SchedulerLease.acquired_at: lease.acquired_at if renewing else now,
+                SchedulerLease.renewed_at: now,
+                SchedulerLease.expires_at: expires_at
+            }, synchronize_session=False)
+            db.commit()
+            if updated:
+                self._lease_expires_at = expires_at
+            return bool(updated)
+        finally:
+            db.close()
+
+    def release(self) -> None:
+        """Освободить аренду, если она наша: другой экземпляр заберет ее при следующей попытке"""
+        db = SessionLocal()
+        try:
+            db.query(SchedulerLease).filter(
+                SchedulerLease.name == self.name,
+                SchedulerLease.holder == self.instance_id
+            ).update({
+                SchedulerLease.holder: None,
+                SchedulerLease.expires_at: None
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        self._lease_expires_at = None
+
+    def get_lease(self) -> Optional[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            lease = db.query(SchedulerLease).filter(SchedulerLease.name == self.name).first()
+            if lease is None:
+                return None
+            expires_at = _as_utc(lease.expires_at)
+            return {
+                "holder": lease.holder,
+                "acquired_at": _as_utc(lease.acquired_at).isoformat() if lease.acquired_at else None,
+                "renewed_at": _as_utc(lease.renewed_at).isoformat() if lease.renewed_at else None,
+                "expires_at": expires_at.isoformat() if expires_at else None,
+                "expired": expires_at is None or expires_at < datetime.now(timezone.utc)
+            }
+        finally:
+            db.close()
+
+    def holds_lease(self) -> bool:
+        """Ведущий и аренда еще не истекла по локальным часам (is_leader обновляется только при продлении)"""
+        return (
+            self.is_leader
+            and self._lease_expires_at is not None
+            and datetime.now(timezone.utc) < self._lease_expires_at
+        )
+
+    # Корутина выбора ведущего
+
+    def start(
+        self,
+        on_elected: Callable[[], Awaitable[None]],
+        on_demoted: Callable[[], Awaitable[None]]
+    ) -> None:
+        """Запустить захват аренды в текущем event loop; колбэки запускают и останавливают фоновые задачи"""
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Выбор ведущего экземпляра запущен: {self.instance_id}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            await self._demote("остановка экземпляра")
+            try:
+                await asyncio.to_thread(self.release)
+            except Exception as e:
+                logger.error(f"Ошибка освобождения аренды ведущего: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                acquired = await asyncio.to_thread(self.try_acquire)
+                self._stats["last_error"] = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка продления аренды ведущего: {e}")
+                self._stats["last_error"] = str(e)
+                # Без связи с БД ведущий остается ведущим, пока не истекла его аренда
+                acquired = self.holds_lease()
+
+            if acquired:
+                self._stats["last_renewed_at"] = datetime.now(timezone.utc).isoformat()
+                if not self.is_leader:
+                    await self._elect()
+            elif self.is_leader:
+                await self._demote("аренда перешла к другому экземпляру или истекла")
+
+            await asyncio.sleep(settings.scheduler_lease_renew_seconds)
+
+    async def _elect(self) -> None:
+        self.is_leader = True
+        self._stats["elected_at"] = datetime.now(timezone.utc).isoformat()
+        self._stats["elections"] += 1
+        logger.info(f"Экземпляр {self.instance_id} стал ведущим: фоновые задачи запускаются")
+        try:
+            await self._on_elected()
+        except Exception as e:
+            logger.error(f"Ошибка запуска фоновых задач ведущего: {e}")
+
+    async def _demote(self, reason: str) -> None:
+        self.is_leader = False
+        self._stats["elected_at"] = None
+        logger.warning(f"Экземпляр {self.instance_id} больше не ведущий ({reason}): фоновые задачи остановлены")
+        try:
+            await self._on_demoted()
+        except Exception as e:
+            logger.error(f"Ошибка остановки фоновых задач ведущего: {e}")
+
+    def get_status(self) -> Dict[str, Any]:
+        try:
+            lease = self.get_lease()
+        except Exception as e:
+            lease = {"error": str(e)}
+        return {
+            "enabled": self._task is not None,
+            "instance_id": self.instance_id,
+            "is_leader": self.is_leader,
+            "lease": lease,
+            **self._stats
+        }
+
+
+class LeaseLock:
+    """Блокировка операции между экземплярами: asyncio.Lock в процессе и аренда в scheduler_leases
+
+    Пока операция выполняется, аренда продлевается каждые scheduler_lease_renew_seconds;
+    если экземпляр упал, блокировку забирают после scheduler_lease_ttl_seconds.
+    """
+
+    # Как часто повторяется попытка захватить занятую аренду
+    POLL_SECONDS = 1.0
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lease = LeaderElection(name)
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _process_lock(self) -> asyncio.Lock:
+        # asyncio.Lock привязан к event loop, в котором используется
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @asynccontextmanager
+    async def hold(self, timeout: float) -> AsyncIterator[None]:
+        """Выполнить блок под блокировкой; TimeoutError - не удалось захватить за timeout секунд"""
+        deadline = time.monotonic() + timeout
+        lock = self._process_lock()
+        try:
+            await asyncio.wait_for(lock.acquire(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Блокировка {self.name} занята в этом экземпляре")
+        try:
+            while not await asyncio.to_thread(self._lease.try_acquire):
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Блокировка {self.name} занята другим экземпляром")
+                await asyncio.sleep(self.POLL_SECONDS)
+
+            renewal = asyncio.create_task(self._renew())
+            try:
+                yield
+            finally:
+                renewal.cancel()
+                await asyncio.gather(renewal, return_exceptions=True)
+                try:
+                    await asyncio.to_thread(self._lease.release)
+                except Exception as e:
+                    logger.error(f"Ошибка освобождения блокировки {self.name}: {e}")
+        finally:
+            lock.release()
+
+    async def _renew(self) -> None:
+        while True:
+            await asyncio.sleep(settings.scheduler_lease_renew_seconds)
+            try:
+                if not await asyncio.to_thread(self._lease.try_acquire):
+                    logger.warning(f"Блокировка {self.name} истекла и занята другим экземпляром")
+            except Exception as e:
+                logger.error(f"Ошибка продления блокировки {self.name}: {e}")
+
+
+# Глобальный экземпляр выбора ведущего для планировщиков
+scheduler_leader = LeaderElection()
+
+# Блокировка проверок триггеров между экземплярами
+trigger_check_lock = LeaseLock("trigger_checks")
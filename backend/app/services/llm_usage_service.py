@@ -0,0 +1,230 @@
+"""Учет токенов и стоимости вызовов LLM по клиентам и агентам
+
+Каждый вызов LLM агентом анализа добавляется в llm_usage, а дневная сводка
+llm_usage_daily обновляется в той же транзакции, поэтому отчеты и проверка
+месячного бюджета клиента не сканируют сырые записи.
+"""
+
+import logging
+from datetime import datetime, date, timedelta
+from typing import Optional, List, Dict, Any
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..models.client import Client
+from ..models.llm_usage import LLMUsage, LLMUsageDaily
+
+logger = logging.getLogger(__name__)
+
+# Цены OpenAI в USD за 1M токенов: (вход, выход)
+LLM_PRICING_PER_1M_TOKENS = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+}
+
+# Решения проверки бюджета
+BUDGET_OK = "ok"
+BUDGET_DOWNGRADE = "downgrade"
+BUDGET_SKIP = "skip"
+
+
+class LLMUsageService:
+    """Запись вызовов LLM, отчеты по расходам и месячные бюджеты клиентов"""
+
+    @staticmethod
+    def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+        """Стоимость вызова по таблице цен; неизвестная модель считается бесплатной"""
+        pricing = LLM_PRICING_PER_1M_TOKENS.get(model)
+        if pricing is None:
+            # Версии с датой (gpt-4o-mini-2024-07-18) считаем по базовой модели
+            base_models = [name for name in LLM_PRICING_PER_1M_TOKENS if model.startswith(name)]
+            if not base_models:
+                return 0.0
+            pricing = LLM_PRICING_PER_1M_TOKENS[max(base_models, key=len)]
+        input_price, output_price = pricing
+        return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+    @staticmethod
+    def _daily_filter(query, day: date, client_id: Optional[int], agent: str, model: str):
+        client_filter = LLMUsageDaily.client_id.is_(None) if client_id is None else LLMUsageDaily.client_id == client_id
+        return query.filter(
+            LLMUsageDaily.day == day,
+            client_filter,
+            LLMUsageDaily.agent == agent,
+            LLMUsageDaily.model == model
+        )
+
+    @staticmethod
+    def record(db: Session, client_id: Optional[int], agent: str, model: str,
+               input_tokens: int, output_tokens: int, latency_ms: int, price_factor: float = 1.0) -> LLMUsage:
+        """Добавить вызов в журнал и увеличить дневную сводку
+
+        Args:
+            price_factor: множитель цены, например 0.5 для OpenAI Batch API
+        """
+        cost = LLMUsageService.estimate_cost(model, input_tokens, output_tokens) * price_factor
+        usage = LLMUsage(
+            client_id=client_id,
+            agent=agent,
+            model=model,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            cost_usd=cost,
+            latency_ms=latency_ms
+        )
+        db.add(usage)
+
+        day = datetime.utcnow().date()
+        increments = {
+            LLMUsageDaily.calls: LLMUsageDaily.calls + 1,
+            LLMUsageDaily.input_tokens: LLMUsageDaily.input_tokens + input_tokens,
+            LLMUsageDaily.output_tokens: LLMUsageDaily.output_tokens + output_tokens,
+            LLMUsageDaily.cost_usd: LLMUsageDaily.cost_usd + cost,
+            LLMUsageDaily.latency_ms_total: LLMUsageDaily.latency_ms_total + latency_ms
+        }
+        daily_query = LLMUsageService._daily_filter(db.query(LLMUsageDaily), day, client_id, agent, model)
+        updated = daily_query.update(increments, synchronize_session=False)
+        if not updated:
+            try:
+                # Первая запись за день; параллельная вставка той же строки ловится уникальным индексом
+                with db.begin_nested():
+                    db.add(LLMUsageDaily(
+                        day=day,
+                        client_id=client_id,
+                        agent=agent,
+                        model=model,
+                        calls=1,
+                        input_tokens=input_tokens,
+                        output_tokens=output_tokens,
+                        cost_usd=cost,
+                        latency_ms_total=latency_ms
+                    ))
+            except IntegrityError:
+                daily_query.update(increments, synchronize_session=False)
+
+        db.commit()
+        return usage
+
+    @staticmethod
+    def record_call(client_id: Optional[int], agent: str, model: str,
+                    input_tokens: int, output_tokens: int, latency_ms: int) -> None:
+        """Запись вызова в отдельной сессии; ошибка учета не прерывает анализ"""
+        db = SessionLocal()
+        try:
+            LLMUsageService.record(db, client_id, agent, model, input_tokens, output_tokens, latency_ms)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Ошибка записи использования LLM ({agent}, клиент {client_id}): {e}")
+        finally:
+            db.close()
+
+    @staticmethod
+    def get_month_spend(db: Session, client_id: int, today: Optional[date] = None) -> float:
+        """Расход клиента с начала текущего месяца, USD"""
+        today = today or datetime.utcnow().date()
+        month_start = today.replace(day=1)
+        spend = db.query(func.coalesce(func.sum(LLMUsageDaily.cost_usd), 0.0)).filter(
+            LLMUsageDaily.client_id == client_id,
+            LLMUsageDaily.day >= month_start
+        ).scalar()
+        return float(spend or 0.0)
+
+    @staticmethod
+    def get_budget(client: Client) -> float:
+        """Месячный бюджет клиента, USD; 0 - без ограничений"""
+        if client.llm_monthly_budget_usd is not None:
+            return client.llm_monthly_budget_usd
+        return settings.llm_client_monthly_budget_usd
+
+    @staticmethod
+    def check_budget(db: Session, client: Client) -> Dict[str, Any]:
+        """Можно ли анализировать клиента в рамках месячного бюджета
+
+        Returns:
+            {"action": "ok" | "downgrade" | "skip", "budget_usd", "spent_usd"}
+        """
+        budget = LLMUsageService.get_budget(client)
+        if not budget or budget <= 0:
+            return {"action": BUDGET_OK, "budget_usd": None, "spent_usd": None}
+
+        spent = LLMUsageService.get_month_spend(db, client.id)
+        action = BUDGET_OK
+        if spent >= budget:
+            action = BUDGET_SKIP if settings.llm_budget_exceeded_action == BUDGET_SKIP else BUDGET_DOWNGRADE
+        return {"action": action, "budget_usd": budget, "spent_usd": round(spent, 6)}
+
+    @staticmethod
+    def set_budget(db: Session, client_id: int, budget_usd: Optional[float]) -> Optional[Client]:
+        """Задать месячный бюджет клиента; None - вернуть общий из настроек"""
+        client = db.query(Client).filter(Client.id == client_id).first()
+        if not client:
+            return None
+        client.llm_monthly_budget_usd = budget_usd
+        db.commit()
+        db.refresh(client)
+        return client
+
+    @staticmethod
+    def get_top_clients(db: Session, days: int = 30, limit: int = 10) -> List[Dict[str, Any]]:
+        """Клиенты с наибольшим расходом за последние days дней"""
+        since = datetime.utcnow().date() - timedelta(days=days - 1)
+        cost = func.sum(LLMUsageDaily.cost_usd).label("cost_usd")
+        rows = db.query(
+            LLMUsageDaily.client_id,
+            Client.name,
+            func.sum(LLMUsageDaily.calls).label("calls"),
+            func.sum(LLMUsageDaily.input_tokens).label("input_tokens"),
+            func.sum(LLMUsageDaily.output_tokens).label("output_tokens"),
+            cost
+        ).outerjoin(Client, Client.id == LLMUsageDaily.client_id).filter(
+            LLMUsageDaily.day >= since
+        ).group_by(LLMUsageDaily.client_id, Client.name).order_by(cost.desc()).limit(limit).all()
+
+        return [
+            {
+                "client_id": row.client_id,
+                "client_name": row.name,
+                "calls": int(row.calls or 0),
+                "input_tokens": int(row.input_tokens or 0),
+                "output_tokens": int(row.output_tokens or 0),
+                "cost_usd": round(float(row.cost_usd or 0.0), 6)
+            }
+            for row in rows
+        ]
+
+    @staticmethod
+    def get_trend(db: Session, days: int = 30, client_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Расход по дням и агентам за последние days дней"""
+        since = datetime.utcnow().date() - timedelta(days=days - 1)
+        query = db.query(
+            LLMUsageDaily.day,
+            LLMUsageDaily.agent,
+            func.sum(LLMUsageDaily.calls).label("calls"),
+            func.sum(LLMUsageDaily.input_tokens).label("input_tokens"),
+            func.sum(LLMUsageDaily.output_tokens).label("output_tokens"),
+            func.sum(LLMUsageDaily.cost_usd).label("cost_usd"),
+            func.sum(LLMUsageDaily.latency_ms_total).label("latency_ms_total")
+        ).filter(LLMUsageDaily.day >= since)
+        if client_id is not None:
+            query = query.filter(LLMUsageDaily.client_id == client_id)
+        rows = query.group_by(LLMUsageDaily.day, LLMUsageDaily.agent).order_by(LLMUsageDaily.day).all()
+
+        return [
+            {
+                "day": row.day.isoformat(),
+                "agent": row.agent,
+                "calls": int(row.calls or 0),
+                "input_tokens": int(row.input_tokens or 0),
+                "output_tokens": int(row.output_tokens or 0),
+                "cost_usd": round(float(row.cost_usd or 0.0), 6),
+                "avg_latency_ms": round(float(row.latency_ms_total or 0) / row.calls) if row.calls else 0
+            }
+            for row in rows
+        ]
@@ -4,6 +4,7 @@ from sqlalchemy import desc
 from datetime import datetime
 from ..models.message import Message, MessageAttachment, SenderType
 from ..schemas.message import MessageCreate, MessageUpdate
+from .chat_history_cache import chat_history_cache
 
 
 class MessageService:
@@ -124,6 +125,8 @@ class MessageService:
                 setattr(db_message, field, value)
             db.commit()
             db.refresh(db_message)
+            # Отформатированная история содержит старый текст сообщения
+            chat_history_cache.invalidate(db_message.client_id)
         return db_message
 
     @staticmethod
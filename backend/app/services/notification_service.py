@@ -2,10 +2,21 @@
 
 import asyncio
 import logging
-from typing import Dict, Any
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from ..core.config import settings
 
 logger = logging.getLogger(__name__)
 
+NOTIFICATION_DOSSIER = "dossier"
+NOTIFICATION_CAR_INTEREST = "car_interest"
+NOTIFICATION_TASK = "task"
+
+# Уведомления-снимки: в пачке достаточно последнего по клиенту
+SNAPSHOT_NOTIFICATIONS = {NOTIFICATION_DOSSIER, NOTIFICATION_CAR_INTEREST}
+
 
 class NotificationService:
     """Сервис для отправки WebSocket уведомлений"""
@@ -51,31 +62,174 @@ class NotificationService:
 
     @staticmethod
     def sync_send_dossier_notification(client_id: int, dossier_data: Dict[str, Any]) -> None:
-        """Синхронная обертка для отправки уведомления о досье"""
-        try:
-            asyncio.run(NotificationService.send_dossier_notification(client_id, dossier_data))
-        except Exception as e:
-            logger.error(f"Ошибка синхронной отправки уведомления о досье: {e}")
+        """Отправка уведомления о досье из рабочего потока через notification_bridge"""
+        notification_bridge.publish(NOTIFICATION_DOSSIER, client_id, dossier_data)
 
     @staticmethod
     def sync_send_car_interest_notification(client_id: int, car_interest_data: Dict[str, Any]) -> None:
-        """Синхронная обертка для отправки уведомления о автомобильных интересах"""
-        try:
-            asyncio.run(NotificationService.send_car_interest_notification(client_id, car_interest_data))
-        except Exception as e:
-            logger.error(f"Ошибка синхронной отправки уведомления о автомобильных интересах: {e}")
+        """Отправка уведомления о автомобильных интересах из рабочего потока через notification_bridge"""
+        notification_bridge.publish(NOTIFICATION_CAR_INTEREST, client_id, car_interest_data)
 
     @staticmethod
     def sync_send_task_notification(client_id: int, task_data: Dict[str, Any]) -> None:
-        """Синхронная обертка для отправки уведомления о задачах"""
+        """Отправка уведомления о задачах из рабочего потока через notification_bridge"""
+        notification_bridge.publish(NOTIFICATION_TASK, client_id, task_data)
+
+
+class NotificationBridge:
+    """Мост уведомлений из рабочих потоков в основной event loop
+
+    WebSocket соединения принадлежат event loop uvicorn, поэтому отправка в них возможна
+    только из этого loop. Потоки анализа кладут события в ограниченную очередь через
+    call_soon_threadsafe, а корутина на основном loop забирает их пачками: события,
+    пришедшие в пределах окна, отправляются вместе, повторные снимки досье и интересов
+    одного клиента схлопываются в последний.
+    """
+
+    SENDERS = {
+        NOTIFICATION_DOSSIER: NotificationService.send_dossier_notification,
+        NOTIFICATION_CAR_INTEREST: NotificationService.send_car_interest_notification,
+        NOTIFICATION_TASK: NotificationService.send_task_notification
+    }
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._drain_task: Optional[asyncio.Task] = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "published": 0,
+            "dropped": 0,
+            "delivered": 0,
+            "coalesced": 0,
+            "failed": 0,
+            "batches": 0,
+            "unbound": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0
+        }
+
+    def bind(self) -> None:
+        """Привязать мост к текущему event loop и запустить доставку (вызывается в lifespan)"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=settings.notification_queue_size)
+        self._drain_task = asyncio.create_task(self._drain())
+        logger.info("Мост уведомлений привязан к основному event loop")
+
+    async def stop(self) -> None:
+        """Доставить оставшиеся события и остановить корутину"""
+        if self._drain_task is None:
+            return
+        self._drain_task.cancel()
+        await asyncio.gather(self._drain_task, return_exceptions=True)
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        if remaining:
+            await self._deliver(remaining)
+        self._loop = None
+        self._drain_task = None
+
+    def publish(self, kind: str, client_id: int, data: Dict[str, Any]) -> None:
+        """Поставить уведомление в очередь. Безопасно из любого потока, включая сам event loop"""
+        with self._stats_lock:
+            self._stats["published"] += 1
+
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            # Вне приложения (скрипты, бенчмарки) отправлять некуда
+            with self._stats_lock:
+                self._stats["unbound"] += 1
+            logger.debug(f"Мост уведомлений не запущен, уведомление {kind} для клиента {client_id} пропущено")
+            return
+
         try:
-            asyncio.run(NotificationService.send_task_notification(client_id, task_data))
-        except Exception as e:
-            logger.error(f"Ошибка синхронной отправки уведомления о задачах: {e}")
+            loop.call_soon_threadsafe(self._put, (kind, client_id, data, time.monotonic()))
+        except RuntimeError:
+            # Loop закрывается при остановке приложения
+            with self._stats_lock:
+                self._stats["dropped"] += 1
+
+    def _put(self, event: Tuple) -> None:
+        """Выполняется в event loop"""
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            with self._stats_lock:
+                self._stats["dropped"] += 1
+            logger.warning(f"Очередь уведомлений переполнена, уведомление {event[0]} для клиента {event[1]} отброшено")
+
+    async def _drain(self) -> None:
+        window = settings.notification_batch_window_ms / 1000
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + window
+            while len(batch) < settings.notification_batch_max:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._deliver(batch)
+
+    @staticmethod
+    def _coalesce(batch: List[Tuple]) -> List[Tuple]:
+        """Оставляет последний снимок досье/интересов каждого клиента, задачи - все по порядку"""
+        latest_snapshot = {}
+        for index, (kind, client_id, _, _) in enumerate(batch):
+            if kind in SNAPSHOT_NOTIFICATIONS:
+                latest_snapshot[(kind, client_id)] = index
+        return [
+            event for index, event in enumerate(batch)
+            if event[0] not in SNAPSHOT_NOTIFICATIONS or latest_snapshot[(event[0], event[1])] == index
+        ]
+
+    async def _deliver(self, batch: List[Tuple]) -> None:
+        events = self._coalesce(batch)
+        delivered = failed = 0
+        latencies = []
+        for kind, client_id, data, published_at in events:
+            try:
+                await self.SENDERS[kind](client_id, data)
+                delivered += 1
+                latencies.append(time.monotonic() - published_at)
+            except Exception as e:
+                failed += 1
+                logger.error(f"Ошибка доставки уведомления {kind} для клиента {client_id}: {e}")
+
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["delivered"] += delivered
+            self._stats["failed"] += failed
+            self._stats["coalesced"] += len(batch) - len(events)
+            self._stats["latency_total"] += sum(latencies)
+            if latencies:
+                self._stats["latency_max"] = max(self._stats["latency_max"], max(latencies))
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Метрики доставки уведомлений с момента запуска"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        delivered = stats.pop("delivered")
+        latency_total = stats.pop("latency_total")
+        latency_max = stats.pop("latency_max")
+        return {
+            "bound": self._loop is not None,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": settings.notification_queue_size,
+            "delivered": delivered,
+            **stats,
+            "avg_batch_size": round((delivered + stats["coalesced"] + stats["failed"]) / stats["batches"], 2) if stats["batches"] else 0.0,
+            "latency_avg_ms": round(latency_total / delivered * 1000, 1) if delivered else 0.0,
+            "latency_max_ms": round(latency_max * 1000, 1)
+        }
 
 
-# Глобальный экземпляр сервиса
+# Глобальные экземпляры
 notification_service = NotificationService()
+notification_bridge = NotificationBridge()
 
 # Экспорт функций для обратной совместимости
 send_dossier_notification = NotificationService.send_dossier_notification
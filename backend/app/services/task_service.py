@@ -39,7 +39,7 @@ class TaskService:
         # Отправляем уведомление фермеру (если это новая задача)
         if send_notification and not db_task.telegram_notification_sent:
             try:
-                from .ai.notifications import sync_send_task_notification
+                from .notification_service import sync_send_task_notification
                 # Формируем данные задачи
                 task_data = {
                     "id": db_task.id,
@@ -99,7 +99,8 @@ class TaskService:
                 due_date=due_date,
                 priority=task_data.get('priority', 'normal')
             )
-            db_task = TaskService.create_task(db, task_create, send_notification=True)
+            # С notify_callback задачи объявляются одним пакетным уведомлением ниже
+            db_task = TaskService.create_task(db, task_create, send_notification=notify_callback is None)
             created_tasks.append(db_task)
         
         # Вызываем callback для уведомления если он передан
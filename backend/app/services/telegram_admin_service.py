@@ -11,14 +11,23 @@ class TelegramAdminService:
     FARMER_ID = settings.farmer_telegram_id
     
     @staticmethod
-    async def send_notification(message: str):
-        """Отправка уведомления админу"""
-        url = f"{TelegramAdminService.API_URL}/sendMessage"
-        payload = {
+    def send_message_url() -> str:
+        return f"{TelegramAdminService.API_URL}/sendMessage"
+    
+    @staticmethod
+    def notification_payload(message: str) -> Dict:
+        """Тело sendMessage для уведомления админу"""
+        return {
             "chat_id": TelegramAdminService.FARMER_ID,
             "text": message,
             "parse_mode": "HTML"
         }
+    
+    @staticmethod
+    async def send_notification(message: str):
+        """Отправка уведомления админу"""
+        url = TelegramAdminService.send_message_url()
+        payload = TelegramAdminService.notification_payload(message)
         
         async with httpx.AsyncClient() as client:
             try:
@@ -1,81 +1,193 @@
 """Сервис для управления таймерами"""
 
+import heapq
+import itertools
 import threading
+import time
 import logging
-from threading import Timer
-from typing import Callable, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional
 
 logger = logging.getLogger(__name__)
 
 
+class _TimerEntry:
+    """Запись в куче таймеров. Отмена помечает запись, а не ищет ее в куче"""
+    __slots__ = ("timer_id", "due", "callback", "cancelled")
+
+    def __init__(self, timer_id: str, due: float, callback: Callable):
+        self.timer_id = timer_id
+        self.due = due
+        self.callback = callback
+        self.cancelled = False
+
+
 class TimerService:
-    """Общий сервис для управления таймерами"""
-    
-    def __init__(self):
-        self._timers: Dict[str, Timer] = {}
-        self._lock = threading.Lock()
-    
+    """Общий сервис для управления таймерами
+
+    Все таймеры живут в одной куче (min-heap по времени срабатывания) и обслуживаются
+    одним потоком. Перенос и отмена таймера - O(log n) без создания потоков; колбэки
+    выполняются в небольшом пуле, чтобы долгий колбэк не задерживал остальные таймеры.
+    """
+
+    # Перестраивать кучу, когда отмененных записей больше половины
+    COMPACT_RATIO = 0.5
+
+    def __init__(self, callback_workers: int = 4, name: str = "timers"):
+        self._heap: List[tuple] = []
+        self._timers: Dict[str, _TimerEntry] = {}
+        self._seq = itertools.count()
+        self._cancelled_in_heap = 0
+        self._cond = threading.Condition()
+        self._callback_workers = callback_workers
+        self._name = name
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {
+            "fired": 0,
+            "lateness_total": 0.0,
+            "lateness_max": 0.0,
+            "lateness_last": 0.0
+        }
+
+    def _ensure_started(self) -> None:
+        """Поток таймеров запускается при первом schedule (вызывается под self._cond)"""
+        if self._thread is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._callback_workers, thread_name_prefix=f"{self._name}-callback")
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
     def schedule(self, timer_id: str, callback: Callable, delay_seconds: float) -> None:
         """Запланировать выполнение callback через delay_seconds, отменив предыдущий таймер если есть"""
-        with self._lock:
+        with self._cond:
+            self._ensure_started()
+
             # Отменяем старый таймер если существует
             if timer_id in self._timers:
-                old_timer = self._timers[timer_id]
-                old_timer.cancel()
+                self._mark_cancelled(self._timers.pop(timer_id))
                 logger.info(f"Отменен предыдущий таймер {timer_id}")
-            
+
             # Создаем новый таймер
-            timer = Timer(delay_seconds, callback)
-            timer.daemon = True
-            timer.start()
-            self._timers[timer_id] = timer
-            logger.info(f"Запланирован таймер {timer_id} через {delay_seconds/60:.1f} минут")
-    
+            entry = _TimerEntry(timer_id, time.monotonic() + delay_seconds, callback)
+            heapq.heappush(self._heap, (entry.due, next(self._seq), entry))
+            self._timers[timer_id] = entry
+            self._compact_if_needed()
+            # Будим поток, если новый таймер раньше текущего ожидания
+            self._cond.notify()
+        logger.info(f"Запланирован таймер {timer_id} через {delay_seconds/60:.1f} минут")
+
     def cancel(self, timer_id: str) -> None:
         """Отменить запланированный таймер"""
-        with self._lock:
+        with self._cond:
             if timer_id in self._timers:
-                self._timers[timer_id].cancel()
-                del self._timers[timer_id]
+                self._mark_cancelled(self._timers.pop(timer_id))
+                self._compact_if_needed()
                 logger.info(f"Отменен таймер {timer_id}")
-    
+
     def is_scheduled(self, timer_id: str) -> bool:
         """Проверить, запланирован ли таймер"""
-        with self._lock:
-            return timer_id in self._timers and self._timers[timer_id].is_alive()
-    
+        with self._cond:
+            return timer_id in self._timers
+
     def get_active_timers_count(self) -> int:
         """Получить количество активных таймеров"""
-        with self._lock:
-            return len([timer for timer in self._timers.values() if timer.is_alive()])
+        with self._cond:
+            return len(self._timers)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Число ожидающих таймеров и запаздывание срабатывания относительно срока"""
+        with self._cond:
+            fired = self._stats["fired"]
+            next_due = None
+            for due, _, entry in self._heap:
+                if not entry.cancelled:
+                    next_due = due if next_due is None else min(next_due, due)
+            return {
+                "pending": len(self._timers),
+                "heap_size": len(self._heap),
+                "fired": fired,
+                "next_in_seconds": round(max(0.0, next_due - time.monotonic()), 1) if next_due is not None else None,
+                "lateness_avg_ms": round(self._stats["lateness_total"] / fired * 1000, 1) if fired else 0.0,
+                "lateness_max_ms": round(self._stats["lateness_max"] * 1000, 1),
+                "lateness_last_ms": round(self._stats["lateness_last"] * 1000, 1)
+            }
+
+    def _mark_cancelled(self, entry: _TimerEntry) -> None:
+        entry.cancelled = True
+        self._cancelled_in_heap += 1
+
+    def _compact_if_needed(self) -> None:
+        """Убирает отмененные записи, чтобы частые переносы не раздували кучу"""
+        if self._cancelled_in_heap > 16 and self._cancelled_in_heap > len(self._heap) * self.COMPACT_RATIO:
+            self._heap = [item for item in self._heap if not item[2].cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled_in_heap = 0
+
+    def _run(self) -> None:
+        """Цикл потока таймеров: ждет ближайший срок и отдает колбэк в пул"""
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                        self._cancelled_in_heap -= 1
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(timeout=wait)
+
+                _, _, entry = heapq.heappop(self._heap)
+                del self._timers[entry.timer_id]
+
+                lateness = time.monotonic() - entry.due
+                self._stats["fired"] += 1
+                self._stats["lateness_total"] += lateness
+                self._stats["lateness_max"] = max(self._stats["lateness_max"], lateness)
+                self._stats["lateness_last"] = lateness
+
+            self._executor.submit(self._invoke, entry)
+
+    @staticmethod
+    def _invoke(entry: _TimerEntry) -> None:
+        try:
+            entry.callback()
+        except Exception as e:
+            logger.error(f"Ошибка в колбэке таймера {entry.timer_id}: {e}")
 
 
 class ClientAnalysisTimers:
     """Управление таймерами анализа для каждого клиента"""
-    
+
     def __init__(self):
-        self._timer_service = TimerService()
-    
+        self._timer_service = TimerService(name="client-analysis-timers")
+
     def schedule(self, client_id: int, callback: Callable, delay_seconds: float) -> None:
         """Запланировать анализ для клиента, отменив предыдущий таймер если есть"""
         timer_id = f"client_analysis_{client_id}"
         self._timer_service.schedule(timer_id, callback, delay_seconds)
-    
+
     def cancel(self, client_id: int) -> None:
         """Отменить запланированный анализ для клиента"""
         timer_id = f"client_analysis_{client_id}"
         self._timer_service.cancel(timer_id)
-    
+
     def is_scheduled(self, client_id: int) -> bool:
         """Проверить, запланирован ли анализ для клиента"""
         timer_id = f"client_analysis_{client_id}"
         return self._timer_service.is_scheduled(timer_id)
-    
+
     def get_active_timers_count(self) -> int:
         """Получить количество активных таймеров"""
         return self._timer_service.get_active_timers_count()
 
+    def get_metrics(self) -> Dict[str, Any]:
+        """Метрики таймеров анализа"""
+        return self._timer_service.get_metrics()
+
 
 # Глобальные экземпляры сервисов
 timer_service = TimerService()
-analysis_timers = ClientAnalysisTimers() 
\ No newline at end of file
+analysis_timers = ClientAnalysisTimers()
@@ -0,0 +1,169 @@
+"""Выполнение действий сработавших триггеров с ограниченным параллелизмом
+
+Проверка условий и выполнение действий разделены: check_all_triggers сначала
+собирает все срабатывания, затем действия выполняются здесь параллельно, не
+больше settings.trigger_action_concurrency одновременно. Внешние адресаты
+(хост webhook, Telegram) дополнительно ограничены своим числом одновременных
+запросов, у каждого вызова свой таймаут и повторы с экспоненциальной задержкой,
+поэтому один медленный адресат не задерживает весь запуск проверки.
+
+HTTP запросы идут через общий httpx.AsyncClient (пул соединений на event loop).
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Any, List, Optional, Callable, Awaitable, TypeVar
+from urllib.parse import urlparse
+
+import httpx
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Ответы, после которых запрос к адресату повторяется
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+
+class TriggerTargetError(Exception):
+    """Ответ адресата, после которого имеет смысл повторить запрос"""
+
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+class TriggerActionDispatcher:
+    """Общий HTTP клиент, ограничения по адресатам и параллельный запуск действий"""
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._target_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _bind_loop(self) -> None:
+        # Клиент и семафоры привязаны к event loop, в котором созданы
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._client = None
+            self._target_semaphores = {}
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """Общий клиент для webhook запросов триггеров"""
+        self._bind_loop()
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=settings.trigger_action_timeout_seconds,
+                limits=httpx.Limits(
+                    max_connections=settings.trigger_action_concurrency * 2,
+                    max_keepalive_connections=settings.trigger_action_concurrency
+                )
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    @staticmethod
+    def target_for_url(url: str) -> str:
+        return urlparse(url).netloc or url
+
+    def _target_semaphore(self, target: str) -> asyncio.Semaphore:
+        self._bind_loop()
+        semaphore = self._target_semaphores.get(target)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(settings.trigger_action_per_target_concurrency)
+            self._target_semaphores[target] = semaphore
+        return semaphore
+
+    async def call_target(
+        self,
+        target: str,
+        operation: Callable[[], Awaitable[T]],
+        timeout: Optional[float] = None,
+        retries: Optional[int] = None
+    ) -> T:
+        """Вызов адресата с таймаутом на попытку и повторами при сетевых ошибках, таймаутах и TriggerTargetError"""
+        timeout = settings.trigger_action_timeout_seconds if timeout is None else timeout
+        retries = settings.trigger_action_retries if retries is None else retries
+        semaphore = self._target_semaphore(target)
+
+        for attempt in range(retries + 1):
+            try:
+                async with semaphore:
+                    return await asyncio.wait_for(operation(), timeout=timeout)
+            except (asyncio.TimeoutError, httpx.TransportError, TriggerTargetError) as e:
+                if attempt >= retries:
+                    raise
+                delay = settings.trigger_action_retry_base_seconds * (2 ** attempt)
+                logger.warning(
+                    f"Адресат {target}: попытка {attempt + 1} из {retries + 1} не удалась "
+                    f"({type(e).__name__}: {e}), повтор через {delay}с"
+                )
+                await asyncio.sleep(delay)
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        **kwargs
+    ) -> httpx.Response:
+        """HTTP запрос через общий клиент; после исчерпания повторов возвращается последний ответ"""
+        timeout = settings.trigger_action_timeout_seconds if timeout is None else timeout
+
+        async def send() -> httpx.Response:
+            response = await self.http_client.request(method, url, timeout=timeout, **kwargs)
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                raise TriggerTargetError(response)
+            return response
+
+        try:
+            return await self.call_target(self.target_for_url(url), send, timeout=timeout, retries=retries)
+        except TriggerTargetError as e:
+            return e.response
+
+    async def run_all(
+        self,
+        items: List[T],
+        execute: Callable[[T], Awaitable[Dict[str, Any]]]
+    ) -> List[Dict[str, Any]]:
+        """Выполнить действия для всех срабатываний; результаты в том же порядке
+
+        Ошибка одного действия не прерывает остальные и возвращается как
+        {"success": False, "message": ..., "error": ...}.
+        """
+        if not items:
+            return []
+        semaphore = asyncio.Semaphore(settings.trigger_action_concurrency)
+
+        async def run(item: T) -> Dict[str, Any]:
+            async with semaphore:
+                started_at = time.perf_counter()
+                try:
+                    result = await execute(item)
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                    result = {"success": False, "message": error, "error": error}
+                result["duration_ms"] = round((time.perf_counter() - started_at) * 1000)
+                return result
+
+        started_at = time.perf_counter()
+        results = await asyncio.gather(*(run(item) for item in items))
+        logger.info(
+            f"Выполнено {len(results)} действий триггеров за {round(time.perf_counter() - started_at, 2)}с, "
+            f"успешно {sum(1 for result in results if result.get('success'))}"
+        )
+        return list(results)
+
+
+# Глобальный экземпляр диспетчера действий триггеров
+trigger_action_dispatcher = TriggerActionDispatcher()
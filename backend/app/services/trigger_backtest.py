@@ -0,0 +1,275 @@
+"""Бэктест триггеров по истории склада без побочных эффектов
+
+История восстанавливается из inventory_snapshots: последний полный снимок до
+начала периода и изменения после него. Каждая версия строки автомобиля за
+период попадает в одну колоночную таблицу (InventoryColumns), а загрузки склада
+раскладываются в переходы "новый / изменен / пропал" со ссылками на текущую и
+предыдущую версии. Условия триггера проверяются одной векторной маской по всем
+версиям, события подписки (new_match, price_dropped, status_changed, changed,
+removed) - операциями над массивами переходов с той же семантикой, что и
+TriggerService.find_trigger_events. Затем учитывается cooldown_minutes.
+
+Ничего не пишется в БД и не выполняется никаких действий. Восстановленная история
+кешируется по периоду и последнему снимку, поэтому повторные запуски с другими
+условиями (форма триггера) стоят только векторной проверки.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models.inventory import InventorySnapshot
+from ..models.trigger import TriggerEvent, DEFAULT_TRIGGER_EVENTS
+from .google_sheets_service import CarData
+from .trigger_engine import InventoryColumns, CompiledConditions
+
+logger = logging.getLogger(__name__)
+
+# Виды переходов между загрузками склада
+TRANSITION_NEW = 0
+TRANSITION_CHANGED = 1
+TRANSITION_REMOVED = 2
+
+
+def _timestamp(value: datetime) -> float:
+    # SQLite возвращает время без зоны - оно сохранялось в UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class InventoryHistory:
+    """Версии автомобилей и переходы между снимками склада за период"""
+
+    def __init__(self, snapshots: List[InventorySnapshot], start: datetime, end: datetime):
+        self.start = start
+        self.end = end
+        self.snapshot_count = 0
+        # Начало восстановленной истории: снимки могут начинаться позже start
+        self.history_start: Optional[datetime] = (
+            datetime.fromtimestamp(_timestamp(snapshots[0].taken_at), timezone.utc) if snapshots else None
+        )
+        raw_versions: List[Dict[str, Any]] = []
+        version_car_ids: List[str] = []
+        state: Dict[str, int] = {}
+        transitions: List[Tuple[int, int, int, float]] = []
+        initial: Optional[List[int]] = None
+        start_ts = _timestamp(start)
+
+        for position, snapshot in enumerate(snapshots):
+            taken_at = _timestamp(snapshot.taken_at)
+            # Первый (полный) снимок - исходное состояние склада, его автомобили не считаются новыми
+            record = position > 0 and taken_at > start_ts
+            if record and initial is None:
+                initial = list(state.values())
+            if record:
+                self.snapshot_count += 1
+
+            if snapshot.is_base:
+                upserts = snapshot.cars or {}
+                removed = [car_id for car_id in state if car_id not in upserts]
+            else:
+                upserts = snapshot.cars or {}
+                removed = snapshot.removed or []
+
+            for car_id, raw_data in upserts.items():
+                previous = state.get(car_id, -1)
+                # Полный снимок содержит и неизменившиеся строки
+                if previous >= 0 and raw_versions[previous] == raw_data:
+                    continue
+                version = len(raw_versions)
+                raw_versions.append(raw_data)
+                version_car_ids.append(car_id)
+                state[car_id] = version
+                if record:
+                    kind = TRANSITION_CHANGED if previous >= 0 else TRANSITION_NEW
+                    transitions.append((version, previous, kind, taken_at))
+
+            for car_id in removed:
+                previous = state.pop(car_id, None)
+                if previous is not None and record:
+                    # Как событие removed: проверяется последнее известное состояние
+                    transitions.append((previous, previous, TRANSITION_REMOVED, taken_at))
+
+        self.car_ids = version_car_ids
+        self.columns = InventoryColumns([
+            CarData(list(raw_data.values()), list(raw_data.keys())) for raw_data in raw_versions
+        ])
+        self.initial = np.array(list(state.values()) if initial is None else initial, dtype=np.int64)
+        table = np.array(transitions, dtype=np.float64).reshape(-1, 4)
+        self.current = table[:, 0].astype(np.int64)
+        self.previous = table[:, 1].astype(np.int64)
+        self.kind = table[:, 2].astype(np.int8)
+        self.times = table[:, 3]
+
+    @property
+    def transition_count(self) -> int:
+        return len(self.kind)
+
+    def event_masks(self, compiled: CompiledConditions) -> Dict[str, np.ndarray]:
+        """Маски переходов по видам событий триггера (как в TriggerService.find_trigger_events)"""
+        matches = compiled.mask(self.columns)
+        current_match = matches[self.current]
+        known_previous = self.previous >= 0
+        previous = np.where(known_previous, self.previous, 0)
+        previous_match = known_previous & matches[previous]
+
+        removed = self.kind == TRANSITION_REMOVED
+        changed = (self.kind == TRANSITION_CHANGED) & current_match
+        price = self.columns.numeric["price"]
+        status = self.columns.codes["status"]
+        return {
+            TriggerEvent.NEW_MATCH.value: ~removed & current_match & ~((self.kind == TRANSITION_CHANGED) & previous_match),
+            # NaN (нет цены) не проходит сравнение - как пропуск пустой цены в событии
+            TriggerEvent.PRICE_DROPPED.value: changed & (price[self.current] < price[previous]),
+            TriggerEvent.STATUS_CHANGED.value: changed & (status[self.current] != status[previous]),
+            TriggerEvent.CHANGED.value: changed,
+            TriggerEvent.REMOVED.value: removed & current_match,
+        }, matches
+
+
+class TriggerBacktester:
+    """Загрузка истории склада за период и оценка определений триггеров по ней"""
+
+    def __init__(self, max_histories: int = 4):
+        self._lock = threading.Lock()
+        self._histories: "OrderedDict[Tuple, InventoryHistory]" = OrderedDict()
+        self._max_histories = max_histories
+
+    def load_history(self, db: Session, start: datetime, end: datetime) -> InventoryHistory:
+        """История за период: последний полный снимок до start и изменения до end"""
+        anchor = db.query(InventorySnapshot.id).filter(
+            InventorySnapshot.is_base.is_(True),
+            InventorySnapshot.taken_at <= start
+        ).order_by(InventorySnapshot.taken_at.desc()).first()
+        if anchor is None:
+            # Снимки начались позже start - история от первого полного снимка
+            anchor = db.query(InventorySnapshot.id).filter(
+                InventorySnapshot.is_base.is_(True)
+            ).order_by(InventorySnapshot.taken_at).first()
+        if anchor is None:
+            return InventoryHistory([], start, end)
+
+        # История зависит только от набора снимков до и после start, а не от точного времени
+        in_range = db.query(InventorySnapshot.id).filter(
+            InventorySnapshot.id > anchor.id,
+            InventorySnapshot.taken_at > start,
+            InventorySnapshot.taken_at <= end
+        )
+        first = in_range.order_by(InventorySnapshot.id).first()
+        last = in_range.order_by(InventorySnapshot.id.desc()).first()
+        key = (anchor.id, first.id if first else None, last.id if last else None)
+        with self._lock:
+            history = self._histories.get(key)
+            if history is not None:
+                self._histories.move_to_end(key)
+                return history
+
+        snapshots = db.query(InventorySnapshot).filter(
+            InventorySnapshot.id >= anchor.id,
+            InventorySnapshot.taken_at <= end
+        ).order_by(InventorySnapshot.id).all()
+        history = InventoryHistory(snapshots, start, end)
+        with self._lock:
+            self._histories[key] = history
+            while len(self._histories) > self._max_histories:
+                self._histories.popitem(last=False)
+        return history
+
+    @staticmethod
+    def evaluate(history: InventoryHistory, definition: Dict[str, Any], sample_size: int = 10) -> Dict[str, Any]:
+        """Срабатывания одного определения триггера по истории
+
+        Args:
+            definition: {"conditions", "events", "cooldown_minutes", "name", "trigger_id"}
+        """
+        subscribed = list(definition.get("events") or DEFAULT_TRIGGER_EVENTS)
+        # Разовые условия формы не попадают в кеш компилятора проверки триггеров
+        compiled = CompiledConditions(definition.get("conditions") or {})
+        masks, matches = history.event_masks(compiled)
+
+        fired = np.zeros(history.transition_count, dtype=bool)
+        for kind in subscribed:
+            fired |= masks[kind]
+        positions = np.flatnonzero(fired)
+
+        cooldown = definition.get("cooldown_minutes")
+        cooldown = settings.trigger_default_cooldown_minutes if cooldown is None else cooldown
+        suppressed = 0
+        if cooldown > 0 and len(positions):
+            kept = []
+            last_fired: Dict[str, float] = {}
+            for position in positions.tolist():
+                car_id = history.car_ids[history.current[position]]
+                fired_at = history.times[position]
+                if car_id in last_fired and fired_at - last_fired[car_id] < cooldown * 60:
+                    suppressed += 1
+                    continue
+                last_fired[car_id] = fired_at
+                kept.append(position)
+            positions = np.array(kept, dtype=np.int64)
+
+        days, day_counts = np.unique((history.times[positions] // 86400).astype(np.int64), return_counts=True)
+        samples = []
+        for position in positions[:sample_size].tolist():
+            samples.append({
+                "fired_at": datetime.fromtimestamp(history.times[position], timezone.utc).isoformat(),
+                "events": [kind for kind in subscribed if masks[kind][position]],
+                "car": history.columns.cars[history.current[position]].to_dict()
+            })
+
+        return {
+            "trigger_id": definition.get("trigger_id"),
+            "name": definition.get("name"),
+            "events": subscribed,
+            "cooldown_minutes": cooldown,
+            # Столько new_match получил бы триггер, включенный в начале периода
+            "initial_matches": int(matches[history.initial].sum()) if len(history.initial) else 0,
+            "would_fire": int(len(positions)),
+            "suppressed_by_cooldown": suppressed,
+            "cars": len({history.car_ids[history.current[position]] for position in positions.tolist()}),
+            "by_event": {kind: int(masks[kind][positions].sum()) for kind in subscribed},
+            "by_day": {
+                datetime.fromtimestamp(int(day) * 86400, timezone.utc).date().isoformat(): int(count)
+                for day, count in zip(days, day_counts)
+            },
+            "samples": samples
+        }
+
+    def run(
+        self,
+        db: Session,
+        definitions: List[Dict[str, Any]],
+        start: datetime,
+        end: datetime,
+        sample_size: int = 10
+    ) -> Dict[str, Any]:
+        """Оценить определения триггеров по истории склада за период"""
+        started_at = time.perf_counter()
+        start, end = (value if value.tzinfo else value.replace(tzinfo=timezone.utc) for value in (start, end))
+        history = self.load_history(db, start, end)
+        loaded_at = time.perf_counter()
+        results = [self.evaluate(history, definition, sample_size) for definition in definitions]
+        finished_at = time.perf_counter()
+        return {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "history_start": history.history_start.isoformat() if history.history_start else None,
+            "snapshots": history.snapshot_count,
+            "transitions": history.transition_count,
+            "car_versions": history.columns.size,
+            "load_seconds": round(loaded_at - started_at, 4),
+            "evaluate_seconds": round(finished_at - loaded_at, 4),
+            "results": results
+        }
+
+
+# Глобальный экземпляр бэктеста триггеров
+trigger_backtester = TriggerBacktester()
@@ -0,0 +1,224 @@
+"""Подавление повторных срабатываний триггера по тому же автомобилю
+
+Для каждой пары (trigger_id, car_id) в trigger_cooldowns хранится время последнего
+выполненного действия. Пока не прошло cooldown_minutes триггера, новое событие по
+этому автомобилю не запускает NOTIFY, CREATE_TASK или WEBHOOK повторно - в том
+числе после перезапуска приложения.
+
+Во время проверки таблица не читается построчно: записи триггера загружаются в
+память одним запросом при первой проверке и отсекают повторы без обращения к БД.
+Окончательное решение - claim до выполнения действий: условный upsert по
+(trigger_id, car_id), который обновляет только истекшие записи, в отдельной
+транзакции. Из двух пересекающихся проверок (в одном процессе или на разных
+репликах) действие по автомобилю выполнит только та, чья запись прошла. Если
+действие не выполнилось, запись освобождается (release), и следующее событие по
+автомобилю не подавляется на весь cooldown.
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..core.database import SessionLocal
+from ..core.config import settings
+from ..models.trigger import Trigger, TriggerCooldown
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(value: datetime) -> float:
+    # SQLite возвращает время без зоны - оно сохранялось в UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class TriggerCooldownCache:
+    """Время последних срабатываний по автомобилям в памяти и захват записей trigger_cooldowns"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # trigger_id -> {car_id: unix time срабатывания}
+        self._entries: Dict[int, Dict[str, float]] = {}
+
+    @staticmethod
+    def cooldown_minutes(trigger: Trigger) -> int:
+        if trigger.cooldown_minutes is None:
+            return settings.trigger_default_cooldown_minutes
+        return trigger.cooldown_minutes
+
+    def load(self, db: Session, trigger_ids: List[int]) -> None:
+        """Загрузить записи триггеров, которых еще нет в памяти (один запрос)"""
+        with self._lock:
+            missing = [trigger_id for trigger_id in trigger_ids if trigger_id not in self._entries]
+        if not missing:
+            return
+
+        loaded: Dict[int, Dict[str, float]] = {trigger_id: {} for trigger_id in missing}
+        rows = db.query(
+            TriggerCooldown.trigger_id, TriggerCooldown.car_id, TriggerCooldown.last_fired_at
+        ).filter(TriggerCooldown.trigger_id.in_(missing)).all()
+        for trigger_id, car_id, last_fired_at in rows:
+            loaded[trigger_id][car_id] = _timestamp(last_fired_at)
+        with self._lock:
+            for trigger_id, entries in loaded.items():
+                self._entries.setdefault(trigger_id, entries)
+
+    def is_suppressed(self, trigger: Trigger, car_id: Optional[str], now: datetime) -> bool:
+        """Срабатывание по автомобилю было меньше cooldown_minutes назад (по памяти, без БД)"""
+        cooldown = self.cooldown_minutes(trigger)
+        if not car_id or cooldown <= 0:
+            return False
+        with self._lock:
+            fired_at = self._entries.get(trigger.id, {}).get(car_id)
+        return fired_at is not None and _timestamp(now) - fired_at < cooldown * 60
+
+    def claim(self, trigger: Trigger, car_ids: List[str], now: datetime) -> Set[str]:
+        """Занять cooldown по автомобилям до выполнения действий; возвращает car_id, по которым действие выполняется
+
+        Запись вставляется или обновляется, только если ее нет или cooldown истек,
+        и фиксируется отдельной транзакцией до выполнения действий.
+        """
+        car_ids = list(dict.fromkeys(car_id for car_id in car_ids if car_id))
+        cooldown = self.cooldown_minutes(trigger)
+        if not car_ids or cooldown <= 0:
+            return set(car_ids)
+        threshold = now - timedelta(minutes=cooldown)
+
+        db = SessionLocal()
+        try:
+            dialect = db.bind.dialect.name
+            if dialect in ("postgresql", "sqlite"):
+                claimed = self._claim_upsert(db, dialect, trigger.id, car_ids, now, threshold)
+            else:
+                claimed = self._claim_rows(db, trigger.id, car_ids, now, threshold)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        with self._lock:
+            entries = self._entries.get(trigger.id)
+            if entries is not None:
+                for car_id in claimed:
+                    entries[car_id] = _timestamp(now)
+                # Остальные автомобили заняты другой проверкой - в памяти их срок неизвестен
+                if len(claimed) < len(car_ids):
+                    del self._entries[trigger.id]
+        return claimed
+
+    @staticmethod
+    def _claim_upsert(
+        db: Session,
+        dialect: str,
+        trigger_id: int,
+        car_ids: List[str],
+        now: datetime,
+        threshold: datetime
+    ) -> Set[str]:
+        """INSERT ... ON CONFLICT (trigger_id, car_id) DO UPDATE ... WHERE истек ... RETURNING"""
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+
+        statement = dialect_insert(TriggerCooldown).values([
+            {"trigger_id": trigger_id, "car_id": car_id, "last_fired_at": now} for car_id in car_ids
+        ])
+        statement = statement.on_conflict_do_update(
+            index_elements=[TriggerCooldown.trigger_id, TriggerCooldown.car_id],
+            set_={"last_fired_at": statement.excluded.last_fired_at},
+            where=TriggerCooldown.last_fired_at < threshold
+        ).returning(TriggerCooldown.car_id)
+        return {car_id for (car_id,) in db.execute(statement)}
+
+    @staticmethod
+    def _claim_rows(
+        db: Session,
+        trigger_id: int,
+        car_ids: List[str],
+        now: datetime,
+        threshold: datetime
+    ) -> Set[str]:
+        """Условный UPDATE истекшей записи, иначе INSERT (конфликт - запись занята другой проверкой)"""
+        claimed = set()
+        for car_id in car_ids:
+            updated = db.query(TriggerCooldown).filter(
+                TriggerCooldown.trigger_id == trigger_id,
+                TriggerCooldown.car_id == car_id,
+                TriggerCooldown.last_fired_at < threshold
+            ).update({TriggerCooldown.last_fired_at: now}, synchronize_session=False)
+            if updated:
+                claimed.add(car_id)
+                continue
+            try:
+                with db.begin_nested():
+                    db.add(TriggerCooldown(trigger_id=trigger_id, car_id=car_id, last_fired_at=now))
+                claimed.add(car_id)
+            except IntegrityError:
+                pass
+        return claimed
+
+    def release(self, trigger: Trigger, car_ids: List[str], claimed_at: datetime) -> int:
+        """Вернуть cooldown по автомобилям, действие по которым не выполнилось
+
+        Удаляются только записи, которые все еще занимает эта проверка (last_fired_at ==
+        claimed_at). Прежняя запись к моменту claim уже истекла, так что удаление равносильно
+        ее восстановлению: следующее событие по автомобилю снова выполнит действие.
+        """
+        car_ids = list(dict.fromkeys(car_id for car_id in car_ids if car_id))
+        if not car_ids or self.cooldown_minutes(trigger) <= 0:
+            return 0
+
+        db = SessionLocal()
+        try:
+            released = db.query(TriggerCooldown).filter(
+                TriggerCooldown.trigger_id == trigger.id,
+                TriggerCooldown.car_id.in_(car_ids),
+                TriggerCooldown.last_fired_at == claimed_at
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        with self._lock:
+            entries = self._entries.get(trigger.id)
+            if entries is not None:
+                for car_id in car_ids:
+                    if entries.get(car_id) == _timestamp(claimed_at):
+                        del entries[car_id]
+        return released
+
+    def invalidate(self, trigger_id: Optional[int] = None) -> None:
+        with self._lock:
+            if trigger_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(trigger_id, None)
+
+    def cleanup(self, db: Session) -> int:
+        """Удалить записи, у которых подавление уже закончилось"""
+        now = datetime.now(timezone.utc)
+        deleted = 0
+        for trigger in db.query(Trigger).all():
+            cooldown = self.cooldown_minutes(trigger)
+            query = db.query(TriggerCooldown).filter(TriggerCooldown.trigger_id == trigger.id)
+            if cooldown > 0:
+                query = query.filter(TriggerCooldown.last_fired_at < now - timedelta(minutes=cooldown))
+            deleted += query.delete(synchronize_session=False)
+        db.commit()
+        self.invalidate()
+        return deleted
+
+
+# Глобальный кэш подавления повторных срабатываний
+trigger_cooldown_cache = TriggerCooldownCache()
@@ -0,0 +1,250 @@
+"""Компилированная векторная проверка условий триггеров по складу автомобилей
+
+Условия триггера компилируются один раз в набор проверок (точные совпадения и
+диапазоны), склад раскладывается по колонкам NumPy: категориальные поля кодируются
+целыми числами, числовые хранятся как float64 с NaN вместо пустых значений.
+Проверка триггера - несколько векторных масок по всем автомобилям сразу вместо
+вложенного цикла триггеры × автомобили на Python.
+
+InventoryIndex дополняет колонки индексами: списки номеров автомобилей по значению
+категориальных полей и отсортированные массивы цены, года и пробега. Поиск по
+условиям начинается с самого короткого списка или самого узкого диапазона, поэтому
+стоит порядка числа совпадений, а не размера склада.
+
+Семантика совпадает с построчной проверкой: пустое условие не учитывается,
+автомобиль без цены/года/пробега не проходит условие по этому полю.
+"""
+
+import json
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Поля точного совпадения: поле условия -> атрибут CarData
+CATEGORICAL_FIELDS = ("car_id", "brand", "model", "location", "status")
+NUMERIC_FIELDS = ("price", "year", "mileage")
+
+# Условия диапазонов: поле условия -> (атрибут CarData, нижняя граница или верхняя)
+RANGE_CONDITIONS = {
+    "price_min": ("price", "min"),
+    "price_max": ("price", "max"),
+    "year_min": ("year", "min"),
+    "year_max": ("year", "max"),
+    "mileage_max": ("mileage", "max"),
+}
+
+
+class InventoryColumns:
+    """Склад в колоночном виде: один проход по CarData на весь запуск проверки"""
+
+    def __init__(self, cars: List[Any]):
+        self.cars = cars
+        self.size = len(cars)
+        # Категориальные поля: значение -> код и массив кодов по автомобилям
+        self.categories: Dict[str, Dict[Optional[str], int]] = {}
+        self.codes: Dict[str, np.ndarray] = {}
+        self.numeric: Dict[str, np.ndarray] = {}
+
+        for field in CATEGORICAL_FIELDS:
+            mapping: Dict[Optional[str], int] = {}
+            self.codes[field] = np.fromiter(
+                (mapping.setdefault(getattr(car, field), len(mapping)) for car in cars),
+                dtype=np.int32, count=self.size
+            )
+            self.categories[field] = mapping
+
+        for field in NUMERIC_FIELDS:
+            self.numeric[field] = np.fromiter(
+                (np.nan if (value := getattr(car, field)) is None else value for car in cars),
+                dtype=np.float64, count=self.size
+            )
+
+    def category_mask(self, field: str, values: frozenset) -> np.ndarray:
+        """Маска автомобилей, у которых поле равно одному из значений"""
+        mapping = self.categories[field]
+        wanted = [mapping[value] for value in values if value in mapping]
+        if not wanted:
+            return np.zeros(self.size, dtype=bool)
+        if len(wanted) == 1:
+            return self.codes[field] == wanted[0]
+        return np.isin(self.codes[field], wanted)
+
+
+class CompiledConditions:
+    """Условия триггера, разобранные один раз в проверки точных совпадений и диапазонов"""
+    __slots__ = ("equals", "ranges")
+
+    def __init__(self, conditions: Dict[str, Any]):
+        self.equals: List[Tuple[str, frozenset]] = []
+        self.ranges: List[Tuple[str, str, float]] = []
+
+        for field in CATEGORICAL_FIELDS:
+            value = conditions.get(field)
+            if not value:
+                continue
+            # brand, model и status допускают список; car_id и location сравниваются как есть
+            values = value if isinstance(value, list) and field in ("brand", "model", "status") else [value]
+            self.equals.append((field, frozenset(v for v in values if isinstance(v, (str, int, float)))))
+
+        for condition_field, (field, bound) in RANGE_CONDITIONS.items():
+            value = conditions.get(condition_field)
+            if value is not None:
+                self.ranges.append((field, bound, float(value)))
+
+    def matches(self, car: Any) -> bool:
+        """Проверка одного автомобиля"""
+        for field, values in self.equals:
+            if getattr(car, field) not in values:
+                return False
+        for field, bound, limit in self.ranges:
+            value = getattr(car, field)
+            if value is None:
+                return False
+            if bound == "min" and value < limit:
+                return False
+            if bound == "max" and value > limit:
+                return False
+        return True
+
+    def mask(self, columns: InventoryColumns) -> np.ndarray:
+        """Маска подходящих автомобилей по всему складу"""
+        result = np.ones(columns.size, dtype=bool)
+        for field, values in self.equals:
+            result &= columns.category_mask(field, values)
+            if not result.any():
+                return result
+        for field, bound, limit in self.ranges:
+            # NaN (нет значения) не проходит ни одно сравнение
+            if bound == "min":
+                result &= columns.numeric[field] >= limit
+            else:
+                result &= columns.numeric[field] <= limit
+        return result
+
+    def match_indices(self, columns: InventoryColumns) -> np.ndarray:
+        """Номера подходящих автомобилей в порядке склада"""
+        return np.flatnonzero(self.mask(columns))
+
+
+class InventoryIndex(InventoryColumns):
+    """Индексы склада для поиска по условиям; строится заново при смене снимка склада"""
+
+    def __init__(self, cars: List[Any]):
+        super().__init__(cars)
+        # Значение категориального поля -> возрастающие номера автомобилей
+        self.postings: Dict[str, Dict[Optional[str], np.ndarray]] = {}
+        # Номера автомобилей с известным значением, упорядоченные по значению, и сами значения
+        self.sorted_positions: Dict[str, np.ndarray] = {}
+        self.sorted_values: Dict[str, np.ndarray] = {}
+
+        for field in CATEGORICAL_FIELDS:
+            codes = self.codes[field]
+            mapping = self.categories[field]
+            order = np.argsort(codes, kind="stable")
+            counts = np.bincount(codes, minlength=len(mapping))
+            groups = np.split(order, np.cumsum(counts)[:-1]) if len(mapping) else []
+            self.postings[field] = {value: groups[code] for value, code in mapping.items()}
+
+        for field in NUMERIC_FIELDS:
+            values = self.numeric[field]
+            known = np.flatnonzero(~np.isnan(values))
+            positions = known[np.argsort(values[known], kind="stable")]
+            self.sorted_positions[field] = positions
+            self.sorted_values[field] = values[positions]
+
+        # car_id -> номер первой строки с этим ID
+        self._car_positions: Dict[Optional[str], int] = {
+            value: int(positions[0]) for value, positions in self.postings["car_id"].items()
+        }
+
+    def get(self, car_id: str) -> Optional[Any]:
+        """Автомобиль по ID (первая строка склада, как при линейном поиске)"""
+        position = self._car_positions.get(car_id)
+        return None if position is None else self.cars[position]
+
+    def _equals_positions(self, field: str, values: frozenset) -> np.ndarray:
+        postings = self.postings[field]
+        found = [postings[value] for value in values if value in postings]
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        if len(found) == 1:
+            return found[0]
+        return np.sort(np.concatenate(found))
+
+    def _range_slice(self, field: str, low: float, high: float) -> Tuple[int, int]:
+        values = self.sorted_values[field]
+        return (
+            int(np.searchsorted(values, low, side="left")),
+            int(np.searchsorted(values, high, side="right"))
+        )
+
+    def match_indices(self, compiled: CompiledConditions) -> np.ndarray:
+        """Номера подходящих автомобилей в порядке склада"""
+        candidates: Optional[np.ndarray] = None
+
+        # Точные совпадения: пересечение списков, начиная с самого короткого
+        equals = sorted(
+            (self._equals_positions(field, values) for field, values in compiled.equals),
+            key=len
+        )
+        for positions in equals:
+            candidates = positions if candidates is None else np.intersect1d(candidates, positions, assume_unique=True)
+            if not len(candidates):
+                return candidates
+
+        # Диапазоны по полю сводятся к одному отрезку [low, high]
+        bounds: Dict[str, List[float]] = {}
+        for field, bound, limit in compiled.ranges:
+            low, high = bounds.setdefault(field, [-np.inf, np.inf])
+            if bound == "min":
+                bounds[field][0] = max(low, limit)
+            else:
+                bounds[field][1] = min(high, limit)
+
+        if candidates is None:
+            if not bounds:
+                return np.arange(self.size)
+            # Без точных совпадений берем самый узкий диапазон по отсортированному массиву
+            field, (start, end) = min(
+                ((field, self._range_slice(field, low, high)) for field, (low, high) in bounds.items()),
+                key=lambda item: item[1][1] - item[1][0]
+            )
+            candidates = np.sort(self.sorted_positions[field][start:end]) if end > start else np.empty(0, dtype=np.int64)
+            del bounds[field]
+
+        # Оставшиеся диапазоны проверяются только по кандидатам; NaN не проходит сравнение
+        for field, (low, high) in bounds.items():
+            if not len(candidates):
+                break
+            values = self.numeric[field][candidates]
+            candidates = candidates[(values >= low) & (values <= high)]
+        return candidates
+
+
+class TriggerConditionCompiler:
+    """Кеш скомпилированных условий: повторная компиляция только при изменении условий"""
+
+    def __init__(self, max_entries: int = 10000):
+        self._cache: Dict[str, CompiledConditions] = {}
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+
+    def compile(self, conditions: Optional[Dict[str, Any]]) -> CompiledConditions:
+        conditions = conditions or {}
+        key = json.dumps(conditions, sort_keys=True, ensure_ascii=False, default=str)
+        compiled = self._cache.get(key)
+        if compiled is None:
+            compiled = CompiledConditions(conditions)
+            with self._lock:
+                if len(self._cache) >= self._max_entries:
+                    self._cache.clear()
+                self._cache[key] = compiled
+        return compiled
+
+
+# Глобальный экземпляр компилятора условий
+trigger_condition_compiler = TriggerConditionCompiler()
@@ -0,0 +1,237 @@
+"""Планировщик проверки триггеров по времени следующей проверки каждого триггера
+
+Вместо опроса всех активных триггеров раз в 5 минут планировщик держит очередь
+с приоритетом (heap) по времени следующей проверки: last_checked_at +
+check_interval_minutes. Корутина спит ровно до ближайшего срока, забирает пачку
+триггеров, срок которых наступил (с окном trigger_scheduler_batch_window_seconds,
+чтобы близкие сроки проверялись вместе), и проверяет их по одному снимку склада.
+
+Очередь обновляется при создании, изменении, переключении и удалении триггера
+(TriggerService) и после каждой проверки. Для изменений из других процессов
+очередь периодически перечитывается из БД (trigger_scheduler_reload_seconds).
+"""
+
+import asyncio
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Optional, Tuple
+
+from ..core.config import settings
+from ..core.database import SessionLocal
+from ..models.trigger import Trigger, TriggerStatus
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    if value is None:
+        return None
+    # SQLite возвращает время без зоны - оно сохранялось в UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class TriggerScheduler:
+    """Очередь триггеров по сроку следующей проверки и корутина, которая их проверяет"""
+
+    # Через сколько повторить пачку, которую не удалось передать на проверку (например, ошибка БД)
+    RETRY_SECONDS = 30
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (срок, trigger_id); устаревшие записи пропускаются при извлечении
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_reload = 0.0
+        self._stats = {
+            "batches": 0,
+            "triggers_checked": 0,
+            "last_batch_at": None,
+            "last_batch_size": 0,
+            "last_batch_seconds": None
+        }
+
+    # Очередь
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def schedule(self, trigger_id: int, due_at: float) -> None:
+        """Назначить срок проверки триггера (unix time); заменяет прежний срок"""
+        # Без корутины очередь никто не разбирает (экземпляр не ведущий) - при запуске она перечитается из БД
+        if not self.running:
+            return
+        with self._lock:
+            self._due[trigger_id] = due_at
+            heapq.heappush(self._heap, (due_at, trigger_id))
+        # Корутина пересчитает время сна: срок мог стать ближе текущего ожидания
+        self.wake()
+
+    def schedule_trigger(self, trigger: Trigger) -> None:
+        """Поставить триггер в очередь по его состоянию; неактивный убирается из очереди"""
+        if trigger.status != TriggerStatus.ACTIVE:
+            self.remove_trigger(trigger.id)
+            return
+        last_checked = _timestamp(trigger.last_checked_at)
+        due_at = time.time() if last_checked is None else last_checked + trigger.check_interval_minutes * 60
+        self.schedule(trigger.id, due_at)
+
+    def remove_trigger(self, trigger_id: int) -> None:
+        with self._lock:
+            self._due.pop(trigger_id, None)
+
+    def pop_due(self, now: float) -> List[int]:
+        """Извлечь триггеры со сроком до now + окно пачки"""
+        horizon = now + settings.trigger_scheduler_batch_window_seconds
+        due_ids = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= horizon:
+                due_at, trigger_id = heapq.heappop(self._heap)
+                if self._due.get(trigger_id) == due_at:
+                    del self._due[trigger_id]
+                    due_ids.append(trigger_id)
+        return due_ids
+
+    def next_due_at(self) -> Optional[float]:
+        with self._lock:
+            # Верх кучи может быть устаревшей записью - снимаем такие
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    def reload(self) -> int:
+        """Перестроить очередь по активным триггерам из БД"""
+        db = SessionLocal()
+        try:
+            rows = db.query(
+                Trigger.id, Trigger.last_checked_at, Trigger.check_interval_minutes
+            ).filter(Trigger.status == TriggerStatus.ACTIVE).all()
+        finally:
+            db.close()
+
+        now = time.time()
+        due = {}
+        for trigger_id, last_checked_at, interval_minutes in rows:
+            last_checked = _timestamp(last_checked_at)
+            due[trigger_id] = now if last_checked is None else last_checked + interval_minutes * 60
+        with self._lock:
+            self._due = due
+            self._heap = [(due_at, trigger_id) for trigger_id, due_at in due.items()]
+            heapq.heapify(self._heap)
+        self._last_reload = time.monotonic()
+        return len(due)
+
+    # Корутина проверки
+
+    def start(self) -> None:
+        """Запустить планировщик в текущем event loop (вызывается в lifespan или при выборе ведущим)"""
+        # Очередь перечитывается из БД: пока экземпляр не был ведущим, триггеры проверял другой
+        self._last_reload = 0.0
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Планировщик триггеров запущен")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        with self._lock:
+            self._heap = []
+            self._due = {}
+
+    def wake(self) -> None:
+        """Пересчитать время сна. Можно вызывать из любого потока"""
+        if self._loop is not None and not self._loop.is_closed() and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if time.monotonic() - self._last_reload >= settings.trigger_scheduler_reload_seconds:
+                    count = await asyncio.to_thread(self.reload)
+                    logger.debug(f"Очередь триггеров перечитана из БД: {count} активных")
+
+                next_due = self.next_due_at()
+                until_reload = settings.trigger_scheduler_reload_seconds - (time.monotonic() - self._last_reload)
+                delay = until_reload if next_due is None else min(next_due - time.time(), until_reload)
+                if delay > 0:
+                    await self._sleep(delay)
+                    continue
+
+                due_ids = self.pop_due(time.time())
+                if due_ids:
+                    await self._check_batch(due_ids)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка планировщика триггеров: {e}")
+                await asyncio.sleep(5)
+
+    async def _sleep(self, delay: float) -> None:
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _check_batch(self, trigger_ids: List[int]) -> None:
+        from .trigger_service import TriggerService
+
+        started_at = time.perf_counter()
+        # pop_due уже убрал триггеры из очереди; после передачи в check_triggers их перепланирует он
+        handed_over = False
+        db = SessionLocal()
+        try:
+            triggers = db.query(Trigger).filter(
+                Trigger.id.in_(trigger_ids),
+                Trigger.status == TriggerStatus.ACTIVE
+            ).all()
+            logger.info(f"Проверка пачки триггеров по сроку: {len(triggers)}")
+            handed_over = True
+            result = await TriggerService.check_triggers(db, triggers, require_leader=True)
+            logger.info(f"Пачка триггеров проверена: {result.get('message', 'OK')}")
+        finally:
+            db.close()
+            if not handed_over:
+                # Иначе триггеры ждали бы следующего перечитывания очереди из БД
+                retry_at = time.time() + self.RETRY_SECONDS
+                with self._lock:
+                    missing = [trigger_id for trigger_id in trigger_ids if trigger_id not in self._due]
+                for trigger_id in missing:
+                    self.schedule(trigger_id, retry_at)
+
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["triggers_checked"] += len(trigger_ids)
+            self._stats["last_batch_at"] = datetime.now(timezone.utc).isoformat()
+            self._stats["last_batch_size"] = len(trigger_ids)
+            self._stats["last_batch_seconds"] = round(time.perf_counter() - started_at, 3)
+
+    def get_status(self) -> Dict[str, Any]:
+        next_due = self.next_due_at()
+        with self._lock:
+            upcoming = heapq.nsmallest(5, ((due_at, trigger_id) for trigger_id, due_at in self._due.items()))
+            return {
+                "running": self.running,
+                "queued_triggers": len(self._due),
+                "next_due_at": datetime.fromtimestamp(next_due, timezone.utc).isoformat() if next_due else None,
+                "upcoming": [
+                    {"trigger_id": trigger_id, "due_at": datetime.fromtimestamp(due_at, timezone.utc).isoformat()}
+                    for due_at, trigger_id in upcoming
+                ],
+                **self._stats
+            }
+
+
+# Глобальный экземпляр планировщика триггеров
+trigger_scheduler = TriggerScheduler()
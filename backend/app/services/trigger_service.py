@@ -1,14 +1,23 @@
-from typing import Optional, List, Dict, Any
-from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import desc
-from ..models.trigger import Trigger, TriggerLog, TriggerStatus, TriggerAction
+from typing import Optional, List, Dict, Any, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import Date, desc, insert, update, func, case
+from sqlalchemy.exc import IntegrityError
+from ..models.trigger import Trigger, TriggerLog, TriggerLogDaily, TriggerCooldown, TriggerStatus, TriggerAction, TriggerEvent, DEFAULT_TRIGGER_EVENTS
+from ..models.inventory import InventoryEvent
+from ..core.config import settings
+from ..core.database import SessionLocal
 from ..schemas.trigger import TriggerCreate, TriggerUpdate, TriggerLogCreate
 from .google_sheets_service import google_sheets_service, CarData
+from .trigger_engine import InventoryIndex, trigger_condition_compiler
+from .inventory_change_service import inventory_change_detector, EVENT_CHANGED, EVENT_REMOVED
+from .trigger_action_dispatcher import trigger_action_dispatcher
+from .trigger_scheduler import trigger_scheduler
+from .trigger_cooldown_service import trigger_cooldown_cache
+from .leader_election import scheduler_leader, trigger_check_lock
 from datetime import datetime, timedelta, timezone
 import logging
 import json
 import asyncio
-import httpx
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +30,7 @@ class TriggerService:
     @staticmethod
     def get_trigger(db: Session, trigger_id: int) -> Optional[Trigger]:
         """Получить триггер по ID"""
-        return db.query(Trigger).options(
-            joinedload(Trigger.trigger_logs)
-        ).filter(Trigger.id == trigger_id).first()
+        return db.query(Trigger).filter(Trigger.id == trigger_id).first()
 
     @staticmethod
     def get_triggers(
@@ -33,7 +40,7 @@ class TriggerService:
         status: Optional[TriggerStatus] = None
     ) -> List[Trigger]:
         """Получить список триггеров"""
-        query = db.query(Trigger).options(joinedload(Trigger.trigger_logs))
+        query = db.query(Trigger)
         
         if status:
             query = query.filter(Trigger.status == status)
@@ -51,14 +58,17 @@ class TriggerService:
             description=trigger_data.description,
             status=trigger_data.status,
             conditions=conditions_dict,
+            events=trigger_data.events,
             action_type=trigger_data.action_type,
             action_config=trigger_data.action_config,
-            check_interval_minutes=trigger_data.check_interval_minutes
+            check_interval_minutes=trigger_data.check_interval_minutes,
+            cooldown_minutes=trigger_data.cooldown_minutes
         )
         
         db.add(db_trigger)
         db.commit()
         db.refresh(db_trigger)
+        trigger_scheduler.schedule_trigger(db_trigger)
         return db_trigger
 
     @staticmethod
@@ -67,7 +77,15 @@ class TriggerService:
         trigger_id: int, 
         trigger_update: TriggerUpdate
     ) -> Optional[Trigger]:
-        """Обновить триггер"""
+        """Обновить триггер
+        
+        Позиция в журнале событий склада (last_event_id) после изменения:
+        - новые conditions или events: сбрасывается, и при следующей проверке триггер
+          получает new_match по всем автомобилям, подходящим под новые условия;
+        - повторная активация (из paused/inactive): переносится на последнее событие -
+          изменения склада за время паузы не воспроизводятся, срабатывания идут
+          по событиям после включения.
+        """
         db_trigger = db.query(Trigger).filter(Trigger.id == trigger_id).first()
         if not db_trigger:
             return None
@@ -78,11 +96,27 @@ class TriggerService:
         if 'conditions' in update_data and update_data['conditions']:
             update_data['conditions'] = update_data['conditions'].model_dump(exclude_unset=True)
         
+        definition_changed = any(
+            field in update_data and update_data[field] != getattr(db_trigger, field)
+            for field in ('conditions', 'events')
+        )
+        reactivated = (
+            update_data.get('status') == TriggerStatus.ACTIVE
+            and db_trigger.status != TriggerStatus.ACTIVE
+        )
+        
         for field, value in update_data.items():
             setattr(db_trigger, field, value)
         
+        if definition_changed:
+            db_trigger.last_event_id = None
+        elif reactivated and db_trigger.last_event_id is not None:
+            db_trigger.last_event_id = inventory_change_detector.get_latest_event_id(db)
+        
         db.commit()
         db.refresh(db_trigger)
+        # Смена статуса или интервала сразу меняет время следующей проверки
+        trigger_scheduler.schedule_trigger(db_trigger)
         return db_trigger
 
     @staticmethod
@@ -90,68 +124,75 @@ class TriggerService:
         """Удалить триггер"""
         db_trigger = db.query(Trigger).filter(Trigger.id == trigger_id).first()
         if db_trigger:
+            # Логи удаляются одним запросом, а не загрузкой коллекции для каскада
+            db.query(TriggerLog).filter(TriggerLog.trigger_id == trigger_id).delete(synchronize_session=False)
+            db.query(TriggerLogDaily).filter(TriggerLogDaily.trigger_id == trigger_id).delete(synchronize_session=False)
+            db.query(TriggerCooldown).filter(TriggerCooldown.trigger_id == trigger_id).delete(synchronize_session=False)
             db.delete(db_trigger)
             db.commit()
+            trigger_scheduler.remove_trigger(trigger_id)
+            trigger_cooldown_cache.invalidate(trigger_id)
             return True
         return False
 
     @staticmethod
     def check_trigger_condition(trigger: Trigger, car: CarData) -> bool:
-        """Проверить, соответствует ли автомобиль условиям триггера"""
-        conditions = trigger.conditions
-        
-        # Проверяем ID автомобиля
-        if 'car_id' in conditions and conditions['car_id']:
-            if car.car_id != conditions['car_id']:
-                return False
-        
-        # Проверяем марку
-        if 'brand' in conditions and conditions['brand']:
-            brands = conditions['brand'] if isinstance(conditions['brand'], list) else [conditions['brand']]
-            if car.brand not in brands:
-                return False
-        
-        # Проверяем модель
-        if 'model' in conditions and conditions['model']:
-            models = conditions['model'] if isinstance(conditions['model'], list) else [conditions['model']]
-            if car.model not in models:
-                return False
-        
-        # Проверяем локацию
-        if 'location' in conditions and conditions['location']:
-            if car.location != conditions['location']:
-                return False
-        
-        # Проверяем цену
-        if 'price_min' in conditions and conditions['price_min'] is not None:
-            if car.price is None or car.price < conditions['price_min']:
-                return False
-        
-        if 'price_max' in conditions and conditions['price_max'] is not None:
-            if car.price is None or car.price > conditions['price_max']:
-                return False
-        
-        # Проверяем год
-        if 'year_min' in conditions and conditions['year_min'] is not None:
-            if car.year is None or car.year < conditions['year_min']:
-                return False
-        
-        if 'year_max' in conditions and conditions['year_max'] is not None:
-            if car.year is None or car.year > conditions['year_max']:
-                return False
-        
-        # Проверяем пробег
-        if 'mileage_max' in conditions and conditions['mileage_max'] is not None:
-            if car.mileage is None or car.mileage > conditions['mileage_max']:
-                return False
-        
-        # Проверяем статус
-        if 'status' in conditions and conditions['status']:
-            statuses = conditions['status'] if isinstance(conditions['status'], list) else [conditions['status']]
-            if car.status not in statuses:
-                return False
-        
-        return True
+        """Проверить, соответствует ли автомобиль условиям триггера (условия компилируются один раз)"""
+        return trigger_condition_compiler.compile(trigger.conditions).matches(car)
+
+    @staticmethod
+    def find_matching_cars(trigger: Trigger, inventory: InventoryIndex) -> List[CarData]:
+        """Автомобили склада, подходящие под условия триггера, через индекс склада"""
+        compiled = trigger_condition_compiler.compile(trigger.conditions)
+        return [inventory.cars[position] for position in inventory.match_indices(compiled)]
+
+    @staticmethod
+    def find_trigger_events(
+        trigger: Trigger,
+        inventory: InventoryIndex,
+        events: List[InventoryEvent]
+    ) -> List[Tuple[CarData, List[str]]]:
+        """Автомобили, по которым у триггера есть события из подписки, и виды этих событий
+        
+        Триггер, который еще не проверялся, получает new_match по всем подходящим
+        автомобилям склада; дальше рассматриваются только события после last_event_id.
+        """
+        subscribed = set(trigger.events or DEFAULT_TRIGGER_EVENTS)
+        if trigger.last_event_id is None:
+            if TriggerEvent.NEW_MATCH.value not in subscribed:
+                return []
+            return [(car, [TriggerEvent.NEW_MATCH.value]) for car in TriggerService.find_matching_cars(trigger, inventory)]
+        
+        compiled = trigger_condition_compiler.compile(trigger.conditions)
+        matches = []
+        for event in events:
+            if event.id <= trigger.last_event_id or not event.data:
+                continue
+            car = CarData.from_dict(event.data)
+            if not compiled.matches(car):
+                continue
+            
+            if event.kind == EVENT_REMOVED:
+                kinds = [TriggerEvent.REMOVED.value]
+            else:
+                was_matching = (
+                    event.kind == EVENT_CHANGED and event.previous_data
+                    and compiled.matches(CarData.from_dict(event.previous_data))
+                )
+                kinds = [] if was_matching else [TriggerEvent.NEW_MATCH.value]
+                if event.kind == EVENT_CHANGED:
+                    changes = event.changes or {}
+                    old_price, new_price = changes.get("price", [None, None])
+                    if old_price is not None and new_price is not None and new_price < old_price:
+                        kinds.append(TriggerEvent.PRICE_DROPPED.value)
+                    if "status" in changes:
+                        kinds.append(TriggerEvent.STATUS_CHANGED.value)
+                    kinds.append(TriggerEvent.CHANGED.value)
+            
+            fired_kinds = [kind for kind in kinds if kind in subscribed]
+            if fired_kinds:
+                matches.append((car, fired_kinds))
+        return matches
 
     @staticmethod
     async def execute_trigger_action(
@@ -185,6 +226,8 @@ class TriggerService:
         except Exception as e:
             logger.error(f"Ошибка выполнения действия триггера {trigger.id}: {e}")
             action_result["message"] = str(e)
+            # По ключу error dispatch_trigger_actions записывает TriggerLog.error_message
+            action_result["error"] = str(e) or type(e).__name__
         
         return action_result
 
@@ -209,7 +252,7 @@ class TriggerService:
                 notifications_sent.append(f'websocket: {formatted_message}')
                 success_count += 1
             elif channel == 'telegram':
-                success = await TelegramAdminService.send_notification(
+                telegram_text = (
                     f"🎯 Сработал триггер: {trigger.name}\n"
                     f"Автомобиль: {car_data.car_id}\n"
                     f"Цена: {car_data.price}\n"
@@ -219,6 +262,19 @@ class TriggerService:
                     f"Триггер: {trigger.name}\n"
                     f"Сообщение: {formatted_message}"
                 )
+                try:
+                    # Через общий клиент диспетчера: таймаут, повторы при 429/5xx и ограничение на адресата
+                    response = await trigger_action_dispatcher.request(
+                        "POST",
+                        TelegramAdminService.send_message_url(),
+                        json=TelegramAdminService.notification_payload(telegram_text)
+                    )
+                    success = response.is_success
+                    if not success:
+                        logger.error(f"Telegram отклонил уведомление триггера {trigger.id}: HTTP {response.status_code}")
+                except Exception as e:
+                    logger.error(f"Ошибка отправки уведомления триггера {trigger.id} в Telegram: {e}")
+                    success = False
                 notifications_sent.append(f'telegram: {"✅" if success else "❌"} {formatted_message}')
                 if success:
                     success_count += 1
@@ -265,7 +321,8 @@ class TriggerService:
             }
         )
         
-        task = TaskService.create_task(db, task_data, send_notification=True)
+        # Создание задачи и уведомление синхронные - выполняются вне event loop
+        task = await asyncio.to_thread(TaskService.create_task, db, task_data, True)
         
         return {
             "success": True,
@@ -297,23 +354,106 @@ class TriggerService:
             "timestamp": datetime.now(timezone.utc).isoformat()
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method=method,
-                url=url,
-                json=payload,
-                headers=headers,
-                timeout=30
-            )
-            
-            return {
-                "success": response.is_success,
-                "message": f"Webhook вызван: {response.status_code}",
-                "data": {
-                    "status_code": response.status_code,
-                    "response_text": response.text[:500]  # Ограничиваем размер
-                }
+        # Общий клиент, таймаут и повторы на адресата (можно переопределить в action_config)
+        response = await trigger_action_dispatcher.request(
+            method,
+            url,
+            timeout=config.get('timeout'),
+            retries=config.get('retries'),
+            json=payload,
+            headers=headers
+        )
+        
+        return {
+            "success": response.is_success,
+            "message": f"Webhook вызван: {response.status_code}",
+            "data": {
+                "status_code": response.status_code,
+                "response_text": response.text[:500]  # Ограничиваем размер
             }
+        }
+
+    @staticmethod
+    async def dispatch_trigger_actions(db: Session, fired_triggers: List[Dict[str, Any]]) -> None:
+        """Выполнить действия срабатываний через диспетчер и записать результаты в строки логов"""
+        async def execute(item: Dict[str, Any]) -> Dict[str, Any]:
+            if item["trigger"].action_type != TriggerAction.CREATE_TASK:
+                return await TriggerService.execute_trigger_action(db, item["trigger"], item["car"])
+            # Своя сессия на задачу: действия выполняются параллельно, а commit общей сессии
+            # сбросил бы (expire) триггеры, которые читают другие действия
+            task_db = SessionLocal()
+            try:
+                return await TriggerService.execute_trigger_action(task_db, item["trigger"], item["car"])
+            finally:
+                task_db.close()
+        
+        results = await trigger_action_dispatcher.run_all(fired_triggers, execute)
+        for item, action_result in zip(fired_triggers, results):
+            log_row = item["log"]
+            log_row["action_result"] = action_result
+            log_row["success"] = action_result.get('success', False)
+            if "error" in action_result:
+                log_row["error_message"] = action_result["error"]
+                trigger_logger.error(f"Ошибка выполнения действия триггера {item['trigger'].name}: {action_result['error']}")
+            else:
+                trigger_logger.info(f"Действие триггера {item['trigger'].name} выполнено: {action_result.get('message', 'OK')}")
+
+    @staticmethod
+    def write_check_results(
+        db: Session,
+        trigger_updates: List[Dict[str, Any]],
+        log_rows: List[Dict[str, Any]]
+    ) -> None:
+        """Многострочная вставка логов и обновление триггеров по первичному ключу (без commit)"""
+        if log_rows:
+            db.execute(insert(TriggerLog), log_rows)
+        if trigger_updates:
+            db.execute(update(Trigger), trigger_updates)
+
+    @staticmethod
+    def save_check_results(
+        db: Session,
+        trigger_updates: Dict[int, Dict[str, Any]],
+        fired_triggers: List[Dict[str, Any]]
+    ) -> List[int]:
+        """Сохранить результаты запуска одной транзакцией
+        
+        Если общая запись не удалась, результаты сохраняются по каждому триггеру
+        отдельно; триггеру, у которого и это не удалось, обновляется только время
+        проверки. Возвращает ID таких триггеров.
+        """
+        log_rows_by_trigger: Dict[int, List[Dict[str, Any]]] = {}
+        for item in fired_triggers:
+            log_rows_by_trigger.setdefault(item["trigger"].id, []).append(item["log"])
+        
+        try:
+            TriggerService.write_check_results(
+                db,
+                list(trigger_updates.values()),
+                [item["log"] for item in fired_triggers]
+            )
+            db.commit()
+            return []
+        except Exception as e:
+            trigger_logger.error(f"Ошибка сохранения результатов проверки, сохраняем по триггерам: {e}")
+            db.rollback()
+        
+        failed_trigger_ids = []
+        for trigger_id, update_row in trigger_updates.items():
+            try:
+                TriggerService.write_check_results(db, [update_row], log_rows_by_trigger.get(trigger_id, []))
+                db.commit()
+            except Exception as trigger_error:
+                db.rollback()
+                failed_trigger_ids.append(trigger_id)
+                trigger_logger.error(f"Ошибка сохранения результатов триггера {trigger_id}: {trigger_error}")
+                try:
+                    db.execute(update(Trigger), [{"id": trigger_id, "last_checked_at": update_row["last_checked_at"]}])
+                    db.commit()
+                except Exception as commit_error:
+                    trigger_logger.error(f"Ошибка сохранения времени проверки для триггера {trigger_id}: {commit_error}")
+                    db.rollback()
+        return failed_trigger_ids
 
     @staticmethod
     def _format_message(message: str, car_data: CarData) -> str:
@@ -359,7 +499,59 @@ class TriggerService:
                     trigger_logger.debug(f"Триггер {trigger.name} (ID: {trigger.id}) добавлен для проверки - прошло {time_since_check.total_seconds()} секунд")
         
         trigger_logger.info(f"К проверке готово {len(triggers_to_check)} триггеров")
+        return await TriggerService.check_triggers(db, triggers_to_check)
+
+    @staticmethod
+    async def check_triggers(
+        db: Session,
+        triggers_to_check: List[Trigger],
+        now: Optional[datetime] = None,
+        require_leader: bool = False
+    ) -> Dict[str, Any]:
+        """Проверить переданные триггеры по одному снимку склада и перепланировать их
+        
+        Проверки выполняются по одной во всех экземплярах (trigger_check_lock), поэтому
+        ручная проверка на любой реплике и проверка ведущего не обработают одни и те же
+        события дважды.
         
+        Args:
+            require_leader: проверка планировщика ведущего - не выполняет действий,
+                если аренда ведущего потеряна
+        """
+        try:
+            async with trigger_check_lock.hold(settings.trigger_check_lock_timeout_seconds):
+                if triggers_to_check:
+                    # Пока ждали блокировку, другая проверка могла обработать события этих триггеров
+                    triggers_to_check = db.query(Trigger).filter(
+                        Trigger.id.in_([trigger.id for trigger in triggers_to_check]),
+                        Trigger.status == TriggerStatus.ACTIVE
+                    ).populate_existing().all()
+                return await TriggerService._check_triggers(
+                    db, triggers_to_check, now or datetime.now(timezone.utc), require_leader
+                )
+        except TimeoutError as lock_error:
+            trigger_logger.warning(f"Проверка триггеров пропущена: {lock_error}")
+            return {
+                "triggers_checked": 0,
+                "triggers_fired": 0,
+                "message": "Проверка триггеров уже выполняется",
+                "error": str(lock_error)
+            }
+        finally:
+            # Следующая проверка - через check_interval_minutes после этой
+            for trigger in triggers_to_check:
+                try:
+                    trigger_scheduler.schedule_trigger(trigger)
+                except Exception as schedule_error:
+                    trigger_logger.error(f"Ошибка планирования триггера {trigger.id}: {schedule_error}")
+
+    @staticmethod
+    async def _check_triggers(
+        db: Session,
+        triggers_to_check: List[Trigger],
+        now: datetime,
+        require_leader: bool = False
+    ) -> Dict[str, Any]:
         if not triggers_to_check:
             return {
                 "triggers_checked": 0,
@@ -367,20 +559,31 @@ class TriggerService:
                 "message": "Нет триггеров для проверки"
             }
         
-        # Получаем данные из Google Sheets с повторными попытками
+        # Получаем данные из Google Sheets с повторными попытками. Загрузка и задержки - вне
+        # event loop: иначе они задерживали бы продление аренды ведущего и блокировки проверок
         cars = None
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                cars = google_sheets_service.get_sheet_data()
+                cars = await asyncio.to_thread(google_sheets_service.get_sheet_data)
                 if cars:
                     break
                 trigger_logger.warning(f"Попытка {attempt + 1}: Нет данных из Google Sheets")
             except Exception as e:
                 trigger_logger.error(f"Попытка {attempt + 1}: Ошибка получения данных из Google Sheets: {e}")
                 if attempt < max_retries - 1:
-                    import time
-                    time.sleep(2 ** attempt)  # Экспоненциальная задержка
+                    await asyncio.sleep(2 ** attempt)  # Экспоненциальная задержка
+        
+        # Пока шла загрузка, аренда ведущего могла перейти к другому экземпляру. Дальше до
+        # выполнения действий ожиданий нет: проверка, cooldown и действия идут одним участком
+        if require_leader and settings.scheduler_leader_election and not scheduler_leader.holds_lease():
+            trigger_logger.warning("Экземпляр больше не ведущий: проверка триггеров прервана до выполнения действий")
+            return {
+                "triggers_checked": 0,
+                "triggers_fired": 0,
+                "message": "Проверка прервана: экземпляр больше не ведущий",
+                "error": "Аренда ведущего потеряна"
+            }
         
         if not cars:
             # Обновляем время проверки для всех триггеров, даже если данных нет
@@ -400,93 +603,143 @@ class TriggerService:
         fired_triggers = []
         triggers_with_errors = []
         
-        # Проверяем каждый триггер с изоляцией ошибок
+        # Индекс склада перестраивается только при изменении данных листа
+        inventory = google_sheets_service.get_inventory_index(cars)
+        
+        # Изменения склада с прошлой загрузки записываются в журнал событий
+        try:
+            inventory_change_detector.detect(db, cars)
+        except Exception as detect_error:
+            trigger_logger.error(f"Ошибка поиска изменений склада: {detect_error}")
+            db.rollback()
+        latest_event_id = inventory_change_detector.get_latest_event_id(db)
+        processed_event_ids = [trigger.last_event_id for trigger in triggers_to_check if trigger.last_event_id is not None]
+        events = (
+            inventory_change_detector.get_events(db, min(processed_event_ids), latest_event_id)
+            if processed_event_ids else []
+        )
+        
+        # Время последних срабатываний по автомобилям - один запрос на триггеры, которых нет в памяти
+        try:
+            trigger_cooldown_cache.load(db, [trigger.id for trigger in triggers_to_check])
+        except Exception as cooldown_error:
+            trigger_logger.error(f"Ошибка загрузки подавления повторных срабатываний: {cooldown_error}")
+            db.rollback()
+        
+        # Проверяем каждый триггер с изоляцией ошибок. Результаты копятся в памяти и пишутся
+        # после выполнения действий: один insert логов и один update триггеров на весь запуск
+        trigger_updates: Dict[int, Dict[str, Any]] = {}
+        suppressed_count = 0
         for trigger in triggers_to_check:
+            # Все строки update с одинаковым набором полей - один executemany
+            update_row = {
+                "id": trigger.id,
+                "last_checked_at": now,
+                "last_triggered_at": trigger.last_triggered_at,
+                "trigger_count": trigger.trigger_count,
+                "last_event_id": trigger.last_event_id
+            }
+            trigger_updates[trigger.id] = update_row
             try:
                 trigger_logger.debug(f"Проверяем триггер {trigger.name} (ID: {trigger.id})")
                 
-                # Обновляем время последней проверки
-                trigger.last_checked_at = now
-                
-                # Проверяем условия для каждого автомобиля
-                trigger_fired = False
-                for car in cars:
-                    try:
-                        if TriggerService.check_trigger_condition(trigger, car):
-                            trigger_logger.info(f"Триггер {trigger.name} сработал для автомобиля {car.car_id}")
-                            
-                            fired_triggers.append({
-                                "trigger": trigger,
-                                "car": car
-                            })
-                            
-                            # Обновляем статистику триггера
-                            trigger.last_triggered_at = now
-                            trigger.trigger_count += 1
-                            trigger_fired = True
-                            
-                            # Логируем срабатывание
-                            log_entry = TriggerLog(
-                                trigger_id=trigger.id,
-                                trigger_data=car.to_dict(),
-                                success=True
-                            )
-                            db.add(log_entry)
-                            
-                            # Выполняем действие триггера
-                            try:
-                                action_result = await TriggerService.execute_trigger_action(db, trigger, car)
-                                trigger_logger.info(f"Действие триггера выполнено: {action_result.get('message', 'OK')}")
-                                
-                                # Обновляем лог с результатом действия
-                                log_entry.action_result = action_result
-                                log_entry.success = action_result.get('success', False)
-                                
-                            except Exception as action_error:
-                                trigger_logger.error(f"Ошибка выполнения действия триггера {trigger.name}: {action_error}")
-                                log_entry.success = False
-                                log_entry.error_message = str(action_error)
-                    
-                    except Exception as car_error:
-                        trigger_logger.error(f"Ошибка проверки автомобиля {car.car_id} для триггера {trigger.name}: {car_error}")
-                        # Продолжаем проверку других автомобилей
+                # Только новые события склада, на которые подписан триггер; действия выполняются после проверки всех триггеров
+                trigger_fired = []
+                trigger_suppressed = 0
+                for car, event_kinds in TriggerService.find_trigger_events(trigger, inventory, events):
+                    if trigger_cooldown_cache.is_suppressed(trigger, car.car_id, now):
+                        trigger_logger.debug(f"Триггер {trigger.name}: повтор по автомобилю {car.car_id} подавлен ({', '.join(event_kinds)})")
+                        trigger_suppressed += 1
                         continue
+                    trigger_fired.append({
+                        "trigger": trigger,
+                        "car": car,
+                        "events": event_kinds,
+                        "log": {
+                            "trigger_id": trigger.id,
+                            "triggered_at": now,
+                            "trigger_data": {**car.to_dict(), "events": event_kinds},
+                            "action_result": None,
+                            "success": False,
+                            "error_message": None
+                        }
+                    })
                 
-                # Сохраняем изменения для этого триггера
-                db.commit()
+                # Cooldown занимается в БД до выполнения действий: пересекающаяся проверка
+                # (другая реплика или ручной запуск) не выполнит действие по тому же автомобилю
+                if trigger_fired:
+                    claimed = trigger_cooldown_cache.claim(trigger, [item["car"].car_id for item in trigger_fired], now)
+                    claimed_fired = []
+                    for item in trigger_fired:
+                        car_id = item["car"].car_id
+                        if car_id and car_id not in claimed:
+                            trigger_logger.debug(f"Триггер {trigger.name}: повтор по автомобилю {car_id} подавлен ({', '.join(item['events'])})")
+                            trigger_suppressed += 1
+                            continue
+                        if car_id and trigger_cooldown_cache.cooldown_minutes(trigger) > 0:
+                            # Второе событие по тому же автомобилю в этой проверке - тоже повтор
+                            claimed.discard(car_id)
+                        trigger_logger.info(f"Триггер {trigger.name} сработал для автомобиля {car_id} ({', '.join(item['events'])})")
+                        claimed_fired.append(item)
+                    trigger_fired = claimed_fired
+                
+                # Статистика триггера обновляется только если проверка прошла целиком
+                if trigger_fired:
+                    update_row["last_triggered_at"] = now
+                    update_row["trigger_count"] = trigger.trigger_count + len(trigger_fired)
+                update_row["last_event_id"] = latest_event_id
+                fired_triggers.extend(trigger_fired)
+                suppressed_count += trigger_suppressed
                 
             except Exception as trigger_error:
+                # Время проверки обновится, а события останутся необработанными до следующей проверки
                 trigger_logger.error(f"Критическая ошибка при проверке триггера {trigger.name} (ID: {trigger.id}): {trigger_error}")
                 triggers_with_errors.append({
                     "trigger_id": trigger.id,
                     "trigger_name": trigger.name,
                     "error": str(trigger_error)
                 })
-                
-                # Обновляем время проверки даже при ошибке
-                try:
-                    trigger.last_checked_at = now
-                    db.commit()
-                except Exception as commit_error:
-                    trigger_logger.error(f"Ошибка сохранения времени проверки для триггера {trigger.id}: {commit_error}")
-                    db.rollback()
         
-        # Финальная фиксация всех изменений
-        try:
-            db.commit()
-        except Exception as final_commit_error:
-            trigger_logger.error(f"Ошибка финального сохранения: {final_commit_error}")
-            db.rollback()
+        # Действия сработавших триггеров выполняются параллельно, результаты попадают в строки логов
+        await TriggerService.dispatch_trigger_actions(db, fired_triggers)
+
+        # Cooldown по неудавшимся действиям освобождается: иначе автомобиль был бы подавлен
+        # на весь cooldown и следующее событие по нему не выполнило бы действие
+        failed_by_trigger: Dict[int, Dict[str, Any]] = {}
+        for item in fired_triggers:
+            if not item["log"]["success"]:
+                failed = failed_by_trigger.setdefault(item["trigger"].id, {"trigger": item["trigger"], "car_ids": []})
+                failed["car_ids"].append(item["car"].car_id)
+        for failed in failed_by_trigger.values():
+            try:
+                trigger_cooldown_cache.release(failed["trigger"], failed["car_ids"], now)
+            except Exception as release_error:
+                trigger_logger.error(f"Ошибка освобождения cooldown триггера {failed['trigger'].name}: {release_error}")
+
+        # Логи и статистика триггеров - одной транзакцией на запуск
+        failed_trigger_ids = TriggerService.save_check_results(db, trigger_updates, fired_triggers)
+        for trigger_id in failed_trigger_ids:
+            triggers_with_errors.append({
+                "trigger_id": trigger_id,
+                "trigger_name": next(item.name for item in triggers_to_check if item.id == trigger_id),
+                "error": "Не удалось сохранить результаты проверки"
+            })
         
         result = {
             "triggers_checked": len(triggers_to_check),
             "triggers_fired": len(fired_triggers),
             "triggers_with_errors": len(triggers_with_errors),
-            "message": f"Проверено {len(triggers_to_check)} триггеров, сработало {len(fired_triggers)}, ошибок {len(triggers_with_errors)}",
+            "actions_executed": len(fired_triggers),
+            "actions_suppressed": suppressed_count,
+            "message": (
+                f"Проверено {len(triggers_to_check)} триггеров, сработало {len(fired_triggers)}, "
+                f"подавлено повторов {suppressed_count}, ошибок {len(triggers_with_errors)}"
+            ),
             "fired_triggers": [
                 {
                     "trigger_name": item["trigger"].name,
-                    "car_id": item["car"].car_id
+                    "car_id": item["car"].car_id,
+                    "events": item["events"]
                 }
                 for item in fired_triggers
             ]
@@ -513,6 +766,48 @@ class TriggerService:
         
         return query.order_by(desc(TriggerLog.triggered_at)).offset(skip).limit(limit).all()
 
+    @staticmethod
+    def get_trigger_counts(
+        db: Session,
+        since: datetime,
+        trigger_ids: Optional[List[int]] = None
+    ) -> Dict[int, Dict[str, int]]:
+        """Число срабатываний триггеров с момента since: {trigger_id: {"fired", "successful"}}
+
+        Свежие логи считаются агрегатным запросом, компактированные - по дневным
+        сводкам trigger_log_daily (день since учитывается целиком).
+        """
+        counts: Dict[int, Dict[str, int]] = {}
+
+        log_query = db.query(
+            TriggerLog.trigger_id,
+            func.count(TriggerLog.id),
+            func.sum(case((TriggerLog.success.is_(True), 1), else_=0))
+        ).filter(TriggerLog.triggered_at >= since)
+        daily_query = db.query(
+            TriggerLogDaily.trigger_id,
+            func.sum(TriggerLogDaily.fired_count),
+            func.sum(TriggerLogDaily.success_count)
+        ).filter(TriggerLogDaily.day >= since.date())
+        if trigger_ids is not None:
+            log_query = log_query.filter(TriggerLog.trigger_id.in_(trigger_ids))
+            daily_query = daily_query.filter(TriggerLogDaily.trigger_id.in_(trigger_ids))
+
+        for query, group_by in ((log_query, TriggerLog.trigger_id), (daily_query, TriggerLogDaily.trigger_id)):
+            for trigger_id, fired, successful in query.group_by(group_by).all():
+                row = counts.setdefault(trigger_id, {"fired": 0, "successful": 0})
+                row["fired"] += int(fired or 0)
+                row["successful"] += int(successful or 0)
+        return counts
+
+    @staticmethod
+    def count_triggers_by_status(db: Session) -> Dict[str, int]:
+        """Число триггеров по статусам одним запросом"""
+        counts = {status.value: 0 for status in TriggerStatus}
+        for status, count in db.query(Trigger.status, func.count(Trigger.id)).group_by(Trigger.status).all():
+            counts[status.value] = count
+        return counts
+
     @staticmethod
     def get_trigger_stats(db: Session, trigger_id: int) -> Dict[str, Any]:
         """Получить статистику по триггеру"""
@@ -522,16 +817,85 @@ class TriggerService:
         
         # Статистика за последние 30 дней
         thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
-        recent_logs = db.query(TriggerLog).filter(
-            TriggerLog.trigger_id == trigger_id,
-            TriggerLog.triggered_at >= thirty_days_ago
-        ).all()
+        recent = TriggerService.get_trigger_counts(db, thirty_days_ago, [trigger_id]).get(
+            trigger_id, {"fired": 0, "successful": 0}
+        )
         
         return {
             "total_triggers": trigger.trigger_count,
-            "triggers_last_30_days": len(recent_logs),
+            "triggers_last_30_days": recent["fired"],
+            "successful_last_30_days": recent["successful"],
+            "failed_last_30_days": recent["fired"] - recent["successful"],
             "last_triggered": trigger.last_triggered_at,
             "last_checked": trigger.last_checked_at,
             "status": trigger.status.value,
             "check_interval_minutes": trigger.check_interval_minutes
-        } 
\ No newline at end of file
+        }
+
+    @staticmethod
+    def compact_trigger_logs(db: Session, retention_days: Optional[int] = None) -> Dict[str, int]:
+        """Свернуть логи старше срока хранения в дневные сводки и удалить их
+
+        Граница - начало дня (UTC) retention_days дней назад, поэтому каждый день
+        целиком либо в trigger_logs, либо в trigger_log_daily. Сводки и удаление
+        логов записываются в одной транзакции.
+
+        Returns:
+            {"rollups": число затронутых дневных сводок, "logs": удалено логов}
+        """
+        retention_days = settings.trigger_log_retention_days if retention_days is None else retention_days
+        if retention_days <= 0:
+            return {"rollups": 0, "logs": 0}
+        cutoff_day = datetime.now(timezone.utc).date() - timedelta(days=retention_days)
+        cutoff = datetime(cutoff_day.year, cutoff_day.month, cutoff_day.day, tzinfo=timezone.utc)
+
+        day_column = func.date(TriggerLog.triggered_at, type_=Date)
+        rows = db.query(
+            TriggerLog.trigger_id,
+            day_column,
+            func.count(TriggerLog.id),
+            func.sum(case((TriggerLog.success.is_(True), 1), else_=0)),
+            func.max(TriggerLog.triggered_at)
+        ).filter(TriggerLog.triggered_at < cutoff).group_by(TriggerLog.trigger_id, day_column).all()
+        if not rows:
+            return {"rollups": 0, "logs": 0}
+
+        # Сводки за эти дни обычно еще не существуют; существующие (повторная компактизация) дополняются
+        existing = {
+            (rollup.trigger_id, rollup.day): rollup
+            for rollup in db.query(TriggerLogDaily).filter(
+                TriggerLogDaily.day >= min(row[1] for row in rows),
+                TriggerLogDaily.day < cutoff_day
+            ).all()
+        }
+        try:
+            for trigger_id, day, fired, successful, last_triggered_at in rows:
+                successful = int(successful or 0)
+                rollup = existing.get((trigger_id, day))
+                if rollup is None:
+                    db.add(TriggerLogDaily(
+                        trigger_id=trigger_id,
+                        day=day,
+                        fired_count=fired,
+                        success_count=successful,
+                        failed_count=fired - successful,
+                        last_triggered_at=last_triggered_at
+                    ))
+                    continue
+                rollup.fired_count += fired
+                rollup.success_count += successful
+                rollup.failed_count += fired - successful
+                if rollup.last_triggered_at is None or (last_triggered_at and last_triggered_at > rollup.last_triggered_at):
+                    rollup.last_triggered_at = last_triggered_at
+
+            deleted = db.query(TriggerLog).filter(
+                TriggerLog.triggered_at < cutoff
+            ).delete(synchronize_session=False)
+            db.commit()
+        except IntegrityError:
+            # Параллельная компактизация уже вставила сводку за этот день - логи остаются до следующего запуска
+            db.rollback()
+            logger.warning("Компактизация логов триггеров пропущена: сводки уже записываются другим процессом")
+            return {"rollups": 0, "logs": 0}
+
+        return {"rollups": len(rows), "logs": deleted}
@@ -0,0 +1,262 @@
+"""Бенчмарк AI анализа клиентов без обращения к OpenAI
+
+Экспорт переписок из рабочей БД в корпус:
+    python -m benchmarks.agent_benchmark export --output corpus.json --limit 50
+
+Прогон ClientAnalysisWorkflow.analyze_client_complete по корпусу во временной SQLite:
+    python -m benchmarks.agent_benchmark run --corpus corpus.json --backend fake
+    python -m benchmarks.agent_benchmark run --corpus corpus.json --backend record --cassettes ./cassettes
+    python -m benchmarks.agent_benchmark run --corpus corpus.json --backend replay --cassettes ./cassettes
+
+Отчет: время, итерации (вызовы LLM) и вызовы инструментов по агентам, токены и SQL запросы.
+Рабочая БД при прогоне не изменяется.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, Any, List
+
+AGENTS = ["dossier", "car_interest", "task", "combined"]
+
+
+def export_corpus(output: str, limit: int, client_ids: List[int]) -> None:
+    """Сохраняет переписки и текущее состояние клиентов из DATABASE_URL в JSON"""
+    from app.core.database import SessionLocal
+    from app.models import Client, Message, Dossier, CarInterest, Task
+
+    db = SessionLocal()
+    try:
+        query = db.query(Client)
+        if client_ids:
+            query = query.filter(Client.id.in_(client_ids))
+        clients = query.order_by(Client.last_message_at.desc()).limit(limit).all()
+
+        corpus = []
+        for client in clients:
+            messages = db.query(Message).filter(Message.client_id == client.id).order_by(Message.timestamp).all()
+            if not messages:
+                continue
+            dossier = db.query(Dossier).filter(Dossier.client_id == client.id).first()
+            car_interest = db.query(CarInterest).filter(CarInterest.client_id == client.id).first()
+            tasks = db.query(Task).filter(Task.client_id == client.id, Task.is_completed == False).all()
+            corpus.append({
+                "name": client.name,
+                "provider": client.provider,
+                "messages": [
+                    {
+                        "sender": msg.sender.value,
+                        "content_type": msg.content_type,
+                        "content": msg.content,
+                        "timestamp": msg.timestamp.isoformat() if msg.timestamp else None
+                    }
+                    for msg in messages
+                ],
+                "dossier": dossier.structured_data if dossier else None,
+                "car_interest": car_interest.structured_data if car_interest else None,
+                "tasks": [
+                    {
+                        "description": task.description,
+                        "due_date": task.due_date.isoformat() if task.due_date else None,
+                        "priority": task.priority
+                    }
+                    for task in tasks
+                ]
+            })
+    finally:
+        db.close()
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(corpus, f, ensure_ascii=False, indent=2)
+    print(f"Экспортировано переписок: {len(corpus)} -> {output}")
+
+
+def _load_corpus(corpus: List[Dict[str, Any]]) -> List[int]:
+    """Создает схему во временной БД и загружает корпус, возвращает ID клиентов"""
+    from app.core.database import Base, engine, SessionLocal
+    from app.models import Client, Message, Dossier, CarInterest, Task, SenderType
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    client_ids = []
+    try:
+        for index, conversation in enumerate(corpus, start=1):
+            client = Client(
+                pact_conversation_id=index,
+                pact_company_id=0,
+                sender_external_id=f"benchmark-{index}",
+                name=conversation.get("name"),
+                provider=conversation.get("provider") or "whatsapp"
+            )
+            db.add(client)
+            db.flush()
+            for msg in conversation["messages"]:
+                db.add(Message(
+                    client_id=client.id,
+                    sender=SenderType(msg["sender"]),
+                    content_type=msg.get("content_type") or "text",
+                    content=msg.get("content"),
+                    income=msg["sender"] == "client",
+                    timestamp=datetime.fromisoformat(msg["timestamp"]) if msg.get("timestamp") else None
+                ))
+            if conversation.get("dossier"):
+                db.add(Dossier(client_id=client.id, structured_data=conversation["dossier"]))
+            if conversation.get("car_interest"):
+                db.add(CarInterest(client_id=client.id, structured_data=conversation["car_interest"]))
+            for task in conversation.get("tasks") or []:
+                db.add(Task(
+                    client_id=client.id,
+                    description=task["description"],
+                    due_date=datetime.fromisoformat(task["due_date"]) if task.get("due_date") else None,
+                    priority=task.get("priority") or "normal",
+                    source="ai"
+                ))
+            client_ids.append(client.id)
+        db.commit()
+    finally:
+        db.close()
+    return client_ids
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_benchmark(args) -> Dict[str, Any]:
+    from sqlalchemy import event
+    from app.core.database import engine
+    from app.services.ai.workflows import ClientAnalysisWorkflow
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    client_ids = _load_corpus(corpus)
+
+    statements = {"count": 0}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements["count"] += 1
+
+    runs = []
+    for repeat in range(args.repeat):
+        for client_id in client_ids:
+            statements["count"] = 0
+            started_at = time.perf_counter()
+            result = ClientAnalysisWorkflow.analyze_client_complete(client_id, mode=args.mode, force=True)
+            wall_seconds = time.perf_counter() - started_at
+
+            usage = result.get("usage", {})
+            runs.append({
+                "client_id": client_id,
+                "repeat": repeat,
+                "wall_seconds": wall_seconds,
+                "db_statements": statements["count"],
+                "usage": usage,
+                "errors": [value for key, value in result.items() if key == "error" or key.endswith("_error")]
+            })
+
+    event.remove(engine, "before_cursor_execute", _count_statement)
+    return _summarize(runs, args)
+
+
+def _summarize(runs: List[Dict[str, Any]], args) -> Dict[str, Any]:
+    wall = [run["wall_seconds"] for run in runs]
+    per_agent = {}
+    for agent in AGENTS:
+        agent_runs = [run["usage"][agent] for run in runs if agent in run["usage"]]
+        if not agent_runs:
+            continue
+        per_agent[agent] = {
+            "runs": len(agent_runs),
+            "iterations_avg": round(statistics.mean(usage.get("llm_calls", 0) for usage in agent_runs), 2),
+            "tool_calls_avg": round(statistics.mean(usage.get("tool_calls", 0) for usage in agent_runs), 2),
+            "input_tokens_avg": round(statistics.mean(usage.get("input_tokens", 0) for usage in agent_runs)),
+            "output_tokens_avg": round(statistics.mean(usage.get("output_tokens", 0) for usage in agent_runs))
+        }
+
+    totals = [run["usage"].get("total", {}) for run in runs]
+    return {
+        "backend": args.backend,
+        "mode": args.mode,
+        "conversations": len({run["client_id"] for run in runs}),
+        "runs": len(runs),
+        "errors": sum(len(run["errors"]) for run in runs),
+        "wall_seconds": {
+            "total": round(sum(wall), 3),
+            "mean": round(statistics.mean(wall), 4) if wall else 0.0,
+            "p50": round(_percentile(wall, 50), 4),
+            "p95": round(_percentile(wall, 95), 4)
+        },
+        "db_statements_avg": round(statistics.mean(run["db_statements"] for run in runs), 1) if runs else 0.0,
+        "llm_calls_total": sum(total.get("llm_calls", 0) for total in totals),
+        "tool_calls_total": sum(total.get("tool_calls", 0) for total in totals),
+        "input_tokens_total": sum(total.get("input_tokens", 0) for total in totals),
+        "output_tokens_total": sum(total.get("output_tokens", 0) for total in totals),
+        "per_agent": per_agent
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"Бэкенд: {report['backend']}, режим: {report['mode']}, переписок: {report['conversations']}, "
+          f"прогонов: {report['runs']}, ошибок: {report['errors']}")
+    wall = report["wall_seconds"]
+    print(f"Время: всего {wall['total']}с, среднее {wall['mean']}с, p50 {wall['p50']}с, p95 {wall['p95']}с")
+    print(f"SQL запросов на анализ: {report['db_statements_avg']}")
+    print(f"Вызовов LLM: {report['llm_calls_total']}, инструментов: {report['tool_calls_total']}, "
+          f"токенов: {report['input_tokens_total']} + {report['output_tokens_total']}")
+    print(f"{'агент':<14}{'прогонов':>10}{'итераций':>10}{'tools':>8}{'in tok':>10}{'out tok':>10}")
+    for agent, stats in report["per_agent"].items():
+        print(f"{agent:<14}{stats['runs']:>10}{stats['iterations_avg']:>10}{stats['tool_calls_avg']:>8}"
+              f"{stats['input_tokens_avg']:>10}{stats['output_tokens_avg']:>10}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Экспорт переписок из DATABASE_URL в корпус")
+    export_parser.add_argument("--output", required=True)
+    export_parser.add_argument("--limit", type=int, default=50)
+    export_parser.add_argument("--client-ids", type=int, nargs="*", default=[])
+
+    run_parser = subparsers.add_parser("run", help="Прогон анализа по корпусу во временной SQLite")
+    run_parser.add_argument("--corpus", required=True)
+    run_parser.add_argument("--backend", choices=["fake", "replay", "record", "live"], default="fake")
+    run_parser.add_argument("--cassettes", default="./llm_cassettes")
+    run_parser.add_argument("--mode", choices=["per_agent", "combined"], default="per_agent")
+    run_parser.add_argument("--repeat", type=int, default=1)
+    run_parser.add_argument("--json", help="Сохранить отчет в JSON файл")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_corpus(args.output, args.limit, args.client_ids)
+        return
+
+    # Настройки читаются при импорте app.core.config, поэтому окружение задается до импорта приложения
+    database_file = os.path.join(tempfile.mkdtemp(prefix="agent-benchmark-"), "benchmark.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database_file}"
+    os.environ["LLM_BACKEND"] = args.backend
+    os.environ["LLM_CASSETTE_DIR"] = args.cassettes
+    os.environ["ANALYSIS_CACHE_ENABLED"] = "false"
+
+    report = run_benchmark(args)
+    _print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
@@ -0,0 +1,208 @@
+"""Бэктест триггеров по снимкам склада: время и сверка с обработкой событий
+
+Генерирует историю склада (загрузки с изменением цен и статусов, новыми и
+пропавшими автомобилями), сохраняет ее через InventoryChangeDetector.detect во
+временную SQLite и сравнивает:
+- replay: TriggerService.find_trigger_events по журналу inventory_events
+- backtest: trigger_backtester.run по inventory_snapshots (первый запуск и с
+  кешированной историей, как при повторных запросах из формы триггера)
+
+Число срабатываний по каждому виду событий должно совпадать (cooldown выключен), а маски
+переходов InventoryHistory.event_masks - с построчным пересчетом через legacy_check.
+
+    python -m benchmarks.trigger_backtest_benchmark --cars 3000 --loads 30 --triggers 50
+    python -m benchmarks.trigger_backtest_benchmark --base-hours 0
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Dict, Any, List
+
+from benchmarks.trigger_benchmark import HEADERS, STATUSES, generate_cars, generate_conditions, legacy_check
+
+EVENT_KINDS = ["new_match", "price_dropped", "status_changed", "changed", "removed"]
+
+
+def mutate(cars: List[Any], load: int, rate: float, rng: random.Random) -> List[Any]:
+    """Следующая загрузка листа: изменения цены и статуса, пропавшие и новые строки"""
+    from app.services.google_sheets_service import CarData
+
+    result = []
+    for car in cars:
+        roll = rng.random()
+        if roll < rate * 0.2:
+            continue
+        if roll < rate:
+            row = [car.raw_data.get(header, "") for header in HEADERS]
+            if rng.random() < 0.6 and car.price:
+                row[3] = f"${int(car.price * rng.choice([0.9, 0.95, 1.05])):,}"
+            else:
+                row[6] = rng.choice(STATUSES)
+            car = CarData(row, HEADERS)
+        result.append(car)
+    new_cars = generate_cars(max(1, int(len(cars) * rate * 0.2)), rng)
+    for index, car in enumerate(new_cars):
+        car.raw_data[" STOCK #"] = f"GE-{load}-{index}"
+    return result + new_cars
+
+
+def replay(definitions: List[Dict[str, Any]]) -> List[Dict[str, int]]:
+    """Срабатывания по журналу событий, как при проверке триггеров"""
+    from app.core.database import SessionLocal
+    from app.services.inventory_change_service import inventory_change_detector
+    from app.services.trigger_service import TriggerService
+
+    db = SessionLocal()
+    try:
+        events = inventory_change_detector.get_events(db, 0, inventory_change_detector.get_latest_event_id(db))
+    finally:
+        db.close()
+
+    report = []
+    for definition in definitions:
+        trigger = SimpleNamespace(conditions=definition["conditions"], events=definition["events"], last_event_id=0)
+        counts = {kind: 0 for kind in definition["events"]}
+        fired = TriggerService.find_trigger_events(trigger, None, events)
+        for _, kinds in fired:
+            for kind in kinds:
+                counts[kind] += 1
+        counts["would_fire"] = len(fired)
+        report.append(counts)
+    return report
+
+
+def check_transition_masks(history: Any, definitions: List[Dict[str, Any]]) -> int:
+    """Сверка масок переходов бэктеста с построчным пересчетом по прежней проверке условий
+
+    Returns:
+        Число определений с расхождениями (подробности печатаются)
+    """
+    import numpy as np
+    from app.services.trigger_backtest import TRANSITION_CHANGED, TRANSITION_REMOVED
+    from app.services.trigger_engine import CompiledConditions
+
+    cars = history.columns.cars
+    mismatches = 0
+    for index, definition in enumerate(definitions):
+        conditions = definition["conditions"]
+        masks, _ = history.event_masks(CompiledConditions(conditions))
+        matched = [legacy_check(conditions, car) for car in cars]
+        expected = {kind: [] for kind in EVENT_KINDS}
+        for position in range(history.transition_count):
+            current = cars[history.current[position]]
+            previous = cars[history.previous[position]] if history.previous[position] >= 0 else None
+            kind = history.kind[position]
+            if not matched[history.current[position]]:
+                continue
+            if kind == TRANSITION_REMOVED:
+                expected["removed"].append(position)
+                continue
+            if kind == TRANSITION_CHANGED:
+                expected["changed"].append(position)
+                if current.price is not None and previous.price is not None and current.price < previous.price:
+                    expected["price_dropped"].append(position)
+                if current.status != previous.status:
+                    expected["status_changed"].append(position)
+                if matched[history.previous[position]]:
+                    continue
+            expected["new_match"].append(position)
+
+        for kind in EVENT_KINDS:
+            got = np.flatnonzero(masks[kind]).tolist()
+            if got != expected[kind]:
+                mismatches += 1
+                print(f"Расхождение маски {kind} в определении {index}: ожидалось {len(expected[kind])}, "
+                      f"получено {len(got)}; {conditions}")
+                break
+    return mismatches
+
+
+def run(args) -> int:
+    from app.core.database import engine, Base, SessionLocal
+    import app.models  # noqa: F401 - регистрация таблиц
+    from app.services.inventory_change_service import inventory_change_detector
+    from app.services.trigger_backtest import trigger_backtester
+
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(args.seed)
+
+    started_at = datetime.now(timezone.utc) - timedelta(seconds=1)
+    cars = generate_cars(args.cars, rng)
+    db = SessionLocal()
+    try:
+        generation_started = time.perf_counter()
+        for load in range(args.loads):
+            if load:
+                cars = mutate(cars, load, args.change_rate, rng)
+            inventory_change_detector.detect(db, cars)
+        print(f"История: {args.loads} загрузок, {len(cars)} автомобилей, {time.perf_counter() - generation_started:.2f}с")
+    finally:
+        db.close()
+
+    definitions = [
+        {"conditions": conditions, "events": rng.sample(EVENT_KINDS, rng.randint(1, 3)), "cooldown_minutes": 0}
+        for conditions in generate_conditions(args.triggers, args.cars, rng)
+    ]
+
+    replay_started = time.perf_counter()
+    expected = replay(definitions)
+    replay_seconds = time.perf_counter() - replay_started
+
+    db = SessionLocal()
+    try:
+        end = datetime.now(timezone.utc)
+        first = trigger_backtester.run(db, definitions, started_at, end, sample_size=args.samples)
+        cached_started = time.perf_counter()
+        trigger_backtester.run(db, definitions, started_at, end, sample_size=args.samples)
+        cached_seconds = time.perf_counter() - cached_started
+        history = trigger_backtester.load_history(db, started_at, end)
+    finally:
+        db.close()
+
+    print(f"Снимков: {first['snapshots']}, переходов: {first['transitions']}, версий автомобилей: {first['car_versions']}")
+    print(f"replay по событиям:          {replay_seconds:.3f}с")
+    print(f"backtest (загрузка истории): {first['load_seconds'] + first['evaluate_seconds']:.3f}с "
+          f"(загрузка {first['load_seconds']}с, проверка {first['evaluate_seconds']}с)")
+    print(f"backtest (кеш истории):      {cached_seconds:.3f}с")
+
+    mismatches = 0
+    for index, (definition, want, got) in enumerate(zip(definitions, expected, first["results"])):
+        got_counts = {**got["by_event"], "would_fire": got["would_fire"]}
+        if got_counts != want:
+            mismatches += 1
+            print(f"Расхождение в определении {index}: ожидалось {want}, получено {got_counts}; {definition}")
+    print(f"Срабатываний всего: {sum(item['would_fire'] for item in expected)}, расхождений: {mismatches}")
+
+    mask_mismatches = check_transition_masks(history, definitions)
+    print(f"Сверка масок переходов с legacy: расхождений {mask_mismatches}")
+    return 1 if mismatches or mask_mismatches else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cars", type=int, default=3000)
+    parser.add_argument("--loads", type=int, default=30)
+    parser.add_argument("--triggers", type=int, default=50)
+    parser.add_argument("--change-rate", type=float, default=0.02, help="Доля строк, меняющихся за загрузку")
+    parser.add_argument("--samples", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--base-hours", type=int, help="Интервал полных снимков; 0 - полный снимок на каждой загрузке")
+    args = parser.parse_args()
+
+    # Настройки читаются при импорте app.core.config, поэтому окружение задается до импорта приложения
+    database_file = os.path.join(tempfile.mkdtemp(prefix="trigger-backtest-benchmark-"), "benchmark.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database_file}"
+    if args.base_hours is not None:
+        os.environ["INVENTORY_SNAPSHOT_BASE_HOURS"] = str(args.base_hours)
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
@@ -0,0 +1,222 @@
+"""Бенчмарк проверки условий триггеров по складу автомобилей
+
+Синтетический склад и триггеры, сравнение способов проверки:
+- legacy: прежний построчный разбор словаря conditions для каждой пары триггер × автомобиль
+- compiled: скомпилированные условия, построчная проверка
+- vectorized: скомпилированные условия и маски NumPy по колонкам склада
+- indexed: поиск по индексу склада (списки по значениям и отсортированные диапазоны)
+
+    python -m benchmarks.trigger_benchmark --cars 20000 --triggers 500
+    python -m benchmarks.trigger_benchmark --cars 20000 --triggers 500 --skip-legacy
+
+Число совпадений у всех способов должно быть одинаковым, а на части склада (--parity-cars)
+каждый триггер должен находить те же автомобили, что и legacy, иначе бенчмарк завершается ошибкой.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Dict, Any, List
+
+HEADERS = [' STOCK #', 'МАРКА', ' МОДЕЛЬ', ' ЦЕНА ПРОДАЖИ В ГРУЗИИ $', 'Год', 'Пробег', 'Статус', 'Location']
+BRANDS = {
+    "Toyota": ["Camry", "RAV4", "Prius", "Highlander"],
+    "Honda": ["Civic", "Accord", "CR-V"],
+    "Hyundai": ["Sonata", "Elantra", "Tucson", "Santa Fe"],
+    "Kia": ["Optima", "Sportage", "Sorento"],
+    "BMW": ["X5", "320i", "530i"],
+    "Mercedes-Benz": ["C300", "E350", "GLE"],
+    "Lexus": ["RX350", "ES350"],
+    "Ford": ["Fusion", "Escape", "Explorer"],
+}
+STATUSES = ["В пути", "В Поти", "В продаже", "Продан", "Резерв"]
+LOCATIONS = ["Поти", "Тбилиси", "Батуми", "Порт США", ""]
+
+
+def generate_cars(count: int, rng: random.Random) -> List[Any]:
+    """Строки склада в формате Google Sheets, включая пустые и неразборчивые значения"""
+    from app.services.google_sheets_service import CarData
+
+    cars = []
+    for index in range(count):
+        brand = rng.choice(list(BRANDS))
+        price = "" if rng.random() < 0.05 else f"${rng.randint(3, 60) * 500:,}"
+        mileage = "" if rng.random() < 0.05 else f"{rng.randint(0, 250) * 1000} mi"
+        year = "н/д" if rng.random() < 0.02 else str(rng.randint(2008, 2024))
+        row = [
+            f"GE-{index}", brand, rng.choice(BRANDS[brand]), price, year, mileage,
+            rng.choice(STATUSES), rng.choice(LOCATIONS)
+        ]
+        cars.append(CarData(row, HEADERS))
+    return cars
+
+
+def generate_conditions(count: int, car_count: int, rng: random.Random) -> List[Dict[str, Any]]:
+    """Условия, похожие на настраиваемые в интерфейсе триггеров, включая редкие формы
+
+    Списки и одиночные значения марки, модели и статуса, пустые значения, явные None
+    и пересекающиеся или пустые диапазоны цены и года.
+    """
+    result = []
+    for _ in range(count):
+        conditions: Dict[str, Any] = {}
+        if rng.random() < 0.05:
+            conditions["car_id"] = f"GE-{rng.randrange(car_count)}"
+        brands = rng.sample(list(BRANDS), rng.randint(1, 2))
+        if rng.random() < 0.8:
+            conditions["brand"] = brands if len(brands) > 1 else brands[0]
+        elif rng.random() < 0.2:
+            conditions["brand"] = rng.choice([[], ""])
+        if rng.random() < 0.3:
+            models = rng.sample(BRANDS[brands[0]], rng.randint(1, 2))
+            conditions["model"] = models if rng.random() < 0.3 else models[0]
+        if rng.random() < 0.6:
+            statuses = rng.sample(STATUSES, rng.randint(1, 2))
+            conditions["status"] = statuses if rng.random() < 0.8 else statuses[0]
+        if rng.random() < 0.3:
+            conditions["location"] = rng.choice(LOCATIONS)
+        for key, low, high in (("price_min", 3, 40), ("price_max", 10, 60)):
+            roll = rng.random()
+            if roll < 0.6:
+                conditions[key] = rng.randint(low, high) * 500
+            elif roll < 0.7:
+                conditions[key] = None
+        if rng.random() < 0.5:
+            conditions["year_min"] = rng.randint(2008, 2022)
+        if rng.random() < 0.3:
+            conditions["year_max"] = rng.randint(2010, 2024)
+        if rng.random() < 0.4:
+            conditions["mileage_max"] = rng.randint(0, 200) * 1000
+        result.append(conditions)
+    return result
+
+
+def legacy_check(conditions: Dict[str, Any], car: Any) -> bool:
+    """Прежняя построчная проверка TriggerService.check_trigger_condition (разбор словаря условий на каждый автомобиль)"""
+    if conditions.get('car_id') and car.car_id != conditions['car_id']:
+        return False
+    for field in ('brand', 'model', 'status'):
+        if conditions.get(field):
+            values = conditions[field] if isinstance(conditions[field], list) else [conditions[field]]
+            if getattr(car, field) not in values:
+                return False
+    if conditions.get('location') and car.location != conditions['location']:
+        return False
+    for key, field, is_min in (('price_min', 'price', True), ('price_max', 'price', False),
+                               ('year_min', 'year', True), ('year_max', 'year', False),
+                               ('mileage_max', 'mileage', False)):
+        if conditions.get(key) is not None:
+            value = getattr(car, field)
+            if value is None or (value < conditions[key] if is_min else value > conditions[key]):
+                return False
+    return True
+
+
+def check_parity(cars: List[Any], all_conditions: List[Dict[str, Any]]) -> int:
+    """Сверка по каждому триггеру: matches, mask и InventoryIndex.match_indices дают те же автомобили, что legacy_check
+
+    Returns:
+        Число триггеров с расхождениями (подробности печатаются)
+    """
+    import numpy as np
+    from app.services.trigger_engine import CompiledConditions, InventoryIndex
+
+    index = InventoryIndex(cars)
+    mismatches = 0
+    for conditions in all_conditions:
+        compiled = CompiledConditions(conditions)
+        expected = [position for position, car in enumerate(cars) if legacy_check(conditions, car)]
+        got = {
+            "matches": [position for position, car in enumerate(cars) if compiled.matches(car)],
+            "mask": np.flatnonzero(compiled.mask(index)).tolist(),
+            "indexed": sorted(index.match_indices(compiled).tolist())
+        }
+        for name, positions in got.items():
+            if positions != expected:
+                mismatches += 1
+                print(f"Расхождение {name}: ожидалось {len(expected)} автомобилей, получено {len(positions)}; {conditions}")
+                break
+    return mismatches
+
+
+def run(car_count: int, trigger_count: int, seed: int, skip_legacy: bool, parity_cars: int) -> None:
+    from app.services.trigger_engine import InventoryColumns, InventoryIndex, TriggerConditionCompiler
+
+    rng = random.Random(seed)
+    cars = generate_cars(car_count, rng)
+    all_conditions = generate_conditions(trigger_count, car_count, rng)
+    timings: Dict[str, float] = {}
+    matches: Dict[str, int] = {}
+
+    if not skip_legacy:
+        started = time.perf_counter()
+        matches["legacy"] = sum(legacy_check(conditions, car) for conditions in all_conditions for car in cars)
+        timings["legacy"] = time.perf_counter() - started
+
+    compiler = TriggerConditionCompiler()
+    started = time.perf_counter()
+    compiled = [compiler.compile(conditions) for conditions in all_conditions]
+    timings["compile"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matches["compiled"] = sum(predicate.matches(car) for predicate in compiled for car in cars)
+    timings["compiled"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    columns = InventoryColumns(cars)
+    timings["columns"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matches["vectorized"] = sum(len(predicate.match_indices(columns)) for predicate in compiled)
+    timings["vectorized"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    index = InventoryIndex(cars)
+    timings["index"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matches["indexed"] = sum(len(index.match_indices(predicate)) for predicate in compiled)
+    timings["indexed"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    lookups = sum(index.get(f"GE-{position}") is not None for position in range(0, car_count, 7))
+    timings["get"] = time.perf_counter() - started
+
+    print(f"Склад: {car_count} автомобилей, триггеров: {trigger_count}, пар: {car_count * trigger_count}")
+    print(f"Компиляция условий: {timings['compile'] * 1000:.1f} мс")
+    print(f"Построение колонок склада: {timings['columns'] * 1000:.1f} мс")
+    print(f"Построение индекса склада: {timings['index'] * 1000:.1f} мс")
+    print(f"Поиск по car_id: {lookups} запросов за {timings['get'] * 1000:.1f} мс")
+    for name in ("legacy", "compiled", "vectorized", "indexed"):
+        if name in timings:
+            print(f"{name:>10}: {timings[name] * 1000:10.1f} мс, совпадений {matches[name]}")
+    if "legacy" in timings:
+        total = timings["vectorized"] + timings["columns"] + timings["compile"]
+        print(f"Ускорение vectorized (с колонками и компиляцией) относительно legacy: {timings['legacy'] / total:.1f}x")
+
+    if len(set(matches.values())) != 1:
+        print(f"Число совпадений различается: {matches}")
+        sys.exit(1)
+
+    mismatches = check_parity(cars[:parity_cars], all_conditions)
+    print(f"Сверка с legacy по {min(parity_cars, car_count)} автомобилям и {trigger_count} триггерам: расхождений {mismatches}")
+    if mismatches:
+        sys.exit(1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cars", type=int, default=20000)
+    parser.add_argument("--triggers", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-legacy", action="store_true", help="Не запускать прежнюю построчную проверку")
+    parser.add_argument("--parity-cars", type=int, default=2000, help="Автомобилей в поштучной сверке с legacy")
+    args = parser.parse_args()
+    run(args.cars, args.triggers, args.seed, args.skip_legacy, args.parity_cars)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
@@ -19,6 +19,7 @@ import {
   Trigger 
 } from '../types';
 import { taskTriggersApi, triggersApi } from '../services/api';
+import { useTriggerBacktest } from '../hooks/useTriggerBacktest';
 
 interface TriggerFormProps {
   clientId: number;
@@ -52,6 +53,15 @@ export const TriggerForm = ({
   const [isLoading, setIsLoading] = useState(false);
   const [errors, setErrors] = useState<Record<string, string>>({});
 
+  // Сколько раз триггер с текущими условиями сработал бы за последние 7 дней
+  const backtest = useTriggerBacktest({
+    definition: {
+      conditions: formData.conditions,
+      events: existingTrigger?.events,
+      cooldown_minutes: existingTrigger?.cooldown_minutes,
+    },
+  });
+
   const handleConditionChange = (field: keyof TriggerConditions, value: any) => {
     setFormData(prev => ({
       ...prev,
@@ -602,6 +612,37 @@ export const TriggerForm = ({
         )}
       </div>
 
+      {/* Проверка на истории склада */}
+      <div className="p-3 bg-neutral-50 border border-neutral-200 rounded-lg">
+        <div className="flex items-center text-sm font-medium text-neutral-700 mb-1">
+          <Zap className="w-4 h-4 mr-2" />
+          Проверка на истории склада за 7 дней
+        </div>
+        {backtest.error ? (
+          <p className="text-xs text-red-600">{backtest.error}</p>
+        ) : backtest.result ? (
+          <div className={`text-xs text-neutral-600 space-y-1 ${backtest.isLoading ? 'opacity-60' : ''}`}>
+            <p>
+              Сработал бы {backtest.result.would_fire} раз по {backtest.result.cars} автомобилям
+              {backtest.result.suppressed_by_cooldown > 0 && `, повторов подавлено: ${backtest.result.suppressed_by_cooldown}`}
+            </p>
+            <p>В начале периода под условия подходило автомобилей: {backtest.result.initial_matches}</p>
+            {backtest.result.samples.length > 0 && (
+              <ul className="list-disc list-inside">
+                {backtest.result.samples.map((sample, index) => (
+                  <li key={index}>
+                    {new Date(sample.fired_at).toLocaleString('ru-RU')}: {sample.car.brand} {sample.car.model}
+                    {sample.car.price ? ` $${Number(sample.car.price).toLocaleString('ru-RU')}` : ''} ({sample.car.car_id})
+                  </li>
+                ))}
+              </ul>
+            )}
+          </div>
+        ) : (
+          <p className="text-xs text-neutral-500">{backtest.isLoading ? 'Проверяем...' : 'Нет данных'}</p>
+        )}
+      </div>
+
       {/* Интервал проверки */}
       <div>
         <label className="flex items-center text-sm font-medium text-neutral-700 mb-2">
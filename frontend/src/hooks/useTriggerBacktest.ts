@@ -0,0 +1,70 @@
+import { useEffect, useRef, useState } from 'react';
+import { TriggerBacktestDefinition, TriggerBacktestResponse } from '../types';
+import { triggersApi } from '../services/api';
+
+interface UseTriggerBacktestProps {
+  definition: TriggerBacktestDefinition;
+  days?: number;
+  sampleSize?: number;
+  enabled?: boolean;
+}
+
+// Бэктест условий триггера по истории склада: пересчитывается при изменении условий
+// с задержкой, устаревшие ответы отбрасываются
+export const useTriggerBacktest = ({
+  definition,
+  days = 7,
+  sampleSize = 5,
+  enabled = true,
+}: UseTriggerBacktestProps) => {
+  const [result, setResult] = useState<TriggerBacktestResponse | null>(null);
+  const [isLoading, setIsLoading] = useState(false);
+  const [error, setError] = useState<string | null>(null);
+  const requestIdRef = useRef(0);
+
+  const definitionKey = JSON.stringify(definition);
+  const debounceDelay = 500;
+
+  useEffect(() => {
+    if (!enabled) return;
+
+    const requestId = ++requestIdRef.current;
+    const timeout = setTimeout(async () => {
+      setIsLoading(true);
+      setError(null);
+      try {
+        const end = new Date();
+        const start = new Date(end.getTime() - days * 24 * 60 * 60 * 1000);
+        const response = await triggersApi.backtest({
+          definitions: [definition],
+          start: start.toISOString(),
+          end: end.toISOString(),
+          sample_size: sampleSize,
+        });
+        if (requestId === requestIdRef.current) {
+          setResult(response.data);
+        }
+      } catch (err: any) {
+        if (requestId === requestIdRef.current) {
+          const detail = err?.response?.data?.detail;
+          setError(typeof detail === 'string' ? detail : 'Не удалось проверить триггер на истории склада');
+        }
+      } finally {
+        if (requestId === requestIdRef.current) {
+          setIsLoading(false);
+        }
+      }
+    }, debounceDelay);
+
+    return () => clearTimeout(timeout);
+    // definition сравнивается по содержимому
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [definitionKey, days, sampleSize, enabled]);
+
+  return {
+    result: result?.results[0] ?? null,
+    response: result,
+    isLoading,
+    error,
+  };
+};
@@ -1,5 +1,5 @@
 import axios from 'axios';
-import { Client, Message, Dossier, CarInterest, Task, DossierManualUpdate, CarInterestManualUpdate, TaskManualUpdate, AdminStats } from '../types';
+import { Client, Message, Dossier, CarInterest, Task, DossierManualUpdate, CarInterestManualUpdate, TaskManualUpdate, AdminStats, TriggerBacktestRequest, TriggerBacktestResponse } from '../types';
 
 // В development используем относительный путь через Vite proxy
 // В production можно использовать переменную окружения
@@ -174,6 +174,8 @@ export const triggersApi = {
     return api.get(`/triggers/${id}/logs?${params.toString()}`);
   },
   getStats: (id: number) => api.get(`/triggers/${id}/stats`),
+  backtest: (request: TriggerBacktestRequest) =>
+    api.post<TriggerBacktestResponse>('/triggers/backtest', request),
 };
 
 export const taskTriggersApi = {
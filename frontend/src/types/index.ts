@@ -296,14 +296,18 @@ export interface TriggerActionConfig {
   headers?: Record<string, string>;
 }
 
+export type TriggerEvent = 'new_match' | 'price_dropped' | 'status_changed' | 'changed' | 'removed';
+
 export interface TriggerBase {
   name: string;
   description?: string;
   status: 'active' | 'inactive' | 'paused';
   conditions: TriggerConditions;
+  events?: TriggerEvent[];
   action_type: 'notify' | 'create_task' | 'send_message' | 'webhook';
   action_config?: TriggerActionConfig;
   check_interval_minutes: number;
+  cooldown_minutes?: number | null;
 }
 
 export interface TriggerCreate extends TriggerBase {}
@@ -313,9 +317,11 @@ export interface TriggerUpdate {
   description?: string;
   status?: 'active' | 'inactive' | 'paused';
   conditions?: TriggerConditions;
+  events?: TriggerEvent[];
   action_type?: 'notify' | 'create_task' | 'send_message' | 'webhook';
   action_config?: TriggerActionConfig;
   check_interval_minutes?: number;
+  cooldown_minutes?: number | null;
 }
 
 export interface Trigger extends TriggerBase {
@@ -325,6 +331,7 @@ export interface Trigger extends TriggerBase {
   last_checked_at?: string;
   last_triggered_at?: string;
   trigger_count: number;
+  triggers_last_30_days: number;
 }
 
 export interface TriggerSummary {
@@ -333,10 +340,56 @@ export interface TriggerSummary {
   status: 'active' | 'inactive' | 'paused';
   action_type: 'notify' | 'create_task' | 'send_message' | 'webhook';
   trigger_count: number;
+  triggers_last_30_days: number;
   last_triggered_at?: string;
   created_at: string;
 }
 
+export interface TriggerBacktestDefinition {
+  name?: string;
+  conditions: TriggerConditions;
+  events?: TriggerEvent[];
+  cooldown_minutes?: number | null;
+}
+
+export interface TriggerBacktestRequest {
+  trigger_ids?: number[];
+  definitions?: TriggerBacktestDefinition[];
+  start?: string;
+  end?: string;
+  sample_size?: number;
+}
+
+export interface TriggerBacktestResult {
+  trigger_id: number | null;
+  name: string | null;
+  events: TriggerEvent[];
+  cooldown_minutes: number;
+  initial_matches: number;
+  would_fire: number;
+  suppressed_by_cooldown: number;
+  cars: number;
+  by_event: Partial<Record<TriggerEvent, number>>;
+  by_day: Record<string, number>;
+  samples: {
+    fired_at: string;
+    events: TriggerEvent[];
+    car: Record<string, any>;
+  }[];
+}
+
+export interface TriggerBacktestResponse {
+  start: string;
+  end: string;
+  history_start: string | null;
+  snapshots: number;
+  transitions: number;
+  car_versions: number;
+  load_seconds: number;
+  evaluate_seconds: number;
+  results: TriggerBacktestResult[];
+}
+
 export interface TaskWithTrigger {
   client_id: number;
   description: string;